@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 
-from app.api.routes import conversation
+from app.api.routes import analytics, conversation, metrics
 
 api_router = APIRouter()
-api_router.include_router(conversation.router)
\ No newline at end of file
+api_router.include_router(conversation.router)
+api_router.include_router(analytics.router)
+api_router.include_router(metrics.router)
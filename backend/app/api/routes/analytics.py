@@ -0,0 +1,49 @@
+from datetime import date
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from app.core.analytics import aggregate_transactions
+from app.core.metrics import stage
+
+router = APIRouter(tags=["analytics"])
+
+GroupKey = Literal["account", "month", "date", "merchant", "category", "amount_bucket", "document"]
+
+
+class AggregateRequest(BaseModel):
+    group_by: List[GroupKey] = []
+    accounts: Optional[List[str]] = None  # last four digits of the account number
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    merchants: Optional[List[str]] = None  # substrings of the merchant name
+    categories: Optional[List[str]] = None
+    amount_buckets: Optional[List[str]] = None  # e.g. "0-10", "100-250", "1000+"
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    side: Optional[Literal["debit", "credit"]] = None
+    limit: Optional[int] = None
+
+
+@router.post("/analytics/aggregate", response_class=JSONResponse)
+async def aggregate(req: AggregateRequest):
+    """
+    Totals across every ingested statement, e.g. monthly dining spend over a year:
+    {"group_by": ["month"], "categories": ["Food & Dining"], "start_date": "2024-01-01"}
+    """
+    try:
+        with stage("analytics", "aggregating"):
+            result = await run_in_threadpool(
+                aggregate_transactions,
+                **req.model_dump(exclude={"group_by", "limit"}),
+                group_by=list(dict.fromkeys(req.group_by)),
+                limit=req.limit,
+            )
+        return JSONResponse(status_code=200, content={"result": result})
+
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return JSONResponse(status_code=500, content={"message": "An error occurred while processing the request."})
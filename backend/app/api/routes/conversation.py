@@ -1,20 +1,28 @@
-from collections import defaultdict
-from typing import Any, List, Optional
-from fastapi import APIRouter, File, UploadFile
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from llama_parse import LlamaParse
+from typing import Dict, List, Optional
+from fastapi import APIRouter, File, Header, Query, UploadFile
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from tabulate import tabulate
 from app.core.config import settings
-from app.core.utils import get_retrieval_qa,get_chat_model,get_retriever,get_custom_prompt,split_markdown,make_retriever,get_markdown_table_as_df,sha256_hash,process_analyzer_response,get_analyzer_prompt,get_analyzer_input,merge_dataframes
-import re
+from app.core.retrieval import get_retriever, make_retriever, use_query_vector
+from app.core.utils import get_retrieval_qa,get_chat_model,get_custom_prompt,split_markdown,get_markdown_path,get_pdf_path,MarkdownFenceStripper,extract_markdown_answer
+from app.core.answers import answer_cache, find_exact_answer, find_similar_answer
+from app.core.ingest import ingest_document, resume_ingestion
+from app.core.http_cache import cache_headers, document_etag, etag_matches, not_modified
+from app.core.insights import get_document_insights, insights_cache_key
+from app.core.transactions import TRANSACTIONS_VERSION, load_transactions, page_transactions
+from app.core.jobs import IngestionInProgressError, ingestion_queue
+from app.core.metrics import LLMMetricsCallback, stage
+from app.core.upstream import UpstreamBusyError
+from app.core.uploads import UploadTooLargeError, discard_upload, stream_upload_to_disk
 import os
-import time
 import pandas as pd
+import pyarrow as pa
 import json
 
 router = APIRouter(tags=["conversation"])
-markdown_dir = "/Users/harishgokul/Finsights/backend/data"
+markdown_dir = settings.data_dir
 
 @router.get("/")
 def read_root():
@@ -22,75 +30,123 @@ def read_root():
         "debug": settings.debug
     }
 
+async def submit_upload(file: UploadFile) -> tuple[int, dict]:
+    """
+    Streams one upload to disk and queues it for ingestion.
+
+    Once the hash is known, duplicates of an ingested document or of a running job
+    are dropped without writing the PDF anywhere.
+    """
+    hash, temp_path = await stream_upload_to_disk(file)
+
+    job = ingestion_queue.get(hash)
+    if (job is None or job.stage == "done") and os.path.exists(get_markdown_path(hash)):
+        print(f"Existing document found with id: {hash}")
+        discard_upload(temp_path)
+        return 200, {"id": hash, "stage": "done"}
+
+    if job is None or job.stage == "failed" or ingestion_queue.abandoned(job):
+        os.replace(temp_path, get_pdf_path(hash))
+    else:
+        discard_upload(temp_path)
+
+    job = ingestion_queue.submit(hash, ingest_document)
+    return 202, {"id": hash, "stage": job.stage}
+
+
 @router.post("/submit", response_class=JSONResponse)
 async def parse_pdf( file: UploadFile = File(...)):
-    time.sleep(3)
-    file_content = await file.read()
-    hash = sha256_hash(file_content) 
-    file_path = f"{markdown_dir}/{hash}.pdf"
-    markdown_file_path = file_path.replace(".pdf",".md")
-    
-    if os.path.exists(markdown_file_path):
-        print(f"Existing document found with id: {hash}")
-        return JSONResponse(content={
-            "id": hash,
-       } )
-    
-    parser = LlamaParse(
-        api_key=settings.llama_cloud_api_key,
-        result_type="markdown",
-        verbose=True,
-        show_progress=True,
-        premium_mode = True,
-    )
-        
-    with open(file_path, "wb") as buffer:
-        buffer.write(file_content)
+    try:
+        status_code, content = await submit_upload(file)
+        return JSONResponse(status_code=status_code, content=content)
 
-    extra_info = {"file_name": hash}
-    documents = await parser.aload_data(file_path, extra_info)
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"message": str(e)})
 
-    os.makedirs(markdown_dir, exist_ok=True)
-    
-    markdown_file_path = os.path.join(markdown_dir, f"{hash}.md")
-    extracted_text = [doc.text_resource.text for doc in documents]
 
-    with open(markdown_file_path, "w", encoding="utf-8") as markdown_file:
-        markdown_file.write("\n\n".join(extracted_text))
+@router.post("/submit/batch", response_class=JSONResponse)
+async def parse_pdf_batch(files: List[UploadFile] = File(...)):
+    """
+    Submits several statements (e.g. a year of monthly PDFs) in one request.
 
-    os.remove(file_path)
-    
-    docs = split_markdown(markdown_file_path)
-    
-    ## adds it to the store.TODO: rename and make interface better
-    
-    make_retriever(hash,{
-        "docs": docs, 
-        "metadata": extra_info
-    }) 
-    
-    return JSONResponse(content={
-        "id": hash,
-    })
+    Uploads are streamed one after another; their ingestion jobs run concurrently on
+    the ingestion queue. Each file gets its own result, so one oversized file does not
+    reject the rest.
+    """
+    if len(files) > settings.max_batch_files:
+        return JSONResponse(status_code=413, content={
+            "message": "At most {} files can be submitted at once".format(settings.max_batch_files)
+        })
+
+    results = []
+    for file in files:
+        try:
+            status_code, content = await submit_upload(file)
+            results.append({"file_name": file.filename, "status": status_code, **content})
+        except UploadTooLargeError as e:
+            results.append({"file_name": file.filename, "status": 413, "message": str(e)})
+
+    return JSONResponse(status_code=202, content={"result": results})
+
+
+@router.get("/jobs/{id}", response_class=JSONResponse)
+async def get_job(id: str):
+    job = resume_ingestion(id)
+    if job is not None:
+        return JSONResponse(content=job.to_dict())
+
+    if os.path.exists(get_markdown_path(id)):
+        return JSONResponse(content={"id": id, "stage": "done", "progress": 1.0, "error": None})
+
+    return JSONResponse(status_code=404, content={"message": "No ingestion job found for id: " + id})
 
 
 class QueryRequest(BaseModel):
     id: str # Unique identifier for a document
     query: str  # The query field that will be passed in the request body
 
+def load_retriever(id: str):
+    retriever, _ = get_retriever(id)
+
+    if retriever is None:
+        # The index may be mid-write in this or another worker; building it again here would race it
+        job = ingestion_queue.get(id)
+        if job is not None and ingestion_queue.running(job):
+            raise IngestionInProgressError(job)
+
+        # Only documents ingested before indexes were persisted end up here
+        print("Markdown found, but no persisted index for id: " + id)
+        docs = split_markdown(get_markdown_path(id))
+        retriever = make_retriever(id, {"docs":docs, "metadata":{"file_name": id}})
+    return retriever
+
+
+def format_source_documents(docs) -> list[str]:
+    return [doc.page_content.strip().replace("\n", " ").replace("\r", " ") for doc in docs]
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/query",response_class=JSONResponse)
 async def get_chat_response(req:QueryRequest):
     try:        
         question = req.query
+        with stage("query", "answer_cache"):
+            cached = find_exact_answer(req.id, question)
+        if cached is not None:
+            return JSONResponse(status_code=200, content=cached)
+
         chat_model = get_chat_model()
-        retriever, _ = get_retriever(req.id)
-        
-        if retriever is None:
-            print("Markdown found, but no retriever for id: " + req.id)
-            file_path = os.path.join(markdown_dir, f"{req.id}.md")
-            docs = split_markdown(file_path)
-            retriever = make_retriever(req.id, {"docs":docs, "metadata":{"file_name": req.id}})
-            print(retriever)
+        with stage("query", "load_retriever"):
+            resume_ingestion(req.id)
+            retriever = await run_in_threadpool(load_retriever, req.id)
+
+        with stage("query", "similar_answer"):
+            cached, vector = await find_similar_answer(req.id, question, retriever)
+        if cached is not None:
+            return JSONResponse(status_code=200, content=cached)
         
         prompt = get_custom_prompt()
         
@@ -100,119 +156,248 @@ async def get_chat_response(req:QueryRequest):
             prompt=prompt
         )
         
-        response = qa.invoke({"query": question})
+        with use_query_vector(question, vector):
+            response = await qa.ainvoke({"query": question}, config={"callbacks": [LLMMetricsCallback("query")]})
         content = response["result"]
-        extracted_markdown = ""
-        match = re.search(r"```markdown\n(.*?)\n```", content, re.DOTALL)
-        if match:
-            extracted_markdown = match.group(1)
-        else:
-            extracted_markdown = content
-        return JSONResponse(
-            status_code=200,
-            content={
-                "result":extracted_markdown,
-                "source_documents": [doc.page_content.strip().replace("\n", " ").replace("\r", " ") for doc in response["source_documents"]]
-            }
-        )
+        extracted_markdown = extract_markdown_answer(content)
+        source_documents = format_source_documents(response["source_documents"])
+        answer_cache.set(req.id, question, vector, extracted_markdown, source_documents)
+        with stage("query", "serializing"):
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "result":extracted_markdown,
+                    "source_documents": source_documents
+                }
+            )
+
+    except IngestionInProgressError as e:
+        return JSONResponse(status_code=409, content={"message": str(e), "stage": e.job.stage})
+
+    except UpstreamBusyError as e:
+        return JSONResponse(status_code=e.status_code, content={"message": str(e)}, headers=e.headers)
     
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return JSONResponse(status_code=500, content={"message": "An error occurred while processing the request."})
 
+@router.post("/query/stream")
+async def stream_chat_response(req:QueryRequest):
+    """
+    Streams the answer as Server-Sent Events.
+
+    The retrieved source snippets are sent first ("sources"), followed by answer
+    tokens with the markdown fence stripped ("token") and a final "done" event,
+    so the first bytes arrive as soon as retrieval finishes.
+    """
+    async def event_stream():
+        try:
+            question = req.query
+            with stage("query_stream", "answer_cache"):
+                cached = find_exact_answer(req.id, question)
+            vector = None
+            if cached is None:
+                with stage("query_stream", "load_retriever"):
+                    resume_ingestion(req.id)
+                    retriever = await run_in_threadpool(load_retriever, req.id)
+                with stage("query_stream", "similar_answer"):
+                    cached, vector = await find_similar_answer(req.id, question, retriever)
+            if cached is not None:
+                yield sse_event("sources", {"source_documents": cached["source_documents"]})
+                yield sse_event("token", {"text": cached["result"]})
+                yield sse_event("done", {"cached": True})
+                return
+
+            callbacks = [LLMMetricsCallback("query_stream")]
+            with use_query_vector(question, vector):
+                docs = await retriever.ainvoke(question, config={"callbacks": callbacks})
+            source_documents = format_source_documents(docs)
+            yield sse_event("sources", {"source_documents": source_documents})
+
+            # Same input the "stuff" chain in get_retrieval_qa builds
+            prompt = get_custom_prompt().format(
+                context="\n\n".join(doc.page_content for doc in docs),
+                question=question,
+            )
+            chat_model = get_chat_model()
+            stripper = MarkdownFenceStripper()
+            answer = []
+            async for chunk in chat_model.astream(prompt, config={"callbacks": callbacks}):
+                text = stripper.feed(chunk.content)
+                if text:
+                    answer.append(text)
+                    yield sse_event("token", {"text": text})
+
+            text = stripper.flush()
+            if text:
+                answer.append(text)
+                yield sse_event("token", {"text": text})
+            answer_cache.set(req.id, question, vector, "".join(answer), source_documents)
+            yield sse_event("done", {})
+
+        except IngestionInProgressError as e:
+            yield sse_event("error", {"message": str(e), "stage": e.job.stage})
+
+        except UpstreamBusyError as e:
+            yield sse_event("error", {"message": str(e), "status": e.status_code, "retry_after": e.retry_after})
+
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            yield sse_event("error", {"message": "An error occurred while processing the request."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 class GetTableRequest(BaseModel):
     id: str # Unique identifier for a document
 
-@router.post("/get_tables",response_class=JSONResponse)
-async def get_tables(req:GetTableRequest):
+class TablePageRequest(GetTableRequest):
+    page: int = Field(1, ge=1)
+    page_size: int = Field(50, ge=1, le=settings.max_table_page_size)
+    sort_by: Optional[str] = None
+    descending: bool = False
+    filters: Dict[str, str] = {}  # column -> case-insensitive substring
+
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def to_columns(df: pd.DataFrame) -> dict:
+    """Column name -> list of values, with missing values as null."""
+    return {col: df[col].astype(object).where(df[col].notna(), None).tolist() for col in df.columns}
+
+
+def to_arrow_stream(df: pd.DataFrame, metadata: dict) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({key: str(value) for key, value in metadata.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+async def table_page_response(req: TablePageRequest, accept: Optional[str], if_none_match: Optional[str]):
+    """
+    One page of the statement's transactions, filtered and sorted on the server.
+
+    The JSON payload is column-oriented ({"columns": [...], "data": {column: values}})
+    with the paging totals alongside. Clients that send `Accept: application/vnd.apache.arrow.stream`
+    get the page as an Arrow IPC stream instead, with the totals in the schema metadata.
+    Pages are immutable for a document hash and table version, so a matching
+    If-None-Match is answered with 304 before the table is even loaded.
+    """
     try:        
-        file_path = f"{markdown_dir}/{req.id}.md"
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                
-        dataframes: dict[Any, pd.DataFrame] = get_markdown_table_as_df(content=content)
-
-        target_columns_pattern = r"(description|transaction|particular)(?!.*date)"
-        date_column_pattern = r"date"
-
-        filtered_dataframes = defaultdict(list)
-
-        for key, df in dataframes.items():
-            lkey = list(key)
-            date_columns = [col for col in lkey if re.search(date_column_pattern, col, re.IGNORECASE)]
-            target_columns = [col for col in lkey if re.search(target_columns_pattern, col, re.IGNORECASE)]
-            
-            if date_columns and target_columns:
-                df = df.reset_index(drop=True)  
-                df.insert(0, "id", range(1, len(df) + 1))
-                df.rename(columns={target_columns[0]: "transaction"}, inplace=True)
-                df.rename(columns={date_columns[0]: "date"}, inplace=True)
-                filtered_dataframes[str(key)] = df
-
-        merged_df = merge_dataframes(filtered_dataframes)
-        print(tabulate(merged_df, headers='keys', tablefmt='pretty'))
-                    
-        return JSONResponse(
-            status_code=200,
-            content={
-                "result": [merged_df.to_json(orient="records")],
-            }
+        arrow = bool(accept and ARROW_STREAM in accept)
+        etag = document_etag(
+            req.id, TRANSACTIONS_VERSION, req.page, req.page_size, req.sort_by, req.descending,
+            sorted(req.filters.items()), "arrow" if arrow else "json",
         )
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, vary="Accept")
+
+        with stage("tables", "loading"):
+            df = await run_in_threadpool(load_transactions, req.id)
+        if df is None:
+            return JSONResponse(status_code=404, content={"message": "No document found for id: " + req.id})
+
+        unknown = [col for col in [req.sort_by, *req.filters] if col and col not in df.columns]
+        if unknown:
+            return JSONResponse(status_code=400, content={
+                "message": "Unknown columns: {}".format(", ".join(unknown)),
+                "columns": list(df.columns),
+            })
+
+        with stage("tables", "paging"):
+            page, total_rows = await run_in_threadpool(
+                page_transactions, df, req.filters, req.sort_by, req.descending,
+                (req.page - 1) * req.page_size, req.page_size,
+            )
+        paging = {
+            "page": req.page,
+            "page_size": req.page_size,
+            "total_rows": total_rows,
+            "total_pages": max(1, -(-total_rows // req.page_size)),
+        }
+
+        if settings.debug:
+            print(tabulate(page, headers='keys', tablefmt='pretty'))
+                    
+        headers = cache_headers(etag, vary="Accept")
+        with stage("tables", "serializing"):
+            if arrow:
+                return Response(content=to_arrow_stream(page, paging), media_type=ARROW_STREAM, headers=headers)
+            return ORJSONResponse(
+                status_code=200,
+                content={"columns": list(page.columns), "data": to_columns(page), **paging},
+                headers=headers,
+            )
     
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return JSONResponse(status_code=500, content={"message": "An error occurred while processing the request."})
+
+
+@router.post("/get_tables",response_class=ORJSONResponse)
+async def get_tables(req:TablePageRequest, accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
+    return await table_page_response(req, accept, if_none_match)
+
+
+@router.get("/documents/{id}/tables", response_class=ORJSONResponse)
+async def get_tables_page(
+    id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=settings.max_table_page_size),
+    sort_by: Optional[str] = None,
+    descending: bool = False,
+    filter: List[str] = Query([], description="column:substring, repeatable"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """GET form of /get_tables, so browsers cache and revalidate pages on their own."""
+    filters = dict(item.split(":", 1) for item in filter if ":" in item)
+    req = TablePageRequest(id=id, page=page, page_size=page_size, sort_by=sort_by, descending=descending, filters=filters)
+    return await table_page_response(req, accept, if_none_match)
     
 
-@router.post("/get_insights", response_class=JSONResponse)
-async def get_insights(req:GetTableRequest):
+async def insights_response(id: str, if_none_match: Optional[str]):
     try:        
-        file_path = f"{markdown_dir}/{req.id}.md"
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                
-        dataframes: dict[Any, pd.DataFrame] = get_markdown_table_as_df(content=content)
-
-        target_columns_pattern = r"(description|transaction|particular)(?!.*date)"
-        date_column_pattern = r"date"
-
-        filtered_dataframes = defaultdict(list)
-
-        for key, df in dataframes.items():
-            lkey = list(key)
-            date_columns = [col for col in lkey if re.search(date_column_pattern, col, re.IGNORECASE)]
-            target_columns = [col for col in lkey if re.search(target_columns_pattern, col, re.IGNORECASE)]
-            
-            if date_columns and target_columns:
-                df = df.reset_index(drop=True)  
-                df.insert(0, "id", range(1, len(df) + 1))
-                df.rename(columns={target_columns[0]: "transaction"}, inplace=True)
-                df.rename(columns={date_columns[0]: "date"}, inplace=True)
-                filtered_dataframes[str(key)] = df
-                
-        table_data = ""
-        merged_df = merge_dataframes(filtered_dataframes)
-        table_data = tabulate(merged_df, headers='keys', tablefmt='pretty')
-                
-        prompt = get_analyzer_prompt()
-        input = get_analyzer_input(table_data)
-        chat_model = get_chat_model()
-        chain = prompt | chat_model
-        message = chain.invoke({"input": input})
-        
-        response = process_analyzer_response(message)
+        # Weak: insights regenerated after their cache entry expires are equivalent, not identical
+        etag = document_etag(id, insights_cache_key(id), weak=True)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        if not os.path.exists(get_markdown_path(id)):
+            return JSONResponse(status_code=404, content={"message": "No document found for id: " + id})
+
+        response = await get_document_insights(id)
         if response is None:
             return JSONResponse(status_code=200, content={"result": "No insights found."})
                     
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=200,
             content={
                 "result":response,
-            }
+            },
+            headers=cache_headers(etag),
         )
+
+    except UpstreamBusyError as e:
+        return JSONResponse(status_code=e.status_code, content={"message": str(e)}, headers=e.headers)
     
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-        return JSONResponse(status_code=500, content={"message": "An error occurred while processing the request."})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"message": "An error occurred while processing the request."})
+
+
+@router.post("/get_insights", response_class=JSONResponse)
+async def get_insights(req:GetTableRequest, if_none_match: Optional[str] = Header(None)):
+    return await insights_response(req.id, if_none_match)
+
+
+@router.get("/documents/{id}/insights", response_class=JSONResponse)
+async def get_document_insights_page(id: str, if_none_match: Optional[str] = Header(None)):
+    """GET form of /get_insights, so browsers cache and revalidate it on their own."""
+    return await insights_response(id, if_none_match)
@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import gauge, render_metrics
+from app.core.upstream import SCHEDULERS
+from app.core.utils import RetrieverCache, existing_client
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of stage latencies, cache hit rates and LLM token counts."""
+    retrievers = RetrieverCache().stats()
+    # A scrape must not create the upstream clients (heavy imports, credentials)
+    embeddings = existing_client("embeddings")
+
+    extra = gauge("finsights_retriever_cache", "Open retriever cache statistics.", [
+        ({"stat": name}, value) for name, value in retrievers.items()
+    ])
+    if embeddings is not None:
+        extra += gauge("finsights_embedding_cache_chunks", "Embedding cache lookups since startup by result.", [
+            ({"result": "hit"}, embeddings.hits),
+            ({"result": "miss"}, embeddings.misses),
+        ])
+    extra += gauge("finsights_upstream", "Upstream scheduler state by backend.", [
+        ({"backend": name, "stat": stat}, value)
+        for name, scheduler in SCHEDULERS.items()
+        for stat, value in scheduler.stats().items()
+    ])
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,215 @@
+import json
+
+import pandas as pd
+from tabulate import tabulate
+
+from app.core.transactions import AMOUNT_SCALE
+
+# Card-network and channel words that prefix merchant names without identifying them
+MERCHANT_NOISE_PATTERN = (
+    r"\b(?:VISA|MASTERCARD|POS|ACH|DEBIT CARD|CHECKCARD|CHECK CARD|PURCHASE|RECURRING|ONLINE|"
+    r"ELECTRONIC|WEB|PPD|CCD|DES|INDN|ID|CO|AUTH|ON)\b"
+)
+
+# Bump whenever the aggregates or the prompt text built from them change, so cached insights are regenerated
+AGGREGATES_VERSION = "2"
+
+# Busiest days listed in the analyzer prompt
+PROMPT_DAY_LIMIT = 10
+
+# Debits to the same merchant whose amounts vary less than this are treated as one recurring charge
+RECURRING_MAX_VARIATION = 0.15
+
+
+def merchant_names(descriptions: pd.Series) -> pd.Series:
+    """Reduces transaction descriptions to a short merchant key (first three meaningful words)."""
+    names = descriptions.astype("string").fillna("").str.upper()
+    names = names.str.replace(MERCHANT_NOISE_PATTERN, " ", regex=True)
+    # Store numbers, card suffixes, reference ids and dates all contain digits
+    names = names.str.replace(r"\S*\d\S*", " ", regex=True)
+    names = names.str.replace(r"[^A-Z&' ]", " ", regex=True)
+    names = names.str.split().str[:3].str.join(" ")
+    return names.where(names.str.len() > 0, "UNKNOWN")
+
+
+def _to_amount(cents) -> float:
+    return round(float(cents) / AMOUNT_SCALE, 2)
+
+
+def summarize_transactions(df: pd.DataFrame) -> dict:
+    """
+    Computes exact statement aggregates locally from the typed transactions table.
+
+    Returns totals and counts, the credit/debit ratio, per-merchant and per-day
+    rollups, and recurring debits. Amounts are decimals rounded to cents.
+    """
+    debits = df["Debit"].fillna(0).astype("int64") if "Debit" in df.columns else pd.Series(0, index=df.index)
+    credits = df["Credit"].fillna(0).astype("int64") if "Credit" in df.columns else pd.Series(0, index=df.index)
+    descriptions = df["transaction"] if "transaction" in df.columns else pd.Series("", index=df.index)
+    dates = df["date"] if "date" in df.columns else pd.Series(pd.NaT, index=df.index)
+
+    frame = pd.DataFrame({
+        "merchant": merchant_names(descriptions),
+        "date": dates,
+        "debit": debits,
+        "credit": credits,
+    })
+    frame["is_debit"] = frame["debit"] > 0
+    frame["is_credit"] = frame["credit"] > 0
+
+    total_debits = int(frame["debit"].sum())
+    total_credits = int(frame["credit"].sum())
+
+    merchants = frame.groupby("merchant").agg(
+        debit_total=("debit", "sum"),
+        debit_count=("is_debit", "sum"),
+        credit_total=("credit", "sum"),
+        credit_count=("is_credit", "sum"),
+        first_date=("date", "min"),
+        last_date=("date", "max"),
+    )
+    merchants["volume"] = merchants["debit_total"] + merchants["credit_total"]
+    merchants = merchants.sort_values("volume", ascending=False)
+
+    days = frame.dropna(subset=["date"]).groupby("date").agg(
+        debit_total=("debit", "sum"),
+        credit_total=("credit", "sum"),
+        count=("merchant", "size"),
+    )
+
+    charges = frame[frame["is_debit"]]
+    recurring = charges.groupby("merchant").agg(
+        count=("debit", "size"),
+        distinct_dates=("date", "nunique"),
+        mean=("debit", "mean"),
+        std=("debit", "std"),
+        first_date=("date", "min"),
+        last_date=("date", "max"),
+    )
+    recurring = recurring[
+        (recurring["count"] >= 2)
+        & (recurring["distinct_dates"] >= 2)
+        & (recurring["std"].fillna(0) <= RECURRING_MAX_VARIATION * recurring["mean"])
+    ]
+
+    return {
+        "totals": {
+            "total_credits": _to_amount(total_credits),
+            "total_debits": _to_amount(total_debits),
+            "credit_count": int(frame["is_credit"].sum()),
+            "debit_count": int(frame["is_debit"].sum()),
+            "transaction_count": len(frame),
+            "net": _to_amount(total_credits - total_debits),
+        },
+        "credit_debit_ratio": {
+            "total_credits": _to_amount(total_credits),
+            "total_debits": _to_amount(total_debits),
+            "ratio": round(total_credits / total_debits, 2) if total_debits else None,
+        },
+        "merchants": [
+            {
+                "merchant": merchant,
+                "debit_total": _to_amount(row.debit_total),
+                "debit_count": int(row.debit_count),
+                "credit_total": _to_amount(row.credit_total),
+                "credit_count": int(row.credit_count),
+                "first_date": _format_date(row.first_date),
+                "last_date": _format_date(row.last_date),
+            }
+            for merchant, row in merchants.iterrows()
+        ],
+        "days": [
+            {
+                "date": _format_date(date),
+                "debit_total": _to_amount(row.debit_total),
+                "credit_total": _to_amount(row.credit_total),
+                "count": int(row["count"]),
+            }
+            for date, row in days.iterrows()
+        ],
+        "recurring": [
+            {
+                "merchant": merchant,
+                "count": int(row["count"]),
+                "typical_amount": _to_amount(row["mean"]),
+                "first_date": _format_date(row.first_date),
+                "last_date": _format_date(row.last_date),
+            }
+            for merchant, row in recurring.iterrows()
+        ],
+    }
+
+
+def _format_date(value) -> str:
+    return value.strftime("%Y-%m-%d") if pd.notna(value) else None
+
+
+def _format_statement_context(summary: dict) -> list[str]:
+    busiest_days = sorted(summary["days"], key=lambda d: d["debit_total"] + d["credit_total"], reverse=True)
+
+    return [
+        "Totals:\n" + json.dumps(summary["totals"]),
+        "Credit/debit ratio:\n" + json.dumps(summary["credit_debit_ratio"]),
+        "Busiest days:\n" + tabulate(busiest_days[:PROMPT_DAY_LIMIT], headers="keys", tablefmt="pipe"),
+        "Recurring debits:\n" + (tabulate(summary["recurring"], headers="keys", tablefmt="pipe") or "None detected"),
+    ]
+
+
+def format_summary_for_prompt(summary: dict) -> str:
+    """
+    Renders the aggregates compactly for the analyzer prompt.
+
+    Rows are merchants and days rather than transactions; statements whose merchant
+    rollup exceeds the prompt budget are split by split_merchants_by_budget instead.
+    """
+    return "\n\n".join([
+        *_format_statement_context(summary),
+        "Per-merchant rollup:\n" + tabulate(summary["merchants"], headers="keys", tablefmt="pipe"),
+    ])
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text and numbers
+    return len(text) // 4 + 1
+
+
+def split_merchants_by_budget(merchants: list[dict], token_budget: int) -> list[list[dict]]:
+    """
+    Splits the merchant rollup into groups whose rendered rows fit within `token_budget`.
+
+    Every transaction of a merchant lands in the same group, so no merchant is
+    categorized twice. A single merchant larger than the budget gets its own group.
+    """
+    groups, current, used = [], [], 0
+    for merchant in merchants:
+        cost = estimate_tokens(tabulate([merchant], tablefmt="pipe"))
+        if current and used + cost > token_budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(merchant)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def format_chunk_for_prompt(summary: dict, merchants: list[dict], part: int, parts: int) -> str:
+    """
+    Renders one merchant group for a map step.
+
+    Every part carries the statement-wide totals, ratio, busiest days and recurring
+    debits, so each map step can reason about the whole statement and not just its merchants.
+    """
+    totals = {
+        "total_credits": round(sum(m["credit_total"] for m in merchants), 2),
+        "total_debits": round(sum(m["debit_total"] for m in merchants), 2),
+        "credit_count": sum(m["credit_count"] for m in merchants),
+        "debit_count": sum(m["debit_count"] for m in merchants),
+    }
+    return "\n\n".join([
+        f"This is part {part} of {parts} of the statement, split by merchant. "
+        "The statement-wide figures below cover every part.",
+        *_format_statement_context(summary),
+        "Totals for this part:\n" + json.dumps(totals),
+        "Per-merchant rollup for this part:\n" + tabulate(merchants, headers="keys", tablefmt="pipe"),
+    ])
@@ -0,0 +1,350 @@
+import fcntl
+import glob
+import os
+import re
+from contextlib import contextmanager
+from datetime import date
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app.core.aggregates import merchant_names
+from app.core.config import settings
+from app.core.transactions import AMOUNT_SCALE, TRANSACTIONS_VERSION, get_transactions_path, load_transactions
+from app.core.utils import get_markdown_path
+
+# Bump whenever the dataset layout or the derived columns change, so it is rebuilt
+ANALYTICS_VERSION = "2"
+
+PARTITION_FILE = "part.parquet"
+PARTITIONING = ds.partitioning(pa.schema([("account", pa.string()), ("month", pa.string())]), flavor="hive")
+
+SCHEMA = pa.schema([
+    ("document", pa.string()),
+    ("date", pa.date32()),
+    ("merchant", pa.string()),
+    ("category", pa.string()),
+    ("description", pa.string()),
+    ("debit", pa.int64()),
+    ("credit", pa.int64()),
+    ("amount", pa.int64()),
+    ("amount_bucket", pa.string()),
+])
+
+# "Account Number: XXXX-XXXX-1234", "Acct # 000123456789", "Account ending in 1234"
+ACCOUNT_PATTERN = re.compile(
+    r"\bACC(?:OUN)?T\b\s*(?:NUMBER|NO\.?|#|ENDING(?:\s+IN)?)?\s*[:#]?\s*([X*\d][X*\d\- ]{3,}\d)",
+    re.IGNORECASE,
+)
+
+# First matching rule wins; matched against the merchant key, then the full description
+CATEGORY_RULES = [
+    ("Income", r"PAYROLL|DIRECT DEP|SALARY|TREASURY|INTEREST PAID|DIVIDEND"),
+    ("Transfers", r"TRANSFER|ZELLE|VENMO|PAYPAL|CASH APP|WIRE"),
+    ("Groceries", r"WHOLE FOODS|TRADER JOE|SAFEWAY|KROGER|ALDI|COSTCO|GROCERY|MARKET"),
+    ("Food & Dining", r"STARBUCKS|COFFEE|CAFE|RESTAURANT|PIZZA|DOORDASH|GRUBHUB|UBER EATS|MCDONALD|CHIPOTLE"),
+    ("Transport", r"UBER|LYFT|SHELL|CHEVRON|EXXON|FUEL|GAS STATION|PARKING|TRANSIT|AIRLINE"),
+    ("Subscriptions", r"NETFLIX|SPOTIFY|HULU|DISNEY|APPLE\.COM|YOUTUBE|PRIME VIDEO"),
+    ("Utilities", r"UTILIT|ELECTRIC|WATER|COMCAST|VERIZON|AT&T|T-MOBILE|INTERNET"),
+    ("Shopping", r"AMAZON|AMZN|TARGET|WALMART|EBAY|BEST BUY"),
+    ("Fees", r"\bFEE\b|OVERDRAFT|SERVICE CHARGE"),
+    ("Refunds", r"REFUND|REVERSAL"),
+]
+
+# Upper bounds in dollars of the absolute transaction amount
+AMOUNT_BUCKET_EDGES = [10, 25, 50, 100, 250, 500, 1000]
+AMOUNT_BUCKETS = (
+    ["0-10"]
+    + [f"{low}-{high}" for low, high in zip(AMOUNT_BUCKET_EDGES, AMOUNT_BUCKET_EDGES[1:])]
+    + [f"{AMOUNT_BUCKET_EDGES[-1]}+"]
+)
+
+GROUP_KEYS = ["account", "month", "date", "merchant", "category", "amount_bucket", "document"]
+
+
+def get_analytics_path() -> str:
+    # Rows are derived from the transactions tables, so a new table version starts a new dataset
+    return os.path.join(settings.data_dir, "analytics", f"v{ANALYTICS_VERSION}.{TRANSACTIONS_VERSION}")
+
+
+def detect_account(markdown: str) -> str:
+    """Last four digits of the account number printed on the statement, or "unknown"."""
+    match = ACCOUNT_PATTERN.search(markdown)
+    digits = re.sub(r"\D", "", match.group(1)) if match else ""
+    return digits[-4:] if len(digits) >= 4 else "unknown"
+
+
+def categorize(merchants: pd.Series, descriptions: pd.Series) -> pd.Series:
+    categories = pd.Series("Other", index=merchants.index, dtype="string")
+    unmatched = pd.Series(True, index=merchants.index)
+    for category, pattern in CATEGORY_RULES:
+        matched = unmatched & (
+            merchants.str.contains(pattern, regex=True, case=False).fillna(False)
+            | descriptions.str.contains(pattern, regex=True, case=False).fillna(False)
+        )
+        categories = categories.where(~matched, category)
+        unmatched &= ~matched
+    return categories
+
+
+def amount_buckets(cents: pd.Series) -> pd.Series:
+    edges = [-1] + [edge * AMOUNT_SCALE for edge in AMOUNT_BUCKET_EDGES] + [float("inf")]
+    return pd.cut(cents.abs(), bins=edges, labels=AMOUNT_BUCKETS, right=False).astype("string")
+
+
+def analytics_rows(id: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Reduces a statement's transactions table to the dataset columns, one row per dated transaction."""
+    index = df.index
+    debits = df["Debit"].fillna(0).astype("int64") if "Debit" in df.columns else pd.Series(0, index=index)
+    credits = df["Credit"].fillna(0).astype("int64") if "Credit" in df.columns else pd.Series(0, index=index)
+    descriptions = df["transaction"].astype("string").fillna("") if "transaction" in df.columns else pd.Series("", index=index, dtype="string")
+    dates = df["date"] if "date" in df.columns else pd.Series(pd.NaT, index=index)
+    merchants = merchant_names(descriptions)
+
+    rows = pd.DataFrame({
+        "document": id,
+        "date": dates.dt.date,
+        "merchant": merchants,
+        "category": categorize(merchants, descriptions),
+        "description": descriptions,
+        "debit": debits,
+        "credit": credits,
+        "amount": credits - debits,
+    })
+    rows["amount_bucket"] = amount_buckets(rows["amount"])
+    # Undated rows (balance lines, totals) cannot be placed in a month partition
+    return rows[dates.notna().values]
+
+
+@contextmanager
+def _dataset_lock():
+    """Serializes writers across worker processes; readers only ever see whole files."""
+    os.makedirs(get_analytics_path(), exist_ok=True)
+    with open(os.path.join(get_analytics_path(), ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _partition_files() -> List[str]:
+    return glob.glob(os.path.join(get_analytics_path(), "account=*", "month=*", PARTITION_FILE))
+
+
+def _write_partition(path: str, table: pa.Table):
+    if table.num_rows == 0:
+        os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _document_parts(id: str) -> dict:
+    """The statement's rows split into the partition files they belong to."""
+    df = load_transactions(id)
+    markdown_path = get_markdown_path(id)
+    if df is None or df.empty or not os.path.exists(markdown_path):
+        return {}
+
+    with open(markdown_path, "r", encoding="utf-8") as f:
+        account = detect_account(f.read())
+
+    rows = analytics_rows(id, df)
+    months = pd.to_datetime(rows["date"]).dt.strftime("%Y-%m")
+    return {
+        os.path.join(get_analytics_path(), f"account={account}", f"month={month}", PARTITION_FILE):
+            pa.Table.from_pandas(part, schema=SCHEMA, preserve_index=False)
+        for month, part in rows.groupby(months.values)
+    }
+
+
+def _holds_documents(path: str, ids: pa.Array) -> bool:
+    # Only the document column is read, so finding the files to rewrite costs a fraction of rewriting them
+    documents = pq.read_table(path, columns=["document"])["document"]
+    return pc.any(pc.is_in(documents, value_set=ids)).as_py()
+
+
+def _replace_documents(ids: List[str], parts: dict):
+    """
+    Swaps the rows of `ids` in every partition for `parts` (path -> list of tables).
+
+    Only the partitions that receive rows or hold rows of `ids` are read in full and
+    rewritten, so replacing a statement costs about as much as the statement.
+    """
+    replaced = pa.array(ids, pa.string())
+    with _dataset_lock():
+        for path in set(_partition_files()) | set(parts):
+            tables = []
+            if os.path.exists(path):
+                if path not in parts and not _holds_documents(path, replaced):
+                    continue
+                existing = pq.read_table(path, schema=SCHEMA)
+                tables.append(existing.filter(pc.invert(pc.is_in(existing["document"], value_set=replaced))))
+            tables += parts.get(path, [])
+            _write_partition(path, pa.concat_tables(tables))
+
+
+def write_analytics(id: str) -> int:
+    """
+    Adds a statement's transactions to the analytics dataset.
+
+    Rows are partitioned by account and month, one compacted file per partition
+    (account=<last 4>/month=<YYYY-MM>/part.parquet), so a query opens a few dozen
+    files however many statements were ingested. The statement's previous rows are
+    dropped first, so re-ingesting it replaces them.
+
+    :return: number of rows written
+    """
+    parts = _document_parts(id)
+    _replace_documents([id], {path: [table] for path, table in parts.items()})
+    count = sum(table.num_rows for table in parts.values())
+    print("Wrote {} analytics rows for id: {}".format(count, id))
+    return count
+
+
+def analytics_documents() -> set:
+    """Hashes of the statements already in the dataset."""
+    documents = set()
+    for path in _partition_files():
+        documents.update(pc.unique(pq.read_table(path, columns=["document"])["document"]).to_pylist())
+    return documents
+
+
+def backfill_analytics() -> int:
+    """
+    Adds statements ingested before the analytics dataset existed (or before its
+    version changed), rewriting each partition once for all of them.
+    """
+    pattern = os.path.join(settings.data_dir, f"*.transactions.v{TRANSACTIONS_VERSION}.parquet")
+    suffix = len(os.path.basename(get_transactions_path("")))
+    present = analytics_documents()
+    ids, parts = [], {}
+    for path in glob.glob(pattern):
+        id = os.path.basename(path)[:-suffix]
+        if id in present:
+            continue
+        for partition, table in _document_parts(id).items():
+            parts.setdefault(partition, []).append(table)
+        ids.append(id)
+
+    if ids:
+        _replace_documents(ids, parts)
+        print("Backfilled {} statements into the analytics dataset".format(len(ids)))
+    return len(ids)
+
+
+def analytics_filter(
+    accounts: Optional[List[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    merchants: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    amount_buckets: Optional[List[str]] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    side: Optional[str] = None,
+) -> Optional[ds.Expression]:
+    """
+    Builds the dataset filter. Account and month conditions prune whole partitions
+    before any file is opened; amounts are absolute values in dollars.
+    """
+    conditions = []
+    if accounts:
+        conditions.append(ds.field("account").isin(accounts))
+    if start_date:
+        conditions.append(ds.field("month") >= start_date.strftime("%Y-%m"))
+        conditions.append(ds.field("date") >= pa.scalar(start_date, pa.date32()))
+    if end_date:
+        conditions.append(ds.field("month") <= end_date.strftime("%Y-%m"))
+        conditions.append(ds.field("date") <= pa.scalar(end_date, pa.date32()))
+    if merchants:
+        matches = [pc.match_substring(ds.field("merchant"), merchant.upper()) for merchant in merchants]
+        conditions.append(_any(matches))
+    if categories:
+        conditions.append(ds.field("category").isin(categories))
+    if amount_buckets:
+        conditions.append(ds.field("amount_bucket").isin(amount_buckets))
+    if min_amount is not None:
+        conditions.append(pc.abs(ds.field("amount")) >= round(min_amount * AMOUNT_SCALE))
+    if max_amount is not None:
+        conditions.append(pc.abs(ds.field("amount")) <= round(max_amount * AMOUNT_SCALE))
+    if side == "debit":
+        conditions.append(ds.field("debit") > 0)
+    elif side == "credit":
+        conditions.append(ds.field("credit") > 0)
+    return _all(conditions)
+
+
+def _any(expressions: list) -> ds.Expression:
+    result = expressions[0]
+    for expression in expressions[1:]:
+        result = result | expression
+    return result
+
+
+def _all(expressions: list) -> Optional[ds.Expression]:
+    if not expressions:
+        return None
+    result = expressions[0]
+    for expression in expressions[1:]:
+        result = result & expression
+    return result
+
+
+def aggregate_transactions(group_by: List[str], limit: Optional[int] = None, **filters) -> List[dict]:
+    """
+    Filtered aggregation over every ingested statement.
+
+    Rows are grouped by `group_by` (any of GROUP_KEYS; none gives one overall row)
+    and carry the transaction count and debit/credit/net totals in dollars, largest
+    volume first.
+    """
+    path = get_analytics_path()
+    if not os.path.isdir(path):
+        return []
+
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    table = dataset.to_table(
+        columns=list(dict.fromkeys(group_by + ["debit", "credit", "amount"])),
+        filter=analytics_filter(**filters),
+    )
+
+    if group_by:
+        grouped = table.group_by(group_by).aggregate([
+            ("amount", "count"), ("debit", "sum"), ("credit", "sum"),
+        ])
+        frame = grouped.to_pandas().rename(columns={
+            "amount_count": "transactions", "debit_sum": "debit", "credit_sum": "credit",
+        })
+    else:
+        frame = pd.DataFrame([{
+            "transactions": table.num_rows,
+            "debit": pc.sum(table["debit"]).as_py() or 0,
+            "credit": pc.sum(table["credit"]).as_py() or 0,
+        }])
+
+    frame = frame.assign(volume=frame["debit"] + frame["credit"]).sort_values("volume", ascending=False)
+    if limit:
+        frame = frame.head(limit)
+
+    result = []
+    for row in frame.itertuples(index=False):
+        item = {key: _format_key(getattr(row, key)) for key in group_by}
+        item.update({
+            "count": int(row.transactions),
+            "debit_total": round(row.debit / AMOUNT_SCALE, 2),
+            "credit_total": round(row.credit / AMOUNT_SCALE, 2),
+            "net": round((row.credit - row.debit) / AMOUNT_SCALE, 2),
+        })
+        result.append(item)
+    return result
+
+
+def _format_key(value):
+    return value.isoformat() if isinstance(value, date) else value
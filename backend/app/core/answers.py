@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import record_cache
+from app.core.retrieval import parse_transaction_filters, tokenize
+from app.core.utils import CHAT_MODEL_NAME, QA_PROMPT_VERSION, get_embedding_model
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases and strips punctuation, so "Total spending?" and "total spending" match exactly."""
+    return " ".join(tokenize(unicodedata.normalize("NFKC", question)))
+
+
+def question_signature(question: str) -> str:
+    """
+    The parts of a question that must match exactly for a near-duplicate to reuse an answer.
+
+    "debits over $500" and "debits over $600" embed almost identically but want different rows,
+    so the parsed filters and every number in the question are compared as well.
+    """
+    filters = parse_transaction_filters(question)
+    numbers = sorted(term for term in tokenize(question) if term.isdigit())
+    return json.dumps({"filters": filters, "numbers": numbers}, sort_keys=True, default=str)
+
+
+class AnswerCache:
+    """
+    Per-document cache of QA answers on SQLite.
+
+    Entries are scoped by document hash, QA prompt version and chat model, so a new
+    prompt or model never serves stale answers. A question hits on its normalized text,
+    or on a stored question whose embedding is at least `threshold` cosine-similar and
+    whose signature (filters and numbers) is identical.
+    """
+
+    def __init__(self, path: str, threshold: float, ttl: float, max_entries: int):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(scope TEXT, question TEXT, signature TEXT, vector BLOB, result TEXT, sources TEXT, "
+                "created_at REAL, PRIMARY KEY (scope, question))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def scope(id: str) -> str:
+        return f"{id}:{QA_PROMPT_VERSION}:{CHAT_MODEL_NAME}"
+
+    def get_exact(self, id: str, question: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result, sources FROM answers WHERE scope = ? AND question = ? AND created_at >= ?",
+                (self.scope(id), normalize_question(question), time.time() - self.ttl),
+            ).fetchone()
+        return self._to_answer(row)
+
+    def get_similar(self, id: str, question: str, vector: List[float]) -> Optional[dict]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT vector, result, sources FROM answers "
+                "WHERE scope = ? AND signature = ? AND vector IS NOT NULL AND created_at >= ?",
+                (self.scope(id), question_signature(question), time.time() - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+
+        matrix = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+        query = np.asarray(vector, dtype=np.float32)
+        similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        print("Near-duplicate question matched with similarity {:.3f}".format(similarities[best]))
+        return self._to_answer(rows[best][1:])
+
+    def set(self, id: str, question: str, vector: Optional[List[float]], result: str, sources: List[str]):
+        """Stores an answer; without a `vector` it can only ever be served as an exact match."""
+        scope = self.scope(id)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    scope,
+                    normalize_question(question),
+                    question_signature(question),
+                    np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None,
+                    result,
+                    json.dumps(sources),
+                    now,
+                ),
+            )
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM answers WHERE scope = ? AND question IN "
+                "(SELECT question FROM answers WHERE scope = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (scope, scope, self.max_entries),
+            )
+
+    def invalidate(self, id: str):
+        """Drops every cached answer for a document, across prompt versions and models."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE scope LIKE ?", (f"{id}:%",))
+
+    @staticmethod
+    def _to_answer(row) -> Optional[dict]:
+        if row is None:
+            return None
+        return {"result": row[0], "source_documents": json.loads(row[1])}
+
+
+answer_cache = AnswerCache(
+    os.path.join(settings.data_dir, "answers.sqlite3"),
+    threshold=settings.answer_cache_similarity_threshold,
+    ttl=settings.answer_cache_ttl,
+    max_entries=settings.answer_cache_max_entries_per_document,
+)
+
+
+def find_exact_answer(id: str, question: str) -> Optional[dict]:
+    """Looks a question up by its normalized text, without touching the embedding model."""
+    answer = answer_cache.get_exact(id, question)
+    if answer is not None:
+        print("Serving cached answer for id: {}".format(id))
+        record_cache("answers", True)
+    return answer
+
+
+async def find_similar_answer(id: str, question: str, retriever) -> tuple[Optional[dict], Optional[List[float]]]:
+    """
+    Looks an exact-match miss up among near-duplicate questions.
+
+    Only questions the retriever answers with vector search are embedded; filter and
+    keyword questions never reach the embedding model and just miss. The vector is
+    returned too, so retrieval can reuse it (use_query_vector) and a miss can be stored with it.
+    """
+    if not retriever.uses_vector_search(question):
+        record_cache("answers", False)
+        return None, None
+
+    vector = await get_embedding_model().aembed_query(question)
+    answer = answer_cache.get_similar(id, question, vector)
+    if answer is not None:
+        print("Serving cached answer for id: {}".format(id))
+    record_cache("answers", answer is not None)
+    return answer, vector
@@ -10,6 +10,47 @@ class Settings(BaseSettings):
     google_application_credentials: str 
     google_cloud_project: str
     api_v1_str: str
+    data_dir: str = "data"
+    embedding_model: str = "text-embedding-005"
+    embedding_batch_size: int = 64
+    ingest_workers: int = 2
+    ingest_lease_seconds: int = 300
+    document_store: str = "sqlite"
+    web_concurrency: int = 1
+    retriever_cache_max_bytes: int = 512 * 1024 * 1024
+    insights_chunk_token_budget: int = 4000
+    insights_map_concurrency: int = 4
+    insights_cache_ttl: int = 30 * 24 * 3600
+    insights_cache_max_entries: int = 1000
+    answer_cache_similarity_threshold: float = 0.95
+    answer_cache_ttl: int = 7 * 24 * 3600
+    answer_cache_max_entries_per_document: int = 200
+    max_upload_bytes: int = 50 * 1024 * 1024
+    upload_chunk_size: int = 1024 * 1024
+    max_batch_files: int = 24
+    max_table_page_size: int = 500
+    compression_minimum_size: int = 1024
+    pdf_parser: str = "llama"
+    parse_concurrency: int = 4
+    parse_pages_per_range: int = 1
+    text_layer_fast_path: bool = True
+    text_layer_min_confidence: float = 0.9
+    nltk_data_dir: str = "nltk_data"
+    prewarm_on_startup: bool = True
+    prewarm_indexes: int = 5
+    # Upstream budgets for the whole deployment, split evenly across the web_concurrency workers
+    upstream_chat_concurrency: int = 8
+    upstream_chat_tokens_per_minute: int = 1_000_000
+    upstream_chat_output_tokens: int = 1024
+    upstream_embedding_concurrency: int = 4
+    upstream_embedding_tokens_per_minute: int = 1_000_000
+    upstream_parser_concurrency: int = 4
+    upstream_parser_pages_per_minute: int = 600
+    upstream_interactive_reserve: int = 2
+    upstream_max_retries: int = 4
+    upstream_backoff_base: float = 0.5
+    upstream_backoff_max: float = 30.0
+    upstream_queue_timeout: float = 30.0
     
     class Config:
         env_file = "././.env"
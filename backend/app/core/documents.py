@@ -0,0 +1,98 @@
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from app.core.config import settings
+
+# Identifies this worker process as the owner of the ingestions it claims
+WORKER_ID = "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class DocumentStore(ABC):
+    """
+    Document records shared by every worker process: ingestion stage, progress and
+    error, keyed by document hash.
+
+    Vectors, metadata, pages and transactions are already on disk under data_dir;
+    this is what lets any worker see and coordinate the ingestions the others run.
+    """
+
+    @abstractmethod
+    def get(self, id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def claim(self, id: str, owner: str, lease: float) -> bool:
+        """
+        Atomically makes `owner` the one worker ingesting `id`.
+
+        Succeeds for new or failed documents, and for documents whose owner stopped
+        renewing its lease (e.g. the worker was killed mid-ingestion).
+        """
+
+    @abstractmethod
+    def update(self, id: str, **fields):
+        """Writes stage/progress/error and renews the owner's lease."""
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """DocumentStore on a SQLite file in WAL mode, shared by the workers on one host."""
+
+    COLUMNS = ("stage", "progress", "error")
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, stage TEXT, progress REAL, "
+                "error TEXT, owner TEXT, created_at REAL, updated_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM documents WHERE id = ?", (id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, id: str, owner: str, lease: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            # One statement, so two workers racing for the same document cannot both win
+            cursor = conn.execute(
+                "INSERT INTO documents (id, stage, progress, error, owner, created_at, updated_at) "
+                "VALUES (?, 'queued', 0, NULL, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET stage = 'queued', progress = 0, error = NULL, "
+                "owner = excluded.owner, created_at = excluded.created_at, updated_at = excluded.updated_at "
+                "WHERE documents.stage = 'failed' OR (documents.stage != 'done' AND documents.updated_at < ?)",
+                (id, owner, now, now, now - lease),
+            )
+            return cursor.rowcount == 1
+
+    def update(self, id: str, **fields):
+        fields = {key: value for key, value in fields.items() if key in self.COLUMNS}
+        assignments = "".join(f"{key} = ?, " for key in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE documents SET {assignments}updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), id),
+            )
+
+
+DOCUMENT_STORES = {
+    "sqlite": lambda: SQLiteDocumentStore(os.path.join(settings.data_dir, "documents.sqlite3")),
+}
+
+
+def get_document_store() -> DocumentStore:
+    return DOCUMENT_STORES[settings.document_store]()
+
+
+document_store = get_document_store()
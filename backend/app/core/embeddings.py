@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_chunk(text: str) -> str:
+    """Collapse whitespace and unicode variants so re-parsed boilerplate hashes the same."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def chunk_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{normalize_chunk(text)}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent chunk-level cache.
+
+    Vectors are stored in a SQLite file keyed by (model name, normalized chunk hash),
+    so boilerplate and recurring transaction lines are only embedded once across
+    statements. Cache misses are de-duplicated and sent to the underlying model
+    in batches of at most `batch_size` texts.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str, batch_size: int = 64):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The instance is shared across ingestion threads, so per-call stats are thread-local
+        self._last = threading.local()
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._connect() as conn:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items: List[tuple[str, List[float]]]):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                [(key, self.model_name, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+
+    @property
+    def last_hits(self) -> int:
+        return getattr(self._last, "hits", 0)
+
+    @property
+    def last_misses(self) -> int:
+        return getattr(self._last, "misses", 0)
+
+    @property
+    def last_hit_ratio(self) -> float:
+        total = self.last_hits + self.last_misses
+        return self.last_hits / total if total else 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [chunk_key(self.model_name, text) for text in texts]
+        with self._lock:
+            vectors = self._lookup(list(set(keys)))
+
+        # Texts that normalize to the same chunk are embedded once
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in pending:
+                pending[key] = text
+
+        hits = sum(1 for key in keys if key in vectors)
+        self._last.hits, self._last.misses = hits, len(keys) - hits
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        pending_items = list(pending.items())
+        for start in range(0, len(pending_items), self.batch_size):
+            batch = pending_items[start:start + self.batch_size]
+            embedded = self.embeddings.embed_documents([text for _, text in batch])
+            # Round-trip through float32 so fresh and cached vectors are identical
+            new_items = [
+                (key, np.asarray(vector, dtype=np.float32).tolist()) for (key, _), vector in zip(batch, embedded)
+            ]
+            with self._lock:
+                self._store(new_items)
+            vectors.update(new_items)
+
+        print("Embedding cache: {} hits, {} misses ({:.0%} hit ratio)".format(
+            self.last_hits, self.last_misses, self.last_hit_ratio))
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query embeddings use a different task type upstream, so they bypass the chunk cache
+        return self.embeddings.embed_query(text)
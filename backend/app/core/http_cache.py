@@ -0,0 +1,67 @@
+import hashlib
+import re
+from typing import Optional
+
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+
+# Results are addressed by document hash and pipeline version, so they never change in place.
+# "private" keeps statements out of shared proxies.
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+# Server-Sent Events routes; compressing them would hold streamed tokens back in a buffer
+STREAMING_ROUTES = [r".*/query/stream$"]
+
+
+def document_etag(id: str, version: str, *parts, weak: bool = False) -> str:
+    """
+    ETag for a document result: the document hash, the version of the pipeline that
+    produced it and whatever else selects the representation (page, sort, format...).
+
+    Pass `weak` for results that are equivalent but not byte-identical when rebuilt
+    (e.g. LLM output regenerated after its cache entry expired).
+    """
+    key = "\0".join([id, version, *(str(part) for part in parts)])
+    tag = '"{}"'.format(hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+    return "W/" + tag if weak else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored on both sides."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def cache_headers(etag: str, vary: Optional[str] = None) -> dict:
+    """Validator and caching headers; a 304 must repeat the ones its 200 sent, Vary included."""
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if vary:
+        headers["Vary"] = vary
+    return headers
+
+
+def not_modified(etag: str, vary: Optional[str] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, vary))
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that passes the STREAMING_ROUTES through uncompressed.
+
+    Starlette only skips text/event-stream responses itself in releases newer than
+    the one pinned in requirements.txt.
+    """
+
+    def __init__(self, app, excluded_routes=STREAMING_ROUTES, **kwargs):
+        super().__init__(app, **kwargs)
+        self.excluded_routes = [re.compile(route) for route in excluded_routes]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(route.match(scope["path"]) for route in self.excluded_routes):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
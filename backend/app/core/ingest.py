@@ -0,0 +1,71 @@
+import os
+from typing import Optional
+
+from app.core.analytics import write_analytics
+from app.core.answers import answer_cache
+from app.core.jobs import Job, ingestion_queue
+from app.core.metrics import stage
+from app.core.parsing import parse_statement_pdf
+from app.core.transactions import materialize_transactions
+from app.core.retrieval import make_retriever
+from app.core.upstream import Priority, current_priority
+from app.core.utils import get_markdown_path, get_pdf_path, split_markdown
+
+
+async def ingest_document(job: Job):
+    """Parse -> split -> embed pipeline for an uploaded PDF already written to disk."""
+    hash = job.id
+    file_path = get_pdf_path(hash)
+    markdown_file_path = get_markdown_path(hash)
+    extra_info = {"file_name": hash}
+    # Runs in its own task, so only this pipeline's upstream calls drop to batch priority
+    current_priority.set(Priority.BATCH)
+
+    job.update("parsing", 0.1)
+    # A resumed job whose PDF was already parsed (and removed) picks up after parsing
+    if os.path.exists(file_path) or not os.path.exists(markdown_file_path):
+        with stage("ingest", "parsing", document=hash):
+            extracted_text = await parse_statement_pdf(file_path, hash, run_blocking=ingestion_queue.run_blocking)
+
+            # Write then rename, so readers never see a half-written statement
+            with open(markdown_file_path + ".tmp", "w", encoding="utf-8") as markdown_file:
+                markdown_file.write(extracted_text)
+            os.replace(markdown_file_path + ".tmp", markdown_file_path)
+            os.remove(file_path)
+
+    job.update("tabulating", 0.5)
+    with stage("ingest", "tabulating", document=hash):
+        await ingestion_queue.run_blocking(materialize_transactions, hash)
+        await ingestion_queue.run_blocking(write_analytics, hash)
+
+    job.update("splitting", 0.6)
+    with stage("ingest", "splitting", document=hash):
+        docs = await ingestion_queue.run_blocking(split_markdown, markdown_file_path)
+
+    job.update("embedding", 0.7)
+    with stage("ingest", "embedding", document=hash):
+        # A rebuilt index can retrieve different sources, so earlier answers no longer apply
+        answer_cache.invalidate(hash)
+        await ingestion_queue.run_blocking(make_retriever, hash, {
+            "docs": docs,
+            "metadata": extra_info
+        })
+
+
+def resume_ingestion(id: str) -> Optional[Job]:
+    """
+    Returns the ingestion job for `id`, first taking over the job if the worker that
+    ran it died or restarted.
+
+    An abandoned job is resumed when its PDF or parsed statement is still on disk, and
+    marked failed otherwise, so clients waiting on it are told to upload again instead
+    of polling forever. Must be called on the event loop.
+    """
+    job = ingestion_queue.get(id)
+    if job is None or not ingestion_queue.abandoned(job):
+        return job
+
+    if os.path.exists(get_pdf_path(id)) or os.path.exists(get_markdown_path(id)):
+        print("Resuming abandoned ingestion of id: {}".format(id))
+        return ingestion_queue.submit(id, ingest_document)
+    return ingestion_queue.fail_abandoned(job, "Ingestion was interrupted, please upload the statement again")
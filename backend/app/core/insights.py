@@ -0,0 +1,158 @@
+import asyncio
+import os
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.aggregates import (
+    AGGREGATES_VERSION,
+    format_chunk_for_prompt,
+    format_summary_for_prompt,
+    split_merchants_by_budget,
+    summarize_transactions,
+)
+from app.core.cache import PersistentCache, SingleFlight
+from app.core.config import settings
+from app.core.metrics import LLMMetricsCallback, record_cache, stage
+from app.core.transactions import TRANSACTIONS_VERSION, load_transactions
+from app.core.upstream import Priority, priority
+from app.core.utils import (
+    ANALYZER_PROMPT_VERSION,
+    CHAT_MODEL_NAME,
+    get_analyzer_input,
+    get_analyzer_prompt,
+    get_chat_model,
+    process_analyzer_response,
+)
+
+insights_cache = PersistentCache(
+    os.path.join(settings.data_dir, "insights.sqlite3"),
+    ttl=settings.insights_cache_ttl,
+    max_entries=settings.insights_cache_max_entries,
+)
+insights_flight = SingleFlight()
+
+
+def insights_cache_key(id: str) -> str:
+    # Statements are immutable per hash, so only the table extraction, the aggregates, the prompt
+    # and the model can change the answer
+    return f"{id}:{TRANSACTIONS_VERSION}:{AGGREGATES_VERSION}:{ANALYZER_PROMPT_VERSION}:{CHAT_MODEL_NAME}"
+
+
+def apply_exact_totals(response: dict, summary: dict):
+    """Replaces the totals and ratio the model echoes back with the locally computed ones."""
+    result = response.get("result") if isinstance(response, dict) else None
+    if not isinstance(result, dict):
+        return
+    trends = result.setdefault("trends", {})
+    if isinstance(trends, dict):
+        trends["credit_debit_ratio"] = summary["credit_debit_ratio"]
+    result["totals"] = summary["totals"]
+
+
+async def analyze(aggregates: str) -> Optional[dict]:
+    prompt = get_analyzer_prompt()
+    input = get_analyzer_input(aggregates)
+    chat_model = get_chat_model()
+    chain = prompt | chat_model
+    message = await chain.ainvoke({"input": input}, config={"callbacks": [LLMMetricsCallback("insights")]})
+    return process_analyzer_response(message)
+
+
+def merge_partial_insights(partials: list[dict]) -> dict:
+    """
+    Reduces the map results into a single insights response.
+
+    Credits and debits are merged by category (amounts and counts summed), and
+    each trend keeps the distinct observations from every part.
+    """
+    merged = {"credits": {}, "debits": {}}
+    trends = {}
+    for partial in partials:
+        result = partial.get("result", partial) if isinstance(partial, dict) else {}
+        for side in ("credits", "debits"):
+            for entry in result.get(side) or []:
+                key = str(entry.get("category", "Other")).strip().lower()
+                current = merged[side].setdefault(key, {
+                    "category": entry.get("category", "Other"),
+                    "description": [],
+                    "total_amount": 0.0,
+                    "transaction_count": 0,
+                    "notes": [],
+                })
+                current["total_amount"] += float(entry.get("total_amount") or 0)
+                current["transaction_count"] += int(entry.get("transaction_count") or 0)
+                for field in ("description", "notes"):
+                    if entry.get(field) and entry[field] not in current[field]:
+                        current[field].append(entry[field])
+
+        for name, value in (result.get("trends") or {}).items():
+            if isinstance(value, str) and value not in trends.setdefault(name, []):
+                trends[name].append(value)
+
+    response = {"result": {}}
+    for side in ("credits", "debits"):
+        entries = sorted(merged[side].values(), key=lambda e: e["total_amount"], reverse=True)
+        for entry in entries:
+            entry["total_amount"] = round(entry["total_amount"], 2)
+            entry["description"] = "; ".join(entry["description"])
+            entry["notes"] = "; ".join(entry["notes"])
+        response["result"][side] = entries
+    response["result"]["trends"] = {name: " ".join(values) for name, values in trends.items()}
+    return response
+
+
+async def map_reduce_insights(summary: dict, groups: list[list[dict]]) -> Optional[dict]:
+    """Analyzes each merchant group concurrently (bounded) and merges the partial results."""
+    semaphore = asyncio.Semaphore(settings.insights_map_concurrency)
+
+    async def analyze_group(part: int, merchants: list[dict]):
+        async with semaphore:
+            return await analyze(format_chunk_for_prompt(summary, merchants, part, len(groups)))
+
+    print("Analyzing {} merchant groups for insights".format(len(groups)))
+    partials = await asyncio.gather(*[analyze_group(part, merchants) for part, merchants in enumerate(groups, 1)])
+    partials = [partial for partial in partials if partial is not None]
+    if not partials:
+        return None
+    return merge_partial_insights(partials)
+
+
+async def compute_insights(id: str) -> Optional[dict]:
+    with stage("insights", "loading"):
+        merged_df = await run_in_threadpool(load_transactions, id)
+    if merged_df is None:
+        return None
+
+    with stage("insights", "aggregating"):
+        summary = summarize_transactions(merged_df)
+
+    # Statements too large for one prompt are analyzed in merchant groups (map) and merged (reduce)
+    groups = split_merchants_by_budget(summary["merchants"], settings.insights_chunk_token_budget)
+    if len(groups) > 1:
+        response = await map_reduce_insights(summary, groups)
+    else:
+        response = await analyze(format_summary_for_prompt(summary))
+
+    if response is not None:
+        apply_exact_totals(response, summary)
+        insights_cache.set(insights_cache_key(id), response)
+    return response
+
+
+async def get_document_insights(id: str) -> Optional[dict]:
+    """
+    Returns the LLM insights for a document, computing them at most once.
+
+    Results are served from the persistent cache; concurrent misses for the same
+    document share one upstream generation, which yields to interactive chat.
+    """
+    key = insights_cache_key(id)
+    cached = insights_cache.get(key)
+    record_cache("insights", cached is not None)
+    if cached is not None:
+        print("Serving cached insights for id: {}".format(id))
+        return cached
+
+    with priority(Priority.BACKGROUND):
+        return await insights_flight.do(key, lambda: compute_insights(id))
@@ -0,0 +1,167 @@
+import asyncio
+import contextvars
+import functools
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from app.core.config import settings
+from app.core.documents import WORKER_ID, DocumentStore, document_store
+
+
+class IngestionInProgressError(Exception):
+    def __init__(self, job: "Job"):
+        super().__init__("Document {} is still being ingested ({})".format(job.id, job.stage))
+        self.job = job
+
+
+class Job:
+    """Tracks the stage and progress of one document moving through ingestion."""
+
+    def __init__(self, id: str, store: Optional[DocumentStore] = None):
+        self.id = id
+        self.stage = "queued"
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.task: Optional[asyncio.Task] = None
+        self.store = store
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        """A read-only view of a job another worker process is running (or ran)."""
+        job = cls(record["id"])
+        job.stage = record["stage"]
+        job.progress = record["progress"]
+        job.error = record["error"]
+        job.created_at = record["created_at"]
+        job.updated_at = record["updated_at"]
+        return job
+
+    def update(self, stage: str, progress: float):
+        self.stage = stage
+        self.progress = progress
+        self.updated_at = time.time()
+        if self.store is not None:
+            self.store.update(self.id, stage=stage, progress=progress, error=self.error)
+        print("Job {} -> {} ({:.0%})".format(self.id, stage, progress))
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobQueue:
+    """
+    Runs ingestion pipelines in the background on a bounded pool.
+
+    At most `max_workers` pipelines run at once; the rest wait in the "queued" stage.
+    Blocking stages (splitting, embedding) are pushed onto a thread pool of the same
+    size so they never stall the event loop. Jobs are keyed by document hash, so a
+    duplicate upload attaches to the job that is already running.
+
+    Job state is written through to the shared document store. A document is only
+    ingested by the worker that claims it there; the other workers report that job's
+    progress, and pick it up again if its owner stops renewing the `lease`.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 1000,
+                 store: Optional[DocumentStore] = None, lease: float = 300):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.store = store
+        self.lease = lease
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def get(self, id: str) -> Optional[Job]:
+        job = self.jobs.get(id)
+        if job is not None or self.store is None:
+            return job
+        record = self.store.get(id)
+        return Job.from_record(record) if record is not None else None
+
+    def submit(self, id: str, pipeline: Callable[[Job], Awaitable[None]]) -> Job:
+        job = self.jobs.get(id)
+        if job is not None and job.stage != "failed":
+            print("Attaching to existing ingestion job for id: {}".format(id))
+            return job
+
+        if self.store is not None and not self.store.claim(id, WORKER_ID, self.lease):
+            print("Ingestion of id {} is owned by another worker".format(id))
+            return Job.from_record(self.store.get(id))
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        job = Job(id, store=self.store)
+        self.jobs[id] = job
+        self.jobs.move_to_end(id)
+        job.task = asyncio.create_task(self._run(job, pipeline))
+        self._evict_finished()
+        return job
+
+    def abandoned(self, job: Job) -> bool:
+        """A job another worker was running but stopped renewing, which the next submit takes over."""
+        return job.task is None and not job.finished and time.time() - job.updated_at > self.lease
+
+    def running(self, job: Job) -> bool:
+        """Whether a worker is still making progress on the job."""
+        return not job.finished and not self.abandoned(job)
+
+    def fail_abandoned(self, job: Job, error: str) -> Job:
+        """Records an abandoned job as failed, so clients stop waiting and upload the statement again."""
+        if self.store.claim(job.id, WORKER_ID, self.lease):
+            self.store.update(job.id, stage="failed", progress=job.progress, error=error)
+            print("Marked abandoned ingestion of id {} as failed".format(job.id))
+        return self.get(job.id)
+
+    async def run_blocking(self, fn, *args):
+        # Carries context variables (e.g. the upstream priority) over to the pool thread
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(contextvars.copy_context().run, fn, *args))
+
+    async def _run(self, job: Job, pipeline: Callable[[Job], Awaitable[None]]):
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if self.store is not None else None
+        try:
+            async with self._semaphore:
+                try:
+                    await pipeline(job)
+                    job.update("done", 1.0)
+                except Exception as e:
+                    job.error = str(e)
+                    job.update("failed", job.progress)
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, job: Job):
+        """Renews the claim while a long stage (or the wait for a slot) runs."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self.store.update, job.id)
+
+    def _evict_finished(self):
+        finished = [id for id, job in self.jobs.items() if job.finished]
+        for id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[id]
+
+
+ingestion_queue = JobQueue(
+    max_workers=settings.ingest_workers,
+    store=document_store,
+    lease=settings.ingest_lease_seconds,
+)
@@ -0,0 +1,172 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from opentelemetry import trace
+
+tracer = trace.get_tracer("finsights")
+
+# Seconds; spans everything from a cache lookup to a multi-minute parse
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> LabelValues:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"')) for key, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counts, total = self.values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key][1] = total + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', str(bound)),))} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram("finsights_stage_seconds", "Time spent per pipeline stage.")
+http_request_seconds = Histogram("finsights_http_request_seconds", "HTTP request latency by route.")
+cache_requests = Counter("finsights_cache_requests_total", "Cache lookups by cache and result (hit/miss).")
+llm_calls = Counter("finsights_llm_calls_total", "LLM calls by call site.")
+llm_tokens = Counter("finsights_llm_tokens_total", "LLM tokens by call site and kind (input/output).")
+pages_parsed = Counter("finsights_pages_parsed_total", "Statement pages by source (cache/text_layer/parser).")
+upstream_requests = Counter("finsights_upstream_requests_total", "Upstream calls by backend and result (ok/retried/exhausted/rejected/failed).")
+
+METRICS = [stage_seconds, http_request_seconds, cache_requests, llm_calls, llm_tokens, pages_parsed, upstream_requests]
+
+
+@contextmanager
+def stage(pipeline: str, name: str, **attributes):
+    """Times one pipeline stage as an OpenTelemetry span and in finsights_stage_seconds."""
+    start = time.perf_counter()
+    with tracer.start_as_current_span(f"{pipeline}.{name}", attributes=attributes):
+        try:
+            yield
+        finally:
+            stage_seconds.observe(time.perf_counter() - start, pipeline=pipeline, stage=name)
+
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_usage(call: str, usage: dict):
+    llm_calls.inc(call=call)
+    if usage:
+        llm_tokens.inc(usage.get("input_tokens", 0), call=call, kind="input")
+        llm_tokens.inc(usage.get("output_tokens", 0), call=call, kind="output")
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Records latency and token usage of every LLM call and retrieval made in a chain.
+
+    Pass it in the `callbacks` config of ainvoke/astream; `call` labels the call site.
+    """
+
+    run_inline = True
+
+    def __init__(self, call: str):
+        self.call = call
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            stage_seconds.observe(time.perf_counter() - start, pipeline=self.call, stage="llm")
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                for kind, value in (getattr(message, "usage_metadata", None) or {}).items():
+                    if isinstance(value, int):
+                        usage[kind] = usage.get(kind, 0) + value
+        record_usage(self.call, usage)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._started.pop(run_id, None)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            stage_seconds.observe(time.perf_counter() - start, pipeline=self.call, stage="retrieval")
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs):
+        self._started.pop(run_id, None)
+
+
+def gauge(name: str, help: str, samples: List[Tuple[dict, float]]) -> List[str]:
+    """Renders a gauge from values read at scrape time (e.g. stats kept by a cache)."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    lines += [f"{name}{_format_labels(_labels(labels))} {value}" for labels, value in samples]
+    return lines
+
+
+def render_metrics(extra: List[str] = ()) -> str:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += extra
+    return "\n".join(lines) + "\n"
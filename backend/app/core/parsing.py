@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import io
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from pypdf import PdfReader, PdfWriter
+
+from app.core.config import settings
+from app.core.metrics import pages_parsed, stage
+from app.core.textlayer import extract_page_markdown
+from app.core.upstream import get_scheduler
+
+
+class PageParser(ABC):
+    """
+    Turns a PDF holding a contiguous range of statement pages into markdown, one string per page.
+
+    `name` is part of the page cache key, so changing the parser or its options
+    (and bumping the name) never serves pages parsed the old way. Parsers that call
+    a remote service set `upstream`, so their requests go through the "parser" scheduler.
+    """
+
+    name: str
+    upstream: bool = False
+
+    @abstractmethod
+    async def parse(self, pdf: bytes, file_name: str) -> List[str]:
+        ...
+
+
+class LlamaCloudParser(PageParser):
+    name = "llama-parse-premium-v1"
+    upstream = True
+
+    async def parse(self, pdf: bytes, file_name: str) -> List[str]:
+        from llama_parse import LlamaParse
+
+        parser = LlamaParse(
+            api_key=settings.llama_cloud_api_key,
+            result_type="markdown",
+            verbose=settings.debug,
+            show_progress=False,
+            premium_mode=True,
+            split_by_page=True,
+        )
+        documents = await parser.aload_data(pdf, {"file_name": file_name})
+        return [doc.text_resource.text for doc in documents]
+
+
+class LocalTextParser(PageParser):
+    """Offline stand-in that returns the PDF's text layer as-is; used for tests and local development."""
+
+    name = "local-text-v1"
+
+    async def parse(self, pdf: bytes, file_name: str) -> List[str]:
+        reader = PdfReader(io.BytesIO(pdf))
+        return [page.extract_text() or "" for page in reader.pages]
+
+
+PARSERS = {
+    "llama": LlamaCloudParser,
+    "local": LocalTextParser,
+}
+
+_parse_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_parser() -> PageParser:
+    return PARSERS[settings.pdf_parser]()
+
+
+def get_page_cache_path(key: str) -> str:
+    return os.path.join(settings.data_dir, "pages", f"{key}.md")
+
+
+def split_pdf_pages(path: str) -> List[bytes]:
+    """Splits a PDF into standalone single-page PDFs."""
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+def merge_pdf_pages(pages: List[bytes]) -> bytes:
+    writer = PdfWriter()
+    for page in pages:
+        writer.append(io.BytesIO(page))
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def page_cache_key(parser: PageParser, page: bytes) -> str:
+    return hashlib.sha256(parser.name.encode("utf-8") + b"\x00" + page).hexdigest()
+
+
+def read_cached_page(key: str) -> Optional[str]:
+    path = get_page_cache_path(key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def write_cached_page(key: str, text: str):
+    path = get_page_cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def extract_text_layer_pages(pages: List[bytes]) -> List[tuple[str, float]]:
+    return [extract_page_markdown(page) for page in pages]
+
+
+def group_page_ranges(indexes: List[int], size: int) -> List[List[int]]:
+    """Groups page indexes into runs of consecutive pages holding at most `size` pages each."""
+    ranges = []
+    for index in indexes:
+        if ranges and index == ranges[-1][-1] + 1 and len(ranges[-1]) < size:
+            ranges[-1].append(index)
+        else:
+            ranges.append([index])
+    return ranges
+
+
+async def parse_statement_pdf(path: str, file_name: str, parser: Optional[PageParser] = None, run_blocking=None) -> str:
+    """
+    Parses a PDF into markdown page by page.
+
+    Pages found in the page cache (keyed by parser and page content hash) are reused.
+    Digitally generated pages are then read locally from their text layer
+    (settings.text_layer_fast_path); only scanned or low-confidence pages are left
+    for the parser. Those are grouped into ranges of settings.parse_pages_per_range and
+    parsed concurrently, with at most settings.parse_concurrency requests in flight
+    across all documents.
+
+    :param run_blocking: runs PDF splitting off the event loop, e.g. JobQueue.run_blocking
+    """
+    global _parse_semaphore
+    if _parse_semaphore is None:
+        _parse_semaphore = asyncio.Semaphore(settings.parse_concurrency)
+    parser = parser or get_parser()
+
+    if run_blocking is not None:
+        pages = await run_blocking(split_pdf_pages, path)
+    else:
+        pages = split_pdf_pages(path)
+
+    keys = [page_cache_key(parser, page) for page in pages]
+    texts = [read_cached_page(key) for key in keys]
+    missing = [index for index, text in enumerate(texts) if text is None]
+    cached = len(pages) - len(missing)
+
+    if settings.text_layer_fast_path and missing:
+        missing_pages = [pages[index] for index in missing]
+        with stage("ingest", "text_layer", pages=len(missing_pages)):
+            if run_blocking is not None:
+                extracted = await run_blocking(extract_text_layer_pages, missing_pages)
+            else:
+                extracted = extract_text_layer_pages(missing_pages)
+        for index, (text, confidence) in zip(list(missing), extracted):
+            if confidence >= settings.text_layer_min_confidence:
+                texts[index] = text
+        missing = [index for index, text in enumerate(texts) if text is None]
+
+    print("Parsing {} of {} pages for {} ({} cached, {} from the text layer)".format(
+        len(missing), len(pages), file_name, cached, len(pages) - cached - len(missing)))
+    pages_parsed.inc(cached, source="cache")
+    pages_parsed.inc(len(pages) - cached - len(missing), source="text_layer")
+    pages_parsed.inc(len(missing), source="parser")
+
+    async def parse_range(indexes: List[int]):
+        pdf = pages[indexes[0]] if len(indexes) == 1 else merge_pdf_pages([pages[i] for i in indexes])
+        range_name = f"{file_name}-p{indexes[0] + 1}-{indexes[-1] + 1}.pdf"
+        async with _parse_semaphore:
+            with stage("ingest", "parse_range", parser=parser.name, pages=len(indexes)):
+                if parser.upstream:
+                    results = await get_scheduler("parser").acall(
+                        lambda: parser.parse(pdf, range_name),
+                        tokens=len(indexes),
+                        key=parser.name + ":" + hashlib.sha256(pdf).hexdigest(),
+                    )
+                else:
+                    results = await parser.parse(pdf, range_name)
+
+        if len(results) == len(indexes):
+            for index, text in zip(indexes, results):
+                texts[index] = text
+                write_cached_page(keys[index], text)
+        else:
+            # Pages could not be told apart; keep the range together and leave it uncached
+            texts[indexes[0]] = "\n\n".join(results)
+            for index in indexes[1:]:
+                texts[index] = ""
+
+    await asyncio.gather(*[
+        parse_range(indexes) for indexes in group_page_ranges(missing, settings.parse_pages_per_range)
+    ])
+    return "\n\n".join(text for text in texts if text)
@@ -0,0 +1,462 @@
+import contextvars
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+import numpy as np
+import pandas as pd
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from app.core.analytics import backfill_analytics
+from app.core.config import settings
+from app.core.transactions import AMOUNT_SCALE, load_transactions, parse_dates, to_display_frame
+from app.core.utils import (
+    RetrieverCache,
+    estimate_index_bytes,
+    get_index_path,
+    get_markdown_path,
+    check_nltk_resources,
+    index_build_lock,
+    index_exists,
+    init_clients,
+    load_store,
+    make_store,
+    release_index,
+    split_markdown,
+)
+
+STOPWORDS = {
+    "a", "an", "the", "to", "of", "in", "on", "for", "at", "by", "from", "with", "and", "or",
+    "my", "me", "i", "is", "are", "was", "were", "be", "what", "which", "how", "much", "many",
+    "show", "list", "find", "all", "any", "did", "do", "does", "give", "tell", "about", "there",
+    "this", "that", "it", "its", "have", "has", "had", "over", "under", "above", "below", "than",
+    "more", "less", "between", "during", "made", "get",
+}
+
+MONTHS = {
+    "jan": 1, "january": 1, "feb": 2, "february": 2, "mar": 3, "march": 3, "apr": 4, "april": 4,
+    "may": 5, "jun": 6, "june": 6, "jul": 7, "july": 7, "aug": 8, "august": 8, "sep": 9, "sept": 9,
+    "september": 9, "oct": 10, "october": 10, "nov": 11, "november": 11, "dec": 12, "december": 12,
+}
+MONTH_PATTERN = "|".join(sorted(MONTHS, key=len, reverse=True))
+DATE_TOKEN = r"(\d{1,4}[/-]\d{1,2}(?:[/-]\d{2,4})?|(?:%s)\.? \d{1,2}(?:,? \d{4})?)" % MONTH_PATTERN
+AMOUNT_TOKEN = r"\$?\s?(\d[\d,]*(?:\.\d{1,2})?)"
+
+DEBIT_WORDS = {"debit", "debits", "payment", "payments", "paid", "spent", "spend", "spending", "purchase",
+               "purchases", "withdrawal", "withdrawals", "charge", "charges", "expense", "expenses"}
+CREDIT_WORDS = {"credit", "credits", "deposit", "deposits", "received", "income", "paycheck", "refund", "refunds"}
+
+# Rows returned for a filter query; the whole set goes into the prompt
+MAX_FILTERED_ROWS = 50
+# Reciprocal rank fusion constant
+RRF_K = 60
+LEXICAL_INDEX_FILE = "lexical.json"
+
+# (question, embedding) already computed for the request, e.g. by the answer cache lookup
+query_vector: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("query_vector", default=None)
+
+
+@contextmanager
+def use_query_vector(query: str, vector: Optional[List[float]]):
+    """Lets retrievers invoked in the block search with `vector` instead of embedding `query` again."""
+    token = query_vector.set((query, vector) if vector is not None else None)
+    try:
+        yield
+    finally:
+        query_vector.reset(token)
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over a list of documents, held as per-term posting arrays."""
+
+    def __init__(self, docs: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.docs = docs
+        self.k1 = k1
+        self.b = b
+        lengths = []
+        postings = defaultdict(lambda: ([], []))
+        for idx, doc in enumerate(docs):
+            counts = Counter(tokenize(doc.page_content))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term][0].append(idx)
+                postings[term][1].append(tf)
+
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if docs else 0.0
+        self.postings = {
+            term: (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32))
+            for term, (ids, tfs) in postings.items()
+        }
+        n = len(docs)
+        self.idf = {
+            term: math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            for term, (ids, _) in self.postings.items()
+        }
+
+    def vocabulary_coverage(self, terms: List[str]) -> float:
+        return sum(term in self.postings for term in terms) / len(terms) if terms else 0.0
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / (self.avg_length or 1.0))
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            scores[ids] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        return scores
+
+    def matches_all(self, idx: int, terms: List[str]) -> bool:
+        tokens = set(tokenize(self.docs[idx].page_content))
+        return all(term in tokens for term in terms)
+
+    def search(self, terms: List[str], k: int) -> List[int]:
+        scores = self.scores(terms)
+        ranked = np.argsort(-scores)[:k]
+        return [int(idx) for idx in ranked if scores[idx] > 0]
+
+
+def transaction_documents(df: Optional[pd.DataFrame]) -> List[Document]:
+    """Renders each transaction row as a small document the lexical index can match on."""
+    if df is None or df.empty:
+        return []
+
+    display = to_display_frame(df)
+    columns = [col for col in ("date", "transaction", "Debit", "Credit", "Balance") if col in display.columns]
+    docs = []
+    for row in display[["id"] + columns].itertuples(index=False):
+        values = row._asdict()
+        text = " | ".join(
+            f"{col.lower()} {values[col]}" if col in ("Debit", "Credit", "Balance") else str(values[col])
+            for col in columns if pd.notna(values[col])
+        )
+        docs.append(Document(page_content=text, metadata={"type": "transaction", "row_id": int(values["id"])}))
+    return docs
+
+
+def parse_transaction_filters(query: str) -> dict:
+    """
+    Extracts structured filters from a question.
+
+    Recognizes amount bounds ("over $500", "between 100 and 200"), date ranges
+    ("in October", "October 2024", "from 10/01/2024 to 10/15/2024", "on Oct 5")
+    and whether debits or credits are meant.
+    """
+    text = query.lower()
+    filters = {}
+
+    between = re.search(r"between\s+%s\s+and\s+%s" % (AMOUNT_TOKEN, AMOUNT_TOKEN), text)
+    if between and "/" not in between.group(0):
+        filters["min_amount"] = float(between.group(1).replace(",", ""))
+        filters["max_amount"] = float(between.group(2).replace(",", ""))
+    else:
+        lower = re.search(r"(?:over|above|more than|greater than|at least|exceeding|>=?)\s*%s" % AMOUNT_TOKEN, text)
+        upper = re.search(r"(?:under|below|less than|at most|<=?)\s*%s" % AMOUNT_TOKEN, text)
+        if lower:
+            filters["min_amount"] = float(lower.group(1).replace(",", ""))
+        if upper:
+            filters["max_amount"] = float(upper.group(1).replace(",", ""))
+
+    date_range = re.search(r"(?:from|between)\s+%s\s+(?:to|and|until|-)\s+%s" % (DATE_TOKEN, DATE_TOKEN), text)
+    single_date = re.search(r"\bon\s+%s" % DATE_TOKEN, text)
+    month = re.search(r"\b(?:in|during|for|of)\s+(%s)\b(?:\s+(\d{4}))?|\b(%s)\s+(\d{4})\b" % (MONTH_PATTERN, MONTH_PATTERN), text)
+    if date_range:
+        dates, _ = parse_dates(pd.Series([date_range.group(1), date_range.group(2)]))
+        if dates.notna().all():
+            filters["start_date"], filters["end_date"] = dates.iloc[0], dates.iloc[1]
+    elif single_date:
+        dates, _ = parse_dates(pd.Series([single_date.group(1)]))
+        if dates.notna().all():
+            filters["start_date"] = filters["end_date"] = dates.iloc[0]
+    elif month:
+        filters["month"] = MONTHS[month.group(1) or month.group(3)]
+        year = month.group(2) or month.group(4)
+        if year:
+            filters["year"] = int(year)
+
+    words = set(tokenize(text))
+    if words & DEBIT_WORDS and not words & CREDIT_WORDS:
+        filters["side"] = "Debit"
+    elif words & CREDIT_WORDS and not words & DEBIT_WORDS:
+        filters["side"] = "Credit"
+    return filters
+
+
+def filter_transactions(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """Applies parsed filters to the typed transactions table with vectorized masks."""
+    mask = pd.Series(True, index=df.index)
+
+    sides = [filters["side"]] if "side" in filters else ["Debit", "Credit"]
+    sides = [side for side in sides if side in df.columns]
+    if sides:
+        amounts = df[sides].max(axis=1, skipna=True)
+    elif "Amount" in df.columns:
+        amounts = df["Amount"].abs()
+    else:
+        amounts = pd.Series(pd.NA, index=df.index, dtype="Int64")
+    if "side" in filters and sides:
+        mask &= amounts.notna()
+    if "min_amount" in filters:
+        mask &= (amounts >= filters["min_amount"] * AMOUNT_SCALE).fillna(False)
+    if "max_amount" in filters:
+        mask &= (amounts <= filters["max_amount"] * AMOUNT_SCALE).fillna(False)
+
+    if "date" in df.columns:
+        dates = df["date"]
+        if "start_date" in filters:
+            mask &= (dates >= filters["start_date"]).fillna(False)
+        if "end_date" in filters:
+            mask &= (dates <= filters["end_date"]).fillna(False)
+        if "month" in filters:
+            mask &= (dates.dt.month == filters["month"]).fillna(False)
+        if "year" in filters:
+            mask &= (dates.dt.year == filters["year"]).fillna(False)
+    return df[mask]
+
+
+def has_structured_filter(filters: dict) -> bool:
+    # The debit/credit side alone is too vague to replace semantic search
+    return any(key in filters for key in ("min_amount", "max_amount", "start_date", "end_date", "month"))
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 lexical search and vector search, with structured transaction filters.
+
+    - Questions with an amount or date filter are answered from the filtered
+      transaction rows, ranked lexically, without touching the embedding model.
+    - Questions whose terms are all in the lexical index and fully matched by the
+      best hit are answered lexically as well.
+    - Everything else runs both searches and merges them by reciprocal rank fusion,
+      reusing the question's embedding when use_query_vector provides it.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_retriever: Any
+    lexical: Any
+    transactions: Optional[Any] = None
+    k: int = 4
+
+    def _plan(self, query: str):
+        terms = [term for term in tokenize(query) if term not in STOPWORDS]
+        filters = parse_transaction_filters(query)
+        # Words and numbers already consumed by the filters should not also have to match lexically
+        lexical_terms = [
+            term for term in terms
+            if term not in DEBIT_WORDS | CREDIT_WORDS and term not in MONTHS and not term.isdigit()
+        ]
+        return terms, filters, lexical_terms
+
+    def _filtered(self, filters: dict, lexical_terms: List[str]) -> List[Document]:
+        rows = filter_transactions(self.transactions, filters)
+        row_docs = {
+            doc.metadata["row_id"]: idx
+            for idx, doc in enumerate(self.lexical.docs)
+            if doc.metadata.get("type") == "transaction"
+        }
+        candidates = [row_docs[row_id] for row_id in rows["id"] if row_id in row_docs]
+        if lexical_terms and candidates:
+            scores = self.lexical.scores(lexical_terms)
+            matched = [idx for idx in candidates if scores[idx] > 0]
+            if matched:
+                candidates = sorted(matched, key=lambda idx: -scores[idx])
+        print("Structured filter {} matched {} transactions".format(filters, len(candidates)))
+        return [self.lexical.docs[idx] for idx in candidates[:MAX_FILTERED_ROWS]]
+
+    def _lexical_only(self, terms: List[str], ranked: List[int]) -> bool:
+        return bool(ranked) and self.lexical.vocabulary_coverage(terms) == 1.0 and self.lexical.matches_all(ranked[0], terms)
+
+    def _fuse(self, lexical_ranked: List[int], vector_docs: List[Document]) -> List[Document]:
+        scores, docs = defaultdict(float), {}
+        for rank, idx in enumerate(lexical_ranked):
+            doc = self.lexical.docs[idx]
+            scores[doc.page_content] += 1 / (RRF_K + rank)
+            docs[doc.page_content] = doc
+        for rank, doc in enumerate(vector_docs):
+            scores[doc.page_content] += 1 / (RRF_K + rank)
+            docs.setdefault(doc.page_content, doc)
+        return [docs[key] for key in sorted(scores, key=lambda key: -scores[key])[:self.k]]
+
+    def uses_vector_search(self, query: str) -> bool:
+        """Whether answering `query` will embed it, i.e. it is neither a filter nor a keyword question."""
+        terms, filters, _ = self._plan(query)
+        if self.transactions is not None and has_structured_filter(filters):
+            return False
+        return not self._lexical_only(terms, self.lexical.search(terms, self.k))
+
+    def _precomputed_vector(self, query: str) -> Optional[List[float]]:
+        precomputed = query_vector.get()
+        return precomputed[1] if precomputed is not None and precomputed[0] == query else None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        terms, filters, lexical_terms = self._plan(query)
+        if self.transactions is not None and has_structured_filter(filters):
+            return self._filtered(filters, lexical_terms)
+
+        ranked = self.lexical.search(terms, self.k)
+        if self._lexical_only(terms, ranked):
+            return [self.lexical.docs[idx] for idx in ranked]
+
+        vector = self._precomputed_vector(query)
+        if vector is not None:
+            store, search_kwargs = self.vector_retriever.vectorstore, self.vector_retriever.search_kwargs
+            vector_docs = store.similarity_search_by_vector(vector, **search_kwargs)
+        else:
+            vector_docs = self.vector_retriever.invoke(query)
+        return self._fuse(ranked, vector_docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        terms, filters, lexical_terms = self._plan(query)
+        if self.transactions is not None and has_structured_filter(filters):
+            return self._filtered(filters, lexical_terms)
+
+        ranked = self.lexical.search(terms, self.k)
+        if self._lexical_only(terms, ranked):
+            return [self.lexical.docs[idx] for idx in ranked]
+
+        vector = self._precomputed_vector(query)
+        if vector is not None:
+            store, search_kwargs = self.vector_retriever.vectorstore, self.vector_retriever.search_kwargs
+            vector_docs = await store.asimilarity_search_by_vector(vector, **search_kwargs)
+        else:
+            vector_docs = await self.vector_retriever.ainvoke(query)
+        return self._fuse(ranked, vector_docs)
+
+
+def save_lexical_documents(id: str, docs: List[Document]):
+    path = os.path.join(get_index_path(id), LEXICAL_INDEX_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs], f)
+    os.replace(path + ".tmp", path)
+
+
+def load_lexical_documents(id: str) -> Optional[List[Document]]:
+    path = os.path.join(get_index_path(id), LEXICAL_INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return [Document(**doc) for doc in json.load(f)]
+
+
+def build_hybrid_retriever(id: str, store, chunks: Optional[List[Document]] = None) -> HybridRetriever:
+    """
+    Wraps a vector store with the lexical index and transactions of the same document.
+
+    The lexical documents (markdown chunks plus one per transaction row) are stored
+    next to the vector index; indexes built before that are backfilled on first use.
+    """
+    transactions = load_transactions(id)
+    lexical_docs = None if chunks is not None else load_lexical_documents(id)
+    if lexical_docs is None:
+        if chunks is None:
+            chunks = split_markdown(get_markdown_path(id))
+        lexical_docs = list(chunks) + transaction_documents(transactions)
+        save_lexical_documents(id, lexical_docs)
+
+    return HybridRetriever(
+        vector_retriever=store.as_retriever(),
+        lexical=BM25Index(lexical_docs),
+        transactions=transactions if transactions is not None and not transactions.empty else None,
+    )
+
+
+def cache_retriever(id: str, retriever, metadata: dict):
+    RetrieverCache().set(
+        id,
+        (retriever, metadata),
+        size_bytes=estimate_index_bytes(id),
+        release=lambda: release_index(id),
+    )
+
+
+def make_retriever(id: Optional[str], data: dict):
+    retriever_cache = RetrieverCache()
+    if not id:
+        id = "default"
+
+    cached = retriever_cache.get(id)
+    if cached:
+        print("Cached Retriever present in store with id: {}".format(id))
+        return cached[0]
+
+    with index_build_lock(id):
+        # Another thread or worker may have built the index while this one waited
+        cached = retriever_cache.get(id)
+        if cached:
+            print("Cached Retriever present in store with id: {}".format(id))
+            return cached[0]
+
+        if index_exists(id):
+            store, metadata = load_store(id)
+            retriever = build_hybrid_retriever(id, store)
+            print("Loaded persisted index for id: {}".format(id))
+        else:
+            metadata = data["metadata"]
+            store, _ = make_store(id, data["docs"], metadata)
+            retriever = build_hybrid_retriever(id, store, chunks=data["docs"])
+            print("Created new Retriever and stored in store with id: {}".format(id))
+
+        cache_retriever(id, retriever, metadata)
+    return retriever
+
+def get_retriever(id: Optional[str]):
+    retriever_cache = RetrieverCache()
+    if not id:
+        id = "default"
+
+    cached = retriever_cache.get(id)
+    if cached:
+        print("Using Cached Retriever with id: {}".format(id))
+        return cached
+
+    store, metadata = load_store(id)
+    if store is None:
+        return (None,None)
+
+    print("Opened persisted index for id: {}".format(id))
+    retriever = build_hybrid_retriever(id, store)
+    cache_retriever(id, retriever, metadata)
+    return (retriever, metadata)
+
+
+def recent_indexes(limit: int) -> List[str]:
+    """Hashes of the `limit` most recently written persisted indexes."""
+    root = os.path.join(settings.data_dir, "index")
+    if limit <= 0 or not os.path.isdir(root):
+        return []
+    ids = [id for id in os.listdir(root) if index_exists(id)]
+    ids.sort(key=lambda id: os.path.getmtime(get_index_path(id)), reverse=True)
+    return ids[:limit]
+
+
+def prewarm(indexes: int):
+    """
+    Pays the cold-start costs before the first request does: creates the upstream
+    clients, imports the lazily loaded dependencies and opens the most recent indexes.
+    """
+    init_clients()
+    check_nltk_resources()
+    backfill_analytics()
+    for id in recent_indexes(indexes):
+        try:
+            get_retriever(id)
+        except Exception as e:
+            print("Could not prewarm index {}: {}".format(id, e))
+    # Imported for their side effect of loading the modules ingestion will need
+    import langchain.chains  # noqa: F401
+    import langchain_community.document_loaders  # noqa: F401
+    import pytablereader  # noqa: F401
+    import sklearn.feature_extraction.text  # noqa: F401
+    print("Prewarm finished")
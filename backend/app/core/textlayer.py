@@ -0,0 +1,357 @@
+import io
+import re
+from statistics import median
+from typing import List, NamedTuple, Optional
+
+from pypdf import PdfReader
+from pypdf.generic import ContentStream, DictionaryObject
+
+# A gap wider than this (in font sizes) between two pieces of text on a line starts a new cell
+CELL_GAP = 0.8
+# Text whose baselines differ by less than this (in font sizes) is on the same line
+LINE_TOLERANCE = 0.4
+# A vertical gap larger than this (in font sizes) ends a table
+TABLE_BREAK_GAP = 3.0
+# Share of the page's text (as pypdf extracts it) that the fast path must have positioned
+MIN_TEXT_COVERAGE = 0.95
+# Pages with less text than this are treated as scanned
+MIN_PAGE_CHARS = 20
+
+
+class TextFragment(NamedTuple):
+    x0: float
+    x1: float
+    y: float
+    size: float
+    text: str
+
+
+class Cell(NamedTuple):
+    x0: float
+    x1: float
+    text: str
+
+    @property
+    def center(self) -> float:
+        return (self.x0 + self.x1) / 2
+
+
+class Line(NamedTuple):
+    y: float
+    size: float
+    cells: List[Cell]
+
+
+def _multiply(a: List[float], b: List[float]) -> List[float]:
+    return [
+        a[0] * b[0] + a[1] * b[2], a[0] * b[1] + a[1] * b[3],
+        a[2] * b[0] + a[3] * b[2], a[2] * b[1] + a[3] * b[3],
+        a[4] * b[0] + a[5] * b[2] + b[4], a[4] * b[1] + a[5] * b[3] + b[5],
+    ]
+
+
+def _parse_to_unicode(font: DictionaryObject) -> dict:
+    """Reads the bfchar/bfrange entries of a font's ToUnicode CMap into {code: text}."""
+    if "/ToUnicode" not in font:
+        return {}
+    data = font["/ToUnicode"].get_object().get_data().decode("latin-1")
+    mapping = {}
+
+    def to_text(hex_text: str) -> str:
+        raw = bytes.fromhex(hex_text)
+        return raw.decode("utf-16-be", errors="ignore")
+
+    for block in re.findall(r"beginbfchar(.*?)endbfchar", data, re.DOTALL):
+        for src, dst in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>", block):
+            mapping[int(src, 16)] = to_text(dst)
+    for block in re.findall(r"beginbfrange(.*?)endbfrange", data, re.DOTALL):
+        for start, end, dst in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(<[0-9A-Fa-f]*>|\[[^\]]*\])", block):
+            start, end = int(start, 16), int(end, 16)
+            if dst.startswith("["):
+                for offset, item in enumerate(re.findall(r"<([0-9A-Fa-f]*)>", dst)):
+                    mapping[start + offset] = to_text(item)
+            else:
+                first = bytes.fromhex(dst[1:-1])
+                base = int.from_bytes(first, "big")
+                for code in range(start, end + 1):
+                    value = (base + code - start).to_bytes(len(first), "big")
+                    mapping[code] = value.decode("utf-16-be", errors="ignore")
+    return mapping
+
+
+class FontInfo:
+    """Just enough of a PDF font to decode shown strings and measure their widths."""
+
+    def __init__(self, font: DictionaryObject):
+        self.composite = font.get("/Subtype") == "/Type0"
+        self.to_unicode = _parse_to_unicode(font)
+        self.widths = {}
+        self.default_width = 500.0
+
+        if self.composite:
+            descendant = font["/DescendantFonts"][0].get_object()
+            self.default_width = float(descendant.get("/DW", 1000))
+            w = descendant.get("/W", [])
+            i = 0
+            while i < len(w):
+                first = int(w[i])
+                if isinstance(w[i + 1], list):
+                    for offset, width in enumerate(w[i + 1]):
+                        self.widths[first + offset] = float(width)
+                    i += 2
+                else:
+                    for code in range(first, int(w[i + 1]) + 1):
+                        self.widths[code] = float(w[i + 2])
+                    i += 3
+        elif "/Widths" in font:
+            first = int(font.get("/FirstChar", 0))
+            for offset, width in enumerate(font["/Widths"]):
+                self.widths[first + offset] = float(width)
+
+    def decode(self, data: bytes) -> tuple[str, List[float]]:
+        """:return: (text, glyph widths in thousandths of the font size)"""
+        codes = [int.from_bytes(data[i:i + 2], "big") for i in range(0, len(data), 2)] if self.composite else list(data)
+        chars, widths = [], []
+        for code in codes:
+            if code in self.to_unicode:
+                chars.append(self.to_unicode[code])
+            elif self.composite:
+                chars.append("�")
+            else:
+                chars.append(bytes([code]).decode("cp1252", errors="replace"))
+            widths.append(self.widths.get(code, self.default_width))
+        return "".join(chars), widths
+
+
+def extract_fragments(page) -> List[TextFragment]:
+    """
+    Runs the page's content stream and records every shown string with its position.
+
+    Handles the text state operators (BT/ET, Tf, Tc, Tw, Tz, TL, Td, TD, Tm, T*) and
+    the graphics state stack and cm; text drawn inside form XObjects is not seen, which
+    the coverage check in extract_page_markdown catches.
+    """
+    resources = page.get("/Resources", DictionaryObject()).get_object()
+    font_resources = resources.get("/Font", DictionaryObject()).get_object()
+    fonts = {}
+
+    def get_font(name) -> Optional[FontInfo]:
+        if name not in fonts:
+            fonts[name] = FontInfo(font_resources[name].get_object()) if name in font_resources else None
+        return fonts[name]
+
+    contents = page.get_contents()
+    if contents is None:
+        return []
+
+    fragments = []
+    cm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    tm = tlm = [1, 0, 0, 1, 0, 0]
+    font, size, char_spacing, word_spacing, scale, leading = None, 0.0, 0.0, 0.0, 1.0, 0.0
+
+    def show(data: bytes):
+        nonlocal tm
+        if font is None:
+            return
+        text, widths = font.decode(data)
+        advance = 0.0
+        for char, width in zip(text, widths):
+            advance += (width / 1000 * size + char_spacing + (word_spacing if char == " " else 0)) * scale
+        start = _multiply(tm, cm)
+        end = _multiply(_multiply([1, 0, 0, 1, advance, 0], tm), cm)
+        effective_size = size * (abs(start[3]) or abs(start[2]) or 1)
+        if text.strip():
+            fragments.append(TextFragment(start[4], end[4], start[5], effective_size, text))
+        tm = _multiply([1, 0, 0, 1, advance, 0], tm)
+
+    for operands, operator in ContentStream(contents, page.pdf).operations:
+        if operator == b"q":
+            stack.append(cm)
+        elif operator == b"Q":
+            cm = stack.pop() if stack else [1, 0, 0, 1, 0, 0]
+        elif operator == b"cm":
+            cm = _multiply([float(v) for v in operands], cm)
+        elif operator == b"BT":
+            tm = tlm = [1, 0, 0, 1, 0, 0]
+        elif operator == b"Tf":
+            font, size = get_font(operands[0]), float(operands[1])
+        elif operator == b"Tc":
+            char_spacing = float(operands[0])
+        elif operator == b"Tw":
+            word_spacing = float(operands[0])
+        elif operator == b"Tz":
+            scale = float(operands[0]) / 100
+        elif operator == b"TL":
+            leading = float(operands[0])
+        elif operator in (b"Td", b"TD"):
+            if operator == b"TD":
+                leading = -float(operands[1])
+            tm = tlm = _multiply([1, 0, 0, 1, float(operands[0]), float(operands[1])], tlm)
+        elif operator == b"Tm":
+            tm = tlm = [float(v) for v in operands]
+        elif operator == b"T*":
+            tm = tlm = _multiply([1, 0, 0, 1, 0, -leading], tlm)
+        elif operator == b"Tj":
+            show(bytes(operands[0].original_bytes if hasattr(operands[0], "original_bytes") else operands[0]))
+        elif operator in (b"'", b'"'):
+            if operator == b'"':
+                word_spacing, char_spacing = float(operands[0]), float(operands[1])
+            tm = tlm = _multiply([1, 0, 0, 1, 0, -leading], tlm)
+            data = operands[-1]
+            show(bytes(data.original_bytes if hasattr(data, "original_bytes") else data))
+        elif operator == b"TJ":
+            for item in operands[0]:
+                if isinstance(item, (int, float)) or hasattr(item, "as_numeric"):
+                    tm = _multiply([1, 0, 0, 1, -float(item) / 1000 * size * scale, 0], tm)
+                else:
+                    show(bytes(item.original_bytes if hasattr(item, "original_bytes") else item))
+    return fragments
+
+
+def group_lines(fragments: List[TextFragment]) -> List[Line]:
+    """Groups fragments into lines (top to bottom) and each line into cells separated by wide gaps."""
+    lines = []
+    for fragment in sorted(fragments, key=lambda f: (-f.y, f.x0)):
+        if lines and abs(lines[-1][0].y - fragment.y) <= LINE_TOLERANCE * fragment.size:
+            lines[-1].append(fragment)
+        else:
+            lines.append([fragment])
+
+    result = []
+    for fragments in lines:
+        fragments.sort(key=lambda f: f.x0)
+        size = median(f.size for f in fragments)
+        cells = []
+        for fragment in fragments:
+            if cells and fragment.x0 - cells[-1].x1 < CELL_GAP * size:
+                last = cells[-1]
+                joiner = "" if fragment.x0 - last.x1 < 0.1 * size else " "
+                cells[-1] = Cell(last.x0, max(last.x1, fragment.x1), last.text + joiner + fragment.text)
+            else:
+                cells.append(Cell(fragment.x0, fragment.x1, fragment.text))
+        cells = [Cell(c.x0, c.x1, " ".join(c.text.split())) for c in cells if c.text.strip()]
+        result.append(Line(fragments[0].y, size, cells))
+    return result
+
+
+def _is_header(line: Line, next_line: Optional[Line]) -> bool:
+    return (
+        len(line.cells) >= 3
+        and not any(re.search(r"\d", cell.text) for cell in line.cells)
+        and next_line is not None
+        and len(next_line.cells) >= 2
+        and any(re.search(r"\d", cell.text) for cell in next_line.cells)
+    )
+
+
+def _assign_columns(cells: List[Cell], boundaries: List[float], size: float) -> Optional[List[int]]:
+    """Maps cells to column indexes; None if two cells land in one column or a cell straddles a boundary."""
+    columns = []
+    for cell in cells:
+        column = sum(cell.center > boundary for boundary in boundaries)
+        if any(cell.x0 < boundary - size and cell.x1 > boundary + size for boundary in boundaries):
+            return None
+        columns.append(column)
+    return columns if len(set(columns)) == len(columns) else None
+
+
+def extract_table(lines: List[Line], start: int) -> tuple[List[List[str]], int, float]:
+    """
+    Reads the table whose header is lines[start].
+
+    Rows start at lines with a cell in two or more columns; a line with only text in
+    non-first columns continues the previous row (wrapped descriptions).
+
+    :return: (rows including the header, index of the first line after the table, confidence)
+    """
+    header = lines[start]
+    boundaries = [(a.x1 + b.x0) / 2 for a, b in zip(header.cells, header.cells[1:])]
+    rows = [[cell.text for cell in header.cells]]
+    good = bad = 0
+
+    index = start + 1
+    previous_y = header.y
+    while index < len(lines):
+        line = lines[index]
+        if previous_y - line.y > TABLE_BREAK_GAP * line.size or _is_header(line, lines[index + 1] if index + 1 < len(lines) else None):
+            break
+        columns = _assign_columns(line.cells, boundaries, line.size)
+        has_digits = any(re.search(r"\d", cell.text) for cell in line.cells)
+
+        if columns is not None and len(line.cells) >= 2:
+            row = [""] * len(header.cells)
+            for column, cell in zip(columns, line.cells):
+                row[column] = cell.text
+            rows.append(row)
+            good += 1
+        elif columns is not None and len(rows) > 1 and 0 not in columns and not has_digits:
+            for column, cell in zip(columns, line.cells):
+                rows[-1][column] = (rows[-1][column] + " " + cell.text).strip()
+        elif columns is None and has_digits:
+            # Looks like a row but does not fit the columns
+            bad += 1
+            rows.append([" ".join(cell.text for cell in line.cells)] + [""] * (len(header.cells) - 1))
+        else:
+            break
+        previous_y = line.y
+        index += 1
+
+    confidence = good / (good + bad) if good + bad else 0.0
+    return rows, index, confidence
+
+
+def to_markdown_table(rows: List[List[str]]) -> str:
+    def escape(text: str) -> str:
+        return text.replace("|", "\\|")
+
+    header, body = rows[0], rows[1:]
+    lines = ["| " + " | ".join(escape(cell) for cell in header) + " |"]
+    lines.append("|" + "|".join("---" for _ in header) + "|")
+    lines += ["| " + " | ".join(escape(cell) for cell in row) + " |" for row in body]
+    return "\n".join(lines)
+
+
+def extract_page_markdown(pdf: bytes) -> tuple[str, float]:
+    """
+    Extracts one page of a digitally generated statement straight from its text layer.
+
+    Text outside tables is kept line by line; tables are found from a header line of
+    three or more text cells and emitted as markdown pipe tables, so they go through
+    get_markdown_table_as_df like cloud-parsed pages do.
+
+    :return: (markdown, confidence in [0, 1]); scanned pages and pages whose text could
+        not be positioned or laid out in columns come back with low confidence
+    """
+    page = PdfReader(io.BytesIO(pdf)).pages[0]
+    reference = re.sub(r"\s", "", page.extract_text() or "")
+    if len(reference) < MIN_PAGE_CHARS:
+        return "", 0.0
+
+    fragments = extract_fragments(page)
+    positioned = sum(len(re.sub(r"\s", "", f.text)) for f in fragments)
+    coverage = min(positioned, len(reference)) / len(reference)
+    if coverage < MIN_TEXT_COVERAGE:
+        return "", coverage
+
+    lines = group_lines(fragments)
+    blocks = []
+    confidences = [coverage]
+    untabled_rows = 0
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if _is_header(line, lines[index + 1] if index + 1 < len(lines) else None):
+            rows, index, confidence = extract_table(lines, index)
+            blocks.append(to_markdown_table(rows))
+            confidences.append(confidence)
+            continue
+        if len(line.cells) >= 3 and any(re.search(r"\d", cell.text) for cell in line.cells):
+            untabled_rows += 1
+        blocks.append(" ".join(cell.text for cell in line.cells))
+        index += 1
+
+    # Column-shaped lines that no header claimed mean a table the fast path could not read
+    if untabled_rows >= 3:
+        confidences.append(0.5)
+    return "\n\n".join(blocks), min(confidences)
@@ -0,0 +1,270 @@
+import os
+from typing import Optional
+
+import pandas as pd
+
+from app.core.utils import HEADER_MAPPING_VERSION, extract_and_standardize_tables, get_markdown_path, merge_dataframes
+from app.core.config import settings
+
+
+# Bump whenever the stored table layout changes, so older tables are rebuilt. The header
+# mapping decides which columns become Debit/Credit/Amount, so its version is part of it,
+# and with it of every table path, ETag and insights key derived from this one.
+TRANSACTIONS_VERSION = f"4.{HEADER_MAPPING_VERSION}"
+
+# Amount columns are stored as integer minor units (cents)
+AMOUNT_COLUMNS = ["Debit", "Credit", "Amount", "Balance"]
+AMOUNT_SCALE = 100
+
+# Format -> which of an ambiguous numeric day and month comes first ("md", "dm"), or None when
+# the format cannot be misread. A document keeps one convention; within it, formats are tried
+# in order of how many rows each one parses.
+DATE_FORMATS = {
+    "%m/%d/%Y": "md", "%m/%d/%y": "md", "%m-%d-%Y": "md",
+    "%d/%m/%Y": "dm", "%d/%m/%y": "dm", "%d-%m-%Y": "dm",
+    "%Y-%m-%d": None, "%Y/%m/%d": None,
+    "%d %b %Y": None, "%d %B %Y": None, "%b %d, %Y": None, "%B %d, %Y": None,
+    "%d-%b-%Y": None, "%d-%b-%y": None, "%b %d %Y": None,
+}
+
+# Formats printed without a year -> (the same with a year, how the year is appended, convention).
+# The statement year is added before parsing, so Feb 29 of a leap year is still a valid date.
+YEARLESS_DATE_FORMATS = {
+    "%m/%d": ("%m/%d/%Y", "/{}", "md"),
+    "%d/%m": ("%d/%m/%Y", "/{}", "dm"),
+    "%d %b": ("%d %b %Y", " {}", None),
+    "%b %d": ("%b %d %Y", " {}", None),
+}
+
+
+def get_transactions_path(id: str) -> str:
+    return os.path.join(settings.data_dir, f"{id}.transactions.v{TRANSACTIONS_VERSION}.parquet")
+
+
+def parse_amounts(values: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """
+    Parses amount strings into integer cents without going through floats.
+
+    Handles currency symbols, thousands separators, "(45.00)" and trailing "-" or "DR"
+    as negatives, "CR" suffixes, and "1.234,56" style decimal commas.
+
+    :return: (Int64 cents, bool flag set where a non-empty value failed to parse)
+    """
+    text = values.astype("string").str.strip().str.upper()
+    empty = text.isna() | text.isin(["", "-", "--", "—", "N/A", "NAN", "NONE"])
+
+    negative = (
+        text.str.match(r"^\(.*\)$")
+        | text.str.contains(r"^[^\d]*-", regex=True)
+        | text.str.endswith("-")
+        | text.str.contains(r"\bDR\b", regex=True)
+    ).fillna(False)
+
+    digits = text.str.replace(r"[^\d.,]", "", regex=True)
+    # A trailing comma group of one or two digits is a decimal comma ("1.234,56")
+    decimal_comma = digits.str.match(r"^\d{1,3}(\.\d{3})*,\d{1,2}$|^\d+,\d{1,2}$").fillna(False)
+    digits = digits.where(
+        ~decimal_comma,
+        digits.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+    )
+    digits = digits.where(decimal_comma, digits.str.replace(",", "", regex=False))
+
+    parts = digits.str.extract(r"^(\d*)(?:\.(\d{0,2}))?$")
+    whole = pd.to_numeric(parts[0].replace("", "0"), errors="coerce")
+    fraction = pd.to_numeric(parts[1].fillna("").str.ljust(2, "0"), errors="coerce")
+    valid = parts[0].notna() & (digits.str.len() > 0).fillna(False) & ~empty
+
+    cents = (whole * AMOUNT_SCALE + fraction).where(valid).round().astype("Int64")
+    cents = cents.where(~negative, -cents)
+    return cents, (~empty & ~valid).astype(bool)
+
+
+def parse_dates(values: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """
+    Parses date strings in any of DATE_FORMATS or YEARLESS_DATE_FORMATS into datetime64.
+
+    Each format is applied to the whole column at once. Dates printed without a year
+    take the most common year found on the statement. Ambiguous numeric dates are all
+    read with whichever convention, month or day first, parses more of the column.
+
+    :return: (datetime64 dates, bool flag set where a non-empty value failed to parse)
+    """
+    text = values.astype("string").str.strip()
+    empty = text.isna() | (text == "")
+
+    candidates = {fmt: pd.to_datetime(text, format=fmt, errors="coerce") for fmt in DATE_FORMATS}
+    conventions = dict(DATE_FORMATS)
+
+    years = pd.concat([dates.dropna().dt.year for dates in candidates.values()])
+    year = int(years.mode().iloc[0]) if not years.empty else pd.Timestamp.now().year
+    for fmt, (with_year, suffix, convention) in YEARLESS_DATE_FORMATS.items():
+        candidates[fmt] = pd.to_datetime(text + suffix.format(year), format=with_year, errors="coerce")
+        conventions[fmt] = convention
+
+    parsed = {fmt: int(dates.notna().sum()) for fmt, dates in candidates.items()}
+    month_first = sum(count for fmt, count in parsed.items() if conventions[fmt] == "md")
+    day_first = sum(count for fmt, count in parsed.items() if conventions[fmt] == "dm")
+    convention = "dm" if day_first > month_first else "md"
+
+    ranked = sorted(
+        (fmt for fmt in candidates if conventions[fmt] in (None, convention)),
+        key=lambda fmt: parsed[fmt],
+        reverse=True,
+    )
+    dates = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    for fmt in ranked:
+        dates = dates.fillna(candidates[fmt])
+
+    return dates, (~empty & dates.isna()).astype(bool)
+
+
+def normalize_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Types the merged transactions table in place of its raw strings.
+
+    Amount columns become Int64 cents, "date" becomes datetime64, and per-row
+    "amount_parse_failed" / "date_parse_failed" flags mark values that could not be read.
+    Debit and Credit are stored as positive magnitudes, whatever sign the bank printed;
+    rows with only a signed Amount get it split into Debit (negative) or Credit (positive).
+    """
+    amount_failed = pd.Series(False, index=df.index)
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col], failed = parse_amounts(df[col])
+            amount_failed |= failed
+
+    # The column already says which side a value is on; "-45.00" under Withdrawals is a 45.00 debit
+    for col in ("Debit", "Credit"):
+        if col in df.columns:
+            df[col] = df[col].abs()
+
+    if "Amount" in df.columns:
+        for col in ("Debit", "Credit"):
+            if col not in df.columns:
+                df[col] = pd.Series(pd.NA, index=df.index, dtype="Int64")
+        unsplit = df["Debit"].isna() & df["Credit"].isna()
+        df["Debit"] = df["Debit"].where(~(unsplit & (df["Amount"] < 0)).fillna(False), -df["Amount"])
+        df["Credit"] = df["Credit"].where(~(unsplit & (df["Amount"] > 0)).fillna(False), df["Amount"])
+
+    df["amount_parse_failed"] = amount_failed
+    if "date" in df.columns:
+        df["date"], df["date_parse_failed"] = parse_dates(df["date"])
+    return df
+
+
+def build_transactions_table(content: str) -> pd.DataFrame:
+    """
+    Extracts the transaction tables from a parsed statement and merges them into one table.
+
+    Headers are standardized first; only tables with both a Date column and a
+    Description (or Transaction) column are kept and renamed to "date" and "transaction".
+    The merged table is typed by normalize_transactions and numbered with a running "id".
+    """
+    dataframes = extract_and_standardize_tables(content)
+
+    filtered_dataframes = {}
+
+    for key, df in dataframes.items():
+        description_column = next((col for col in ("Description", "Transaction") if col in key), None)
+
+        if "Date" in key and description_column:
+            df = _dedupe_columns(df.reset_index(drop=True))
+            df.rename(columns={description_column: "transaction", "Date": "date"}, inplace=True)
+            filtered_dataframes[str(key)] = df
+
+    merged_df = merge_dataframes(filtered_dataframes)
+    if merged_df.empty:
+        return merged_df
+
+    merged_df = normalize_transactions(merged_df)
+    merged_df.insert(0, "id", range(1, len(merged_df) + 1))
+    for col in merged_df.columns:
+        if merged_df[col].dtype == object:
+            merged_df[col] = merged_df[col].astype("string")
+    return merged_df
+
+
+def _dedupe_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Gives every column a unique name so tables can be aligned by name and stored as parquet."""
+    seen = {}
+    columns = []
+    for col in df.columns:
+        name = str(col) or "column"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    df.columns = columns
+    return df
+
+
+def to_display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts cents back to decimal amounts and dates to ISO strings for API responses and prompts."""
+    display = df.copy()
+    for col in AMOUNT_COLUMNS:
+        if col in display.columns:
+            display[col] = display[col].astype("Float64") / AMOUNT_SCALE
+    if "date" in display.columns and pd.api.types.is_datetime64_any_dtype(display["date"]):
+        display["date"] = display["date"].dt.strftime("%Y-%m-%d")
+    return display
+
+
+def page_transactions(
+    df: pd.DataFrame,
+    filters: Optional[dict] = None,
+    sort_by: Optional[str] = None,
+    descending: bool = False,
+    offset: int = 0,
+    limit: int = 50,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Filters, sorts and slices the typed transactions table for one page of the table view.
+
+    Filters are case-insensitive substrings of the displayed value of a column (amounts as
+    decimals, dates as YYYY-MM-DD). Sorting uses the typed values, so amounts and dates
+    order numerically. Only the returned page is converted for display.
+
+    :return: (display frame of the page, number of rows matching the filters)
+    """
+    mask = pd.Series(True, index=df.index)
+    for column, value in (filters or {}).items():
+        if value:
+            shown = to_display_frame(df[[column]])[column].astype("string")
+            mask &= shown.str.contains(value, case=False, regex=False).fillna(False)
+
+    matched = df[mask]
+    if sort_by:
+        matched = matched.sort_values(sort_by, ascending=not descending, na_position="last", kind="stable")
+    return to_display_frame(matched.iloc[offset:offset + limit]), len(matched)
+
+
+def materialize_transactions(id: str) -> Optional[pd.DataFrame]:
+    """Builds the transactions table from the statement markdown and stores it next to it."""
+    markdown_file_path = get_markdown_path(id)
+    if not os.path.exists(markdown_file_path):
+        return None
+
+    with open(markdown_file_path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    df = build_transactions_table(content)
+    path = get_transactions_path(id)
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    print("Materialized {} transactions for id: {}".format(len(df), id))
+    return df
+
+
+def load_transactions(id: str) -> Optional[pd.DataFrame]:
+    """
+    Loads the materialized transactions table for a document.
+
+    Statements ingested before tables were materialized are built on first access,
+    so every later request reads the parquet file instead of re-parsing markdown.
+    """
+    path = get_transactions_path(id)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return materialize_transactions(id)
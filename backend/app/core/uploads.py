@@ -0,0 +1,105 @@
+import hashlib
+import os
+import uuid
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+# Room for the multipart boundaries and part headers around each file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    def __init__(self, limit: int):
+        super().__init__("Upload exceeds the limit of {} bytes".format(limit))
+        self.limit = limit
+
+
+def request_body_limit(path: str) -> Optional[int]:
+    """Largest request body accepted by an upload route, or None for every other route."""
+    if path.endswith("/submit"):
+        return settings.max_upload_bytes + MULTIPART_OVERHEAD_BYTES
+    if path.endswith("/submit/batch"):
+        return settings.max_batch_files * (settings.max_upload_bytes + MULTIPART_OVERHEAD_BYTES)
+    return None
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects oversized upload requests before the multipart body is parsed.
+
+    Starlette spools the whole form to a temporary file before the route runs, so
+    the limit has to be enforced on the raw body: requests that declare a larger
+    Content-Length get a 413 without their body being read, and chunked bodies are
+    cut off as soon as they pass the limit. Files within the request are still
+    checked one by one in stream_upload_to_disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = request_body_limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"message": str(UploadTooLargeError(limit))})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=str(UploadTooLargeError(limit)))
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+
+async def stream_upload_to_disk(file: UploadFile) -> tuple[str, str]:
+    """
+    Copies an upload to a temporary file in data_dir in fixed-size chunks,
+    hashing it as it goes, so the PDF is never held in memory as a whole.
+
+    The request body has already been spooled by the time this runs;
+    UploadSizeLimitMiddleware is what keeps oversized requests from being read at all.
+
+    :return: (sha256 hex digest, path of the temporary file)
+    :raises UploadTooLargeError: once more than settings.max_upload_bytes have been read
+    """
+    os.makedirs(settings.data_dir, exist_ok=True)
+    temp_path = os.path.join(settings.data_dir, f"upload-{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(temp_path, "wb") as buffer:
+            while chunk := await file.read(settings.upload_chunk_size):
+                size += len(chunk)
+                if size > settings.max_upload_bytes:
+                    raise UploadTooLargeError(settings.max_upload_bytes)
+                hasher.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return hasher.hexdigest(), temp_path
+
+
+def discard_upload(temp_path: str):
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
@@ -0,0 +1,520 @@
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from app.core.cache import SingleFlight
+from app.core.config import settings
+from app.core.metrics import stage_seconds, upstream_requests
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # chat a user is waiting on
+    BACKGROUND = 1  # insights
+    BATCH = 2  # ingestion
+
+
+current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("upstream_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def priority(level: Priority):
+    """Runs the upstream calls made in the block, and in the tasks started from it, at `level`."""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class UpstreamBusyError(Exception):
+    """
+    An upstream backend stayed rate limited or unavailable through every retry, or an
+    interactive call waited longer than the queue timeout for a slot.
+
+    `status_code` is 429 or 503, ready to be passed on with `headers` (Retry-After).
+    """
+
+    def __init__(self, backend: str, status_code: int, retry_after: float):
+        self.backend = backend
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__("The {} backend is busy, retry in {}s".format(backend, self.retry_after))
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+
+def upstream_status(error: BaseException) -> Optional[int]:
+    """
+    429 for a rate limited upstream call, 503 for an unavailable one, None for errors
+    that retrying will not fix.
+
+    Reads the HTTP status the Google API core, gRPC and httpx errors carry.
+    """
+    for candidate in (error, error.__cause__):
+        if candidate is None:
+            continue
+        for status in (getattr(candidate, "status_code", None), getattr(candidate, "code", None),
+                       getattr(getattr(candidate, "response", None), "status_code", None)):
+            if status == 429:
+                return 429
+            if status in (502, 503, 504):
+                return 503
+    return None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("level", "tokens", "wake", "grant", "cancelled")
+
+    def __init__(self, level: Priority, tokens: int, wake: Callable[[], None]):
+        self.level = level
+        self.tokens = tokens
+        self.wake = wake
+        self.grant: Optional[list] = None
+        self.cancelled = False
+
+
+class UpstreamScheduler:
+    """
+    Admission control, retries and request coalescing for one upstream backend.
+
+    A call is admitted once a concurrency slot is free and its estimated tokens fit in
+    the rolling one-minute budget; waiting calls are admitted by priority, then arrival.
+    `reserved` slots only ever go to interactive calls, so a burst of ingestion cannot
+    hold every slot while a chat waits.
+
+    Rate limited or unavailable calls are retried with jittered exponential backoff, and
+    a 429 holds back every new call until that backoff has passed. Identical calls in
+    flight at the same time share one request. Waiters can be threads or coroutines, so
+    the blocking clients (embeddings) and the async ones (chat, parsing) share a budget.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, tokens_per_minute: int = 0, reserved: int = 0,
+                 max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 queue_timeout: Optional[float] = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.reserved = max(0, min(reserved, self.max_concurrency - 1))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Only interactive calls give up waiting; batch work waits for as long as it takes
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._queue: list = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._window: deque = deque()  # [admitted_at, tokens] of the calls admitted in the last minute
+        self._used = 0
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = 0.0
+        self._flights: dict[str, Future] = {}
+        self._async_flights = SingleFlight()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": sum(1 for _, _, waiter in self._queue if not waiter.cancelled),
+                "tokens_last_minute": self._used,
+            }
+
+    def _limit(self, level: Priority) -> int:
+        return self.max_concurrency if level == Priority.INTERACTIVE else self.max_concurrency - self.reserved
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        """Seconds until a call of `tokens` fits the budget, 0 when it fits now; lock held."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.tokens_per_minute:
+            return 0.0
+        while self._window and self._window[0][0] <= now - 60:
+            self._used -= self._window.popleft()[1]
+        # A call larger than the whole budget still runs, on its own
+        excess = self._used + min(tokens, self.tokens_per_minute) - self.tokens_per_minute
+        if excess <= 0:
+            return 0.0
+        for admitted_at, used in self._window:
+            excess -= used
+            if excess <= 0:
+                return admitted_at + 60 - now
+        return 60.0
+
+    def _dispatch(self):
+        """Admits waiting calls in priority order while they fit; lock held."""
+        now = time.monotonic()
+        while self._queue:
+            level, _, waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if self._in_flight >= self._limit(level):
+                return
+            wait = self._wait_time(waiter.tokens, now)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+            waiter.grant = [now, waiter.tokens]
+            if self.tokens_per_minute:
+                self._window.append(waiter.grant)
+                self._used += waiter.tokens
+            waiter.wake()
+
+    def _schedule(self, delay: float):
+        """Dispatches again once budget frees up, when nothing else (a release) would; lock held."""
+        at = time.monotonic() + delay
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _enqueue(self, level: Priority, tokens: int, wake: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(level, tokens, wake)
+        with self._lock:
+            heapq.heappush(self._queue, (level, next(self._order), waiter))
+            self._dispatch()
+        return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Takes a waiter out of the queue; False if it was admitted in the meantime."""
+        with self._lock:
+            if waiter.grant is not None:
+                return False
+            waiter.cancelled = True
+            return True
+
+    def _timeout(self, level: Priority) -> Optional[float]:
+        return self.queue_timeout if level == Priority.INTERACTIVE else None
+
+    def _queued_too_long(self) -> UpstreamBusyError:
+        upstream_requests.inc(backend=self.name, result="rejected")
+        return UpstreamBusyError(self.name, 503, self.queue_timeout)
+
+    def _record_wait(self, start: float, level: Priority):
+        stage_seconds.observe(time.perf_counter() - start, pipeline="upstream_" + self.name, stage="wait_" + level.name.lower())
+
+    def acquire(self, tokens: int, level: Priority) -> list:
+        """Blocks the calling thread until the call is admitted; pair with release()."""
+        start = time.perf_counter()
+        admitted = threading.Event()
+        waiter = self._enqueue(level, tokens, admitted.set)
+        if not admitted.wait(self._timeout(level)) and self._withdraw(waiter):
+            raise self._queued_too_long()
+        self._record_wait(start, level)
+        return waiter.grant
+
+    async def aacquire(self, tokens: int, level: Priority) -> list:
+        """Waits on the event loop until the call is admitted; pair with release()."""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None))
+
+        waiter = self._enqueue(level, tokens, wake)
+        try:
+            await asyncio.wait_for(admitted, self._timeout(level))
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                raise self._queued_too_long()
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                self.release(waiter.grant)
+            raise
+        self._record_wait(start, level)
+        return waiter.grant
+
+    def release(self, grant: list, tokens: Optional[int] = None):
+        """Frees the call's slot and, when known, replaces its token estimate with what it actually used."""
+        with self._lock:
+            self._in_flight -= 1
+            if tokens is not None and self.tokens_per_minute and grant[0] > time.monotonic() - 60:
+                self._used += tokens - grant[1]
+                grant[1] = tokens
+            self._dispatch()
+
+    def _retry_delay(self, attempt: int, error: Exception, status: int) -> float:
+        """Seconds to back off before retrying, or raises UpstreamBusyError once the retries are spent."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        if attempt >= self.max_retries:
+            upstream_requests.inc(backend=self.name, result="exhausted")
+            raise UpstreamBusyError(self.name, status, retry_after_seconds(error) or ceiling) from error
+
+        delay = retry_after_seconds(error) or random.uniform(0, ceiling)
+        upstream_requests.inc(backend=self.name, result="retried")
+        if status == 429:
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        print("Upstream {} returned {}, retrying in {:.2f}s ({}/{})".format(self.name, status, delay, attempt + 1, self.max_retries))
+        return delay
+
+    def _failed(self, error: Exception) -> Optional[int]:
+        status = upstream_status(error)
+        if status is None:
+            upstream_requests.inc(backend=self.name, result="failed")
+        return status
+
+    def _call(self, fn: Callable[[], Any], tokens: int, usage: Optional[Callable[[Any], Optional[int]]]) -> Any:
+        level = current_priority.get()
+        for attempt in itertools.count():
+            grant = self.acquire(tokens, level)
+            try:
+                result = fn()
+            except Exception as e:
+                self.release(grant)
+                status = self._failed(e)
+                if status is None:
+                    raise
+                time.sleep(self._retry_delay(attempt, e, status))
+                continue
+            except BaseException:
+                self.release(grant)
+                raise
+            self.release(grant, usage(result) if usage else None)
+            upstream_requests.inc(backend=self.name, result="ok")
+            return result
+
+    async def _acall(self, fn: Callable[[], Awaitable[Any]], tokens: int,
+                     usage: Optional[Callable[[Any], Optional[int]]]) -> Any:
+        level = current_priority.get()
+        for attempt in itertools.count():
+            grant = await self.aacquire(tokens, level)
+            try:
+                result = await fn()
+            except Exception as e:
+                self.release(grant)
+                status = self._failed(e)
+                if status is None:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e, status))
+                continue
+            except BaseException:
+                self.release(grant)
+                raise
+            self.release(grant, usage(result) if usage else None)
+            upstream_requests.inc(backend=self.name, result="ok")
+            return result
+
+    def call(self, fn: Callable[[], Any], tokens: int = 1, key: Optional[str] = None,
+             usage: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        """
+        Runs a blocking upstream call under this scheduler.
+
+        :param tokens: estimated cost, charged against the per-minute budget until `usage` reports the actual one
+        :param key: calls with the same key in flight at the same time share one request
+        """
+        if key is None:
+            return self._call(fn, tokens, usage)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            print("Joining in-flight {} call for key: {}".format(self.name, key))
+            return flight.result()
+
+        try:
+            result = self._call(fn, tokens, usage)
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], tokens: int = 1, key: Optional[str] = None,
+                    usage: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        """Async form of call()."""
+        if key is None:
+            return await self._acall(fn, tokens, usage)
+        return await self._async_flights.do(key, lambda: self._acall(fn, tokens, usage))
+
+    async def astream(self, open_stream: Callable[[], AsyncIterator[Any]], tokens: int = 1,
+                      usage: Optional[Callable[[Any], Optional[int]]] = None) -> AsyncIterator[Any]:
+        """
+        Yields from an upstream stream, holding a slot until it ends.
+
+        A failure is only retried before the first chunk; after that the caller has
+        already seen part of the answer.
+        """
+        level = current_priority.get()
+        for attempt in itertools.count():
+            grant = await self.aacquire(tokens, level)
+            started = False
+            used = None
+            try:
+                async for chunk in open_stream():
+                    started = True
+                    chunk_usage = usage(chunk) if usage else None
+                    if chunk_usage is not None:
+                        used = (used or 0) + chunk_usage
+                    yield chunk
+            except Exception as e:
+                self.release(grant)
+                status = self._failed(e)
+                if status is None or started:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e, status))
+                continue
+            except BaseException:
+                self.release(grant)
+                raise
+            self.release(grant, used)
+            upstream_requests.inc(backend=self.name, result="ok")
+            return
+
+
+def _per_worker(value: int) -> int:
+    """Splits a deployment-wide limit across the worker processes; 0 stays unlimited."""
+    return max(1, value // max(1, settings.web_concurrency)) if value else 0
+
+
+def _scheduler(name: str, concurrency: int, tokens_per_minute: int, reserved: int = 0) -> UpstreamScheduler:
+    return UpstreamScheduler(
+        name,
+        max_concurrency=_per_worker(concurrency),
+        tokens_per_minute=_per_worker(tokens_per_minute),
+        reserved=reserved,
+        max_retries=settings.upstream_max_retries,
+        base_delay=settings.upstream_backoff_base,
+        max_delay=settings.upstream_backoff_max,
+        queue_timeout=settings.upstream_queue_timeout,
+    )
+
+
+SCHEDULERS = {
+    "chat": _scheduler("chat", settings.upstream_chat_concurrency, settings.upstream_chat_tokens_per_minute,
+                       reserved=settings.upstream_interactive_reserve),
+    "embeddings": _scheduler("embeddings", settings.upstream_embedding_concurrency,
+                             settings.upstream_embedding_tokens_per_minute, reserved=settings.upstream_interactive_reserve),
+    # Budgeted in pages rather than tokens
+    "parser": _scheduler("parser", settings.upstream_parser_concurrency, settings.upstream_parser_pages_per_minute),
+}
+
+
+def get_scheduler(name: str) -> UpstreamScheduler:
+    return SCHEDULERS[name]
+
+
+def estimate_tokens(texts: List[str]) -> int:
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+def chat_usage(result) -> Optional[int]:
+    """Total tokens reported on a ChatResult's or a ChatGenerationChunk's message."""
+    generations = result.generations if isinstance(result, ChatResult) else [result]
+    totals = [(getattr(g.message, "usage_metadata", None) or {}).get("total_tokens") for g in generations]
+    totals = [total for total in totals if isinstance(total, int)]
+    return sum(totals) if totals else None
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    Sends every call of the wrapped chat model through the "chat" scheduler.
+
+    Each call is charged its prompt plus `upstream_chat_output_tokens` until the model
+    reports its actual usage. Identical non-streaming prompts in flight share one call.
+    """
+
+    inner: BaseChatModel
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    def _tokens(self, messages: List[BaseMessage]) -> int:
+        return estimate_tokens([str(m.content) for m in messages]) + settings.upstream_chat_output_tokens
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> str:
+        payload = repr((id(self.inner), [(m.type, m.content) for m in messages], stop, sorted(kwargs.items())))
+        return "chat:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return get_scheduler("chat").call(
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=self._tokens(messages),
+            key=self._key(messages, stop, kwargs),
+            usage=chat_usage,
+        )
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return await get_scheduler("chat").acall(
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=self._tokens(messages),
+            key=self._key(messages, stop, kwargs),
+            usage=chat_usage,
+        )
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in get_scheduler("chat").astream(
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=self._tokens(messages),
+            usage=chat_usage,
+        ):
+            yield chunk
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Sends the wrapped embedding model's calls through the "embeddings" scheduler.
+
+    Sits inside CachedEmbeddings, so only cache misses are charged to the budget.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        key = "documents:" + hashlib.sha256("\0".join(texts).encode("utf-8")).hexdigest()
+        return get_scheduler("embeddings").call(
+            lambda: self.embeddings.embed_documents(texts), tokens=estimate_tokens(texts), key=key,
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        key = "query:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return get_scheduler("embeddings").call(
+            lambda: self.embeddings.embed_query(text), tokens=estimate_tokens([text]), key=key,
+        )
@@ -1,82 +1,250 @@
-from typing import List, Optional
-from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
-import chromadb
-from langchain_community.vectorstores import Chroma
-import vertexai
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain_text_splitters import MarkdownHeaderTextSplitter
+from typing import TYPE_CHECKING, List, Optional
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
 from collections import OrderedDict
 from app.core.config import settings
+from app.core.embeddings import CachedEmbeddings
+from app.core.upstream import ScheduledChatModel, ScheduledEmbeddings
 
+import fcntl
 import hashlib
-import nltk
+import os
+import shutil
+import threading
+import weakref
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 import json
+import re
 from collections import defaultdict
 from tabulate import tabulate
-from pytablereader import MarkdownTableTextLoader
-from langchain_core.prompts import ChatPromptTemplate
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+# Vertex AI, Chroma, LangChain chains, unstructured, NLTK, scikit-learn and pytablereader
+# take seconds to import, so they are imported where they are first used. Workers then boot
+# quickly and only pay for what they serve; retrieval.prewarm() loads the rest in the background.
+if TYPE_CHECKING:
+    from langchain.chains import RetrievalQA
+    from langchain_community.vectorstores import Chroma
 
-def init_nltk_deps():
-    nltk.download('punkt_tab')
-    nltk.download('averaged_perceptron_tagger_eng')
+# NLTK data used by the unstructured markdown loader; bundle it into nltk_data_dir at build time:
+#   python -m nltk.downloader -d nltk_data punkt_tab averaged_perceptron_tagger_eng
+NLTK_RESOURCES = {
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+}
+
+
+def use_nltk_data():
+    """
+    Puts the bundled nltk_data_dir first on NLTK's search path.
+
+    Called by everything that needs the data, so it is found whether or not the
+    background prewarm has run yet; NLTK is only imported on first use.
+    """
+    import nltk
+
+    path = os.path.abspath(settings.nltk_data_dir)
+    if path not in nltk.data.path:
+        nltk.data.path.insert(0, path)
+
+
+def check_nltk_resources() -> List[str]:
+    """
+    Checks that the bundled NLTK resources are available without downloading anything.
+
+    :return: names of the missing resources (empty when everything is in place)
+    """
+    import nltk
+
+    use_nltk_data()
+
+    missing = []
+    for name, path in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            missing.append(name)
+    if missing:
+        print("Missing NLTK resources {}; bundle them with: python -m nltk.downloader -d {} {}".format(
+            missing, settings.nltk_data_dir, " ".join(missing)))
+    return missing
 
 
 def init_vertex_ai():
+    import vertexai
+
     PROJECT_ID = "planar-cistern-448818-f5"  
     REGION = "us-central1" 
     vertexai.init(project=PROJECT_ID, location=REGION)
 
 
-def make_store(id:str,docs) -> tuple[Chroma, object]:
+INDEX_COLLECTION = "statement"
+INDEX_READY_MARKER = "READY"
+
+
+def get_markdown_path(id: str) -> str:
+    return os.path.join(settings.data_dir, f"{id}.md")
+
+
+def get_pdf_path(id: str) -> str:
+    return os.path.join(settings.data_dir, f"{id}.pdf")
+
+
+def get_index_path(id: str) -> str:
+    """Directory holding the persisted vector index for a document hash."""
+    return os.path.join(settings.data_dir, "index", id)
+
+
+def index_exists(id: str) -> bool:
+    """An index only counts once it has been fully written and marked ready."""
+    return os.path.exists(os.path.join(get_index_path(id), INDEX_READY_MARKER))
+
+
+# One lock per document hash, dropped once no thread holds or waits on it
+_index_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_index_locks_lock = threading.Lock()
+
+
+@contextmanager
+def index_build_lock(id: str):
+    """
+    Serializes building the index of one document across threads and worker processes.
+
+    make_store replaces a half-written index directory, so a second build of the same
+    document must not start while the first is still writing; callers re-check
+    index_exists once they hold the lock. The lock file sits next to the index
+    directory, since that directory is removed and recreated.
+    """
+    with _index_locks_lock:
+        lock = _index_locks.get(id)
+        if lock is None:
+            lock = _index_locks[id] = threading.Lock()
+
+    root = os.path.dirname(get_index_path(id))
+    os.makedirs(root, exist_ok=True)
+    with lock, open(os.path.join(root, f"{id}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Long-lived upstream clients shared by every request, created once by init_clients()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def create_embedding_model() -> CachedEmbeddings:
+    from langchain_google_vertexai import VertexAIEmbeddings
+
     try:
-        model = VertexAIEmbeddings(model="text-embedding-005")
+        # One attempt per call; retries and backoff are left to the upstream scheduler
+        model = VertexAIEmbeddings(model=settings.embedding_model, max_retries=1)
     except Exception as e:
         raise RuntimeError(f"Error initializing VertexAI model: {str(e)}")
 
-    # TODO: revisit this initialization
+    return CachedEmbeddings(
+        ScheduledEmbeddings(model),
+        model_name=settings.embedding_model,
+        cache_path=os.path.join(settings.data_dir, "embeddings.sqlite3"),
+        batch_size=settings.embedding_batch_size,
+    )
+
+
+def make_store(id: str, docs, metadata: Optional[dict] = None) -> tuple["Chroma", object]:
+    """
+    Embeds the documents into an on-disk Chroma index keyed by the document hash.
+
+    The index is written into its own directory and only marked ready once the
+    embeddings and metadata are flushed, so a crash mid-ingest never leaves a
+    half-built index behind that later queries would trust. Call it while holding
+    index_build_lock(id).
+    """
+    from langchain_community.vectorstores import Chroma
+
+    model = get_embedding_model()
+    persist_directory = get_index_path(id)
+    if os.path.exists(persist_directory):
+        RetrieverCache().delete(id)
+        release_index(id)
+        shutil.rmtree(persist_directory)
+    os.makedirs(persist_directory, exist_ok=True)
+
     store = Chroma.from_documents(
         documents=docs,
         embedding=model,
-        collection_name= id #TODO: revisit this
-    ) 
-    
-    print('Vector DB created successfully!')
+        collection_name=INDEX_COLLECTION,
+        persist_directory=persist_directory,
+    )
+
+    metadata = dict(metadata or {})
+    metadata["embedding_cache"] = {
+        "hits": model.last_hits,
+        "misses": model.last_misses,
+        "hit_ratio": round(model.last_hit_ratio, 4),
+    }
+    with open(os.path.join(persist_directory, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    with open(os.path.join(persist_directory, INDEX_READY_MARKER), "w") as f:
+        f.write(id)
+
+    print('Vector DB created successfully at {}'.format(persist_directory))
     return store, model
 
 
-def make_retriever(id: Optional[str], data: dict) -> chromadb.Client:
-    kv_store = KeyValueStore()
-    if not id: 
-        id = "default"
-    
-    if kv_store.get(id):
-        print("Cached Retriever present in store with id: {}".format(id))
-        return kv_store.get(id)
-    else:
-        collection_id = f"rag-{kv_store.len()}"
-        store, _ = make_store(collection_id,data["docs"])
-        retriever = store.as_retriever()
-        kv_store.set(id, (retriever,data["metadata"]))
-        print("Created new Retriever and stored in store with id: {}".format(id))
-        return retriever
-
-def get_retriever(id: Optional[str]) -> chromadb.Client:
-    kv_store = KeyValueStore()
-    if not id: 
-        id = "default"
-    
-    if kv_store.get(id):
-        print("Using Cached Retriever with id: {}".format(id))
-        return kv_store.get(id)
-    else:
-        return (None,None)
+def load_store(id: str) -> tuple[Optional["Chroma"], Optional[dict]]:
+    """
+    Opens a previously persisted index without re-embedding anything.
+
+    Chroma only reads the collection segments from disk on the first query, so
+    opening is cheap; the embedding model is attached for query embeddings only.
+    """
+    if not index_exists(id):
+        return None, None
+
+    from langchain_community.vectorstores import Chroma
+
+    persist_directory = get_index_path(id)
+    store = Chroma(
+        collection_name=INDEX_COLLECTION,
+        embedding_function=get_embedding_model(),
+        persist_directory=persist_directory,
+    )
+    metadata_path = os.path.join(persist_directory, "metadata.json")
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    return store, metadata
+
+
+def estimate_index_bytes(id: str) -> int:
+    """Approximates the memory an open index needs by its size on disk."""
+    total = 0
+    for root, _, files in os.walk(get_index_path(id)):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def release_index(id: str):
+    """
+    Drops Chroma's process-wide handle on a persisted index.
+
+    The system is not stopped, so a request still holding the retriever can finish;
+    the segments are freed once the last reference goes away.
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    SharedSystemClient._identifier_to_system.pop(get_index_path(id), None)
+
+
+# Bump whenever the QA prompt or the answer extraction changes, so cached answers are regenerated
+QA_PROMPT_VERSION = "2"
+
 
 def get_custom_prompt():
     """
@@ -129,18 +297,73 @@ def get_custom_prompt():
                             input_variables=['context', 'question'])
     return prompt
 
-def get_chat_model():
+CHAT_MODEL_NAME = "gemini-2.0-flash-exp"
+
+
+def create_chat_model():
+    from langchain_google_vertexai import ChatVertexAI
+
     try:
         chat_model = ChatVertexAI(
-            model_name="gemini-2.0-flash-exp",
+            model_name=CHAT_MODEL_NAME,
             project="planar-cistern-448818-f5",
+            max_retries=1,
         )
-        return chat_model
+        return ScheduledChatModel(inner=chat_model)
     except Exception as e:
         raise RuntimeError(f"Error initializing VertexAI Chat Model: {str(e)}")
 
 
-def get_retrieval_qa(chat_model, retriever, prompt: PromptTemplate) -> RetrievalQA:
+def init_clients():
+    """Creates the shared chat and embedding clients; called once at app startup."""
+    get_chat_model()
+    get_embedding_model()
+    print("Initialized shared chat and embedding clients")
+
+
+def use_clients(chat_model=None, embeddings: Optional[Embeddings] = None):
+    """
+    Replaces the shared upstream clients, e.g. with deterministic fakes for benchmarks.
+
+    They go through the same upstream schedulers as the Vertex AI clients, and
+    embeddings are wrapped in the same chunk cache.
+    """
+    with _clients_lock:
+        if chat_model is not None:
+            _clients["chat"] = ScheduledChatModel(inner=chat_model)
+        if embeddings is not None:
+            _clients["embeddings"] = CachedEmbeddings(
+                ScheduledEmbeddings(embeddings),
+                model_name=type(embeddings).__name__,
+                cache_path=os.path.join(settings.data_dir, "embeddings.sqlite3"),
+                batch_size=settings.embedding_batch_size,
+            )
+
+
+def _get_client(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def existing_client(name: str):
+    """The shared client if something already created it, else None; never creates one."""
+    return _clients.get(name)
+
+
+def get_chat_model():
+    return _get_client("chat", create_chat_model)
+
+
+def get_embedding_model() -> CachedEmbeddings:
+    return _get_client("embeddings", create_embedding_model)
+
+
+def get_retrieval_qa(chat_model, retriever, prompt: PromptTemplate) -> "RetrievalQA":
     """
     Creates and returns a RetrievalQA instance.
 
@@ -152,6 +375,8 @@ def get_retrieval_qa(chat_model, retriever, prompt: PromptTemplate) -> Retrieval
     Returns:
         RetrievalQA: An instance of the RetrievalQA chain.
     """
+    from langchain.chains import RetrievalQA
+
     qa = RetrievalQA.from_chain_type(
         llm=chat_model,
         chain_type="stuff",
@@ -161,7 +386,72 @@ def get_retrieval_qa(chat_model, retriever, prompt: PromptTemplate) -> Retrieval
     )
     return qa
 
+MARKDOWN_ANSWER = re.compile(r"```markdown\n(.*?)(?:\n```|\Z)", re.DOTALL)
+
+
+def extract_markdown_answer(content: str) -> str:
+    """
+    The answer inside the first ```markdown fence, up to its closing fence or the end of
+    the output (a truncated answer); answers without an opening fence are returned unchanged.
+    """
+    match = MARKDOWN_ANSWER.search(content)
+    return match.group(1) if match else content
+
+
+class MarkdownFenceStripper:
+    """
+    Incrementally applies extract_markdown_answer to a streamed answer.
+
+    Text before the opening fence is held back, since it is dropped if a fence follows
+    and returned as-is if none does. Inside the fence, only the few characters that
+    could still turn out to be the closing fence are held back between chunks.
+    """
+    OPEN = "```markdown\n"
+    CLOSE = "\n```"
+
+    def __init__(self):
+        self._buffer = ""
+        self._state = "head"
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        if self._state == "head":
+            idx = self._buffer.find(self.OPEN)
+            if idx < 0:
+                return ""
+            self._buffer = self._buffer[idx + len(self.OPEN):]
+            self._state = "body"
+
+        if self._state == "body":
+            idx = self._buffer.find(self.CLOSE)
+            if idx >= 0:
+                out = self._buffer[:idx]
+                self._buffer = ""
+                self._state = "closed"
+                return out
+            keep = 0
+            for size in range(min(len(self.CLOSE) - 1, len(self._buffer)), 0, -1):
+                if self.CLOSE.startswith(self._buffer[-size:]):
+                    keep = size
+                    break
+            out = self._buffer[:len(self._buffer) - keep]
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            return out
+
+        return ""
+
+    def flush(self) -> str:
+        out = "" if self._state == "closed" else self._buffer
+        self._buffer = ""
+        return out
+
+
 def split_markdown(file_path: str) -> List[Document]:
+    from langchain_community.document_loaders import UnstructuredMarkdownLoader
+    from langchain_text_splitters import MarkdownHeaderTextSplitter
+
+    use_nltk_data()
+
     loader = UnstructuredMarkdownLoader(file_path)
     markdown_document = loader.load()
     headers_to_split_on = [("#", "Header 1"),("##", "Header 2"),("###", "Header 3")]
@@ -171,6 +461,8 @@ def split_markdown(file_path: str) -> List[Document]:
     return splits
 
 def get_markdown_table_as_df(content: str):
+    from pytablereader import MarkdownTableTextLoader
+
     reader = MarkdownTableTextLoader(text=content)
 
     table_groups = defaultdict(list)
@@ -190,66 +482,149 @@ def get_markdown_table_as_df(content: str):
 
 
 # Standardized schema for transaction tables
-STANDARD_SCHEMA = ['Date', 'Description', 'Transaction', 'Type', 'Debit', 'Credit', 'Balance']
-
-def map_headers_to_standard(headers_list):
-    """
-    Maps extracted table headers to a standardized schema using TF-IDF and cosine similarity.
+STANDARD_SCHEMA = ['Date', 'Description', 'Transaction', 'Type', 'Debit', 'Credit', 'Amount', 'Balance', 'Reference']
+
+# Header spellings seen on bank statements, grouped by the standard column they mean
+STANDARD_SYNONYMS = {
+    'Date': ['date', 'transaction date', 'posting date', 'post date', 'posted date', 'value date', 'value dt', 'txn date', 'txn dt', 'date posted', 'trans date', 'effective date'],
+    'Description': ['description', 'details', 'particulars', 'narration', 'narrative', 'memo', 'payee', 'merchant', 'transaction description', 'transaction details'],
+    'Transaction': ['transaction', 'transactions'],
+    'Type': ['type', 'transaction type', 'txn type', 'dr/cr', 'cr/dr'],
+    'Debit': ['debit', 'debits', 'debit amount', 'withdrawal', 'withdrawals', 'withdrawal amount', 'money out', 'paid out', 'debits and withdrawals', 'checks and withdrawals',
+              'checks paid', 'cheques paid', 'checks', 'payments', 'payments and debits', 'other debits', 'electronic withdrawals', 'atm withdrawals', 'amount debited'],
+    'Credit': ['credit', 'credits', 'credit amount', 'deposit', 'deposits', 'deposit amount', 'money in', 'paid in', 'deposits and credits', 'deposits and additions',
+               'additions', 'other credits', 'electronic deposits', 'amount credited', 'receipts'],
+    'Amount': ['amount', 'transaction amount', 'amount ($)', 'value'],
+    'Balance': ['balance', 'running balance', 'closing balance', 'available balance', 'ledger balance', 'daily balance', 'balance ($)'],
+    'Reference': ['reference', 'ref', 'ref no', 'reference number', 'cheque no', 'check no', 'check number', 'chq no'],
+}
+
+# Statement fields that look like a standard column but are not one ("Closing Date" is not a
+# transaction date, "Account Number" is not a reference); these always keep their original name
+UNMAPPED_HEADERS = {
+    'closing date', 'opening date', 'statement date', 'due date', 'payment due date', 'statement period',
+    'interest rate', 'page',
+}
+UNMAPPED_WORDS = {'account', 'card', 'routing', 'iban', 'swift', 'page', 'period'}
+
+# Headers scoring below this cosine similarity keep their original name
+HEADER_MATCH_THRESHOLD = 0.6
+# ...and so do headers whose best column beats the next best one by less than this
+HEADER_MATCH_MARGIN = 0.1
+# Scores this high are a spelling of a synonym, never ambiguous
+HEADER_EXACT_MATCH = 0.99
+# Bump whenever STANDARD_SYNONYMS or the thresholds change, so cached mappings (and the
+# transactions tables, whose TRANSACTIONS_VERSION includes this one) are rebuilt
+HEADER_MAPPING_VERSION = "2"
+
+
+def normalize_header(header) -> str:
+    return " ".join(str(header).lower().replace("\n", " ").split())
+
+
+class HeaderMapper:
     """
-    # Flatten the headers and remove duplicates
-    all_headers = list(set(sum(headers_list, [])))
-    
-    # Combine extracted headers with the standard schema for vectorization
-    combined_headers = all_headers + STANDARD_SCHEMA
+    Maps raw table headers onto STANDARD_SCHEMA.
 
-    # Convert headers into TF-IDF vectors
-    vectorizer = TfidfVectorizer().fit_transform(combined_headers)
-    vectors = vectorizer.toarray()
+    The character n-gram TF-IDF model over STANDARD_SYNONYMS is fitted once per
+    process, and every header ever resolved is remembered in a JSON file under the
+    data directory, since banks reuse the same headers month after month. Only
+    headers never seen before are vectorized, all of them in a single batch.
 
-    # Separate vectors for original headers and standard schema
-    original_vectors = vectors[:len(all_headers)]
-    standard_vectors = vectors[len(all_headers):]
+    A header that is weakly or ambiguously similar to the synonyms stays unmapped:
+    a missing column is safer than, say, paid checks counted as credits.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                from sklearn.feature_extraction.text import TfidfVectorizer
+
+                instance = super(HeaderMapper, cls).__new__(cls)
+                labels, synonyms = [], []
+                for column, names in STANDARD_SYNONYMS.items():
+                    labels.extend([column] * len(names))
+                    synonyms.extend(names)
+                instance.labels = np.array(labels)
+                instance.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
+                instance.standard_vectors = instance.vectorizer.fit_transform(synonyms)
+                instance.cache_path = os.path.join(settings.data_dir, f"header_mappings.v{HEADER_MAPPING_VERSION}.json")
+                instance.cache = {}
+                if os.path.exists(instance.cache_path):
+                    with open(instance.cache_path, "r", encoding="utf-8") as f:
+                        instance.cache = json.load(f)
+                cls._instance = instance
+        return cls._instance
 
-    # Compute cosine similarity
-    similarity_matrix = cosine_similarity(original_vectors, standard_vectors)
+    def map(self, headers) -> dict:
+        """Returns {raw header: standard column or None} for every header given."""
+        normalized = {header: normalize_header(header) for header in headers}
+        with self._lock:
+            unseen = sorted({n for n in normalized.values() if n and n not in self.cache})
+            if unseen:
+                # TF-IDF rows are L2-normalized, so the dot product is the cosine similarity
+                similarity = (self.vectorizer.transform(unseen) @ self.standard_vectors.T).toarray()
+                self.cache.update((header, self._match(header, scores)) for header, scores in zip(unseen, similarity))
+                self._save()
+            return {header: self.cache.get(n) for header, n in normalized.items()}
+
+    def _match(self, header: str, scores: np.ndarray) -> Optional[str]:
+        if header in UNMAPPED_HEADERS or set(re.findall(r"[a-z]+", header)) & UNMAPPED_WORDS:
+            return None
+        order = np.argsort(-scores)
+        best = order[0]
+        if scores[best] >= HEADER_EXACT_MATCH:
+            return str(self.labels[best])
+        runner_up = next((scores[i] for i in order[1:] if self.labels[i] != self.labels[best]), 0.0)
+        if scores[best] < HEADER_MATCH_THRESHOLD or scores[best] - runner_up < HEADER_MATCH_MARGIN:
+            return None
+        return str(self.labels[best])
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        with open(self.cache_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, indent=2, sort_keys=True)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
 
-    # Map headers to the most similar standardized header
-    header_mapping = {}
-    for idx, header in enumerate(all_headers):
-        most_similar_index = similarity_matrix[idx].argmax()
-        header_mapping[header] = STANDARD_SCHEMA[most_similar_index]
-    
-    return header_mapping
 
-def extract_and_standardize_tables(markdown_content):
-    """
-    Extracts tables from markdown content, standardizes column headers, and returns DataFrames.
+def map_headers_to_standard(headers_list):
     """
-    reader = MarkdownTableTextLoader(text=markdown_content)
-    table_groups = defaultdict(list)
+    Maps extracted table headers to the standardized schema.
 
-    for table in reader.load():
-        headers = tuple(table.headers)
-        table_groups[headers].extend(table.rows)
+    :param headers_list: Iterable of header tuples, one per table
+    :return: Dictionary of raw header -> standard column (None when nothing is similar enough)
+    """
+    all_headers = {header for headers in headers_list for header in headers}
+    return HeaderMapper().map(all_headers)
 
-    # Get header mappings
-    header_mapping = map_headers_to_standard(list(table_groups.keys()))
 
-    # Convert tables into DataFrames with standardized headers
-    dataframes = {}
-    dataframes = {headers: pd.DataFrame(rows, columns=headers) for headers, rows in table_groups.items()}
-    for headers, rows in table_groups.items():
-        # Map headers to standard schema
-        standardized_headers = [header_mapping.get(h, h) for h in headers]
-        
-        df = pd.DataFrame(rows, columns=standardized_headers)
-        dataframes[tuple(standardized_headers)] = df
+def extract_and_standardize_tables(markdown_content):
+    """
+    Extracts tables from markdown content, standardizes column headers, and returns DataFrames.
 
-        # Print the table with standardized headers
-        print(f"Table with headers {tuple(standardized_headers)}:")
-        print(tabulate(df, headers='keys', tablefmt='pretty'))
+    Headers of every table in the document are mapped in one batch. Within a table the
+    first column mapping to a standard name gets it; later duplicates keep their raw name.
+    """
+    dataframes = get_markdown_table_as_df(content=markdown_content)
+    header_mapping = map_headers_to_standard(dataframes.keys())
+
+    standardized = {}
+    for headers, df in dataframes.items():
+        standardized_headers = []
+        for header in headers:
+            column = header_mapping.get(header)
+            standardized_headers.append(column if column and column not in standardized_headers else header)
+
+        df.columns = standardized_headers
+        key = tuple(standardized_headers)
+        standardized[key] = pd.concat([standardized[key], df], ignore_index=True) if key in standardized else df
+
+        if settings.debug:
+            print(f"Table with headers {tuple(standardized_headers)}")
     
-    return dataframes
+    return standardized
 
 
 def sha256_hash(data: bytes) -> str:
@@ -257,65 +632,109 @@ def sha256_hash(data: bytes) -> str:
     hash_object = hashlib.sha256(data)
     return hash_object.hexdigest()
 
-class KeyValueStore:
-    _instance = None 
-    def __new__(cls, max_size=100):
-        if cls._instance is None:
-            cls._instance = super(KeyValueStore, cls).__new__(cls)
-            cls._instance.store = OrderedDict()
-            cls._instance.max_size = max_size  # Define LRU cache size
-        return cls._instance
+class RetrieverCache:
+    """
+    Process-wide LRU cache of open retrievers, bounded by estimated memory.
 
+    Each entry carries a size estimate; once the total exceeds `max_bytes` the
+    least recently used entries are evicted and their index released. All
+    operations hold a lock, so request handlers and ingestion threads can share it.
+    """
+    _instance = None
+    _lock = threading.RLock()
+
+    def __new__(cls, max_bytes=None):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(RetrieverCache, cls).__new__(cls)
+                cls._instance.store = OrderedDict()
+                # The budget is per host: every worker process keeps its own open indexes
+                cls._instance.max_bytes = max_bytes or settings.retriever_cache_max_bytes // max(1, settings.web_concurrency)
+                cls._instance.total_bytes = 0
+                cls._instance.hits = 0
+                cls._instance.misses = 0
+                cls._instance.evictions = 0
+        return cls._instance
 
-    def set(self, key: str, value):
-        """Store a value with a given key, evict least recently used if full."""
-        if key in self.store:
-            self.store.move_to_end(key)  # Mark as recently used
-        self.store[key] = value
-        if len(self.store) > self.max_size:
-            self.store.popitem(last=False)  # Evict least recently used item
+    def set(self, key: str, value, size_bytes: int, release=None):
+        """Store a value with its estimated size, evicting least recently used entries over budget."""
+        with self._lock:
+            if key in self.store:
+                self._remove(key, release_value=False)
+            self.store[key] = (value, size_bytes, release)
+            self.total_bytes += size_bytes
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.total_bytes > self.max_bytes and len(self.store) > 1:
+                oldest = next(iter(self.store))
+                self._remove(oldest)
+                self.evictions += 1
+                print("Evicted retriever with id: {}".format(oldest))
 
     def get(self, key: str):
-        """Retrieve the value for a given key, move it to the end (most recently used)."""
-        if key in self.store:
-            self.store.move_to_end(key)  # Mark as recently used
-            return self.store[key]
-        return None
+        """Retrieve the value for a given key and mark it as most recently used."""
+        with self._lock:
+            if key in self.store:
+                self.store.move_to_end(key)
+                self.hits += 1
+                return self.store[key][0]
+            self.misses += 1
+            return None
 
     def delete(self, key: str):
-        """Remove a key-value pair if the key exists."""
-        if key in self.store:
-            del self.store[key]
+        """Remove an entry and release its index if the key exists."""
+        with self._lock:
+            if key in self.store:
+                self._remove(key)
+
+    def _remove(self, key: str, release_value: bool = True):
+        _, size_bytes, release = self.store.pop(key)
+        self.total_bytes -= size_bytes
+        if release_value and release is not None:
+            release()
 
-    def get_all(self):
-        """Return all key-value pairs."""
-        return self.store.copy()
-    
     def clear(self):
-        """Clear the entire store."""
-        self.store.clear()
+        """Release and drop every entry."""
+        with self._lock:
+            for key in list(self.store):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.store),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
     
     def len(self):
         return len(self.store)
 
 
+# Bump whenever the analyzer prompt or input changes, so cached insights are recomputed
+ANALYZER_PROMPT_VERSION = "2"
+
+
 def get_analyzer_prompt():    
     prompt = ChatPromptTemplate.from_messages(
     [
         (
             "system",
-            "You are a expert in reading markdown tables and analyzing it.",
+            "You are a expert in reading pre-computed bank statement aggregates and analyzing them.",
         ),
         ("human", "{input}"),
     ])
     
     return prompt
 
-def get_analyzer_input(markdown_table_data: str):
-    input = f"""Here is a transactions data in the form of a markdown table.
-    {markdown_table_data}
+def get_analyzer_input(aggregates: str):
+    input = f"""Here are exact aggregates computed from a bank statement's transactions table.
+    {aggregates}
 
-    For this markdown table, give me a breakdown of the credit and debit expenses, what category they belong to, and a brief analysis of the trends you see from this transactions table. 
+    Using only these aggregates, group the merchants into categories and give me a breakdown of the credit and debit expenses per category, and a brief analysis of the trends you see.
+    The totals, counts and ratio are already exact: add up the listed merchant amounts for each category and do not re-estimate anything.
 
     Return the response in JSON format with the key "result".
 
@@ -434,28 +853,15 @@ def process_analyzer_response(message):
 
 def merge_dataframes(filtered_dataframes):
     """
-    Merges DataFrames that have the same number of columns while keeping the header of the first one.
+    Merges DataFrames by aligning their columns by name.
+
+    Tables are expected to share the standardized schema; a column missing from one
+    table is left empty for its rows instead of the whole table being dropped.
 
-    :param filtered_dataframes: Dictionary of DataFrames
-    :return: Merged DataFrame as JSON (or empty JSON if no valid DataFrames)
-    """
-    """
-    Merges DataFrames by keeping only the header of the first one.
-    
     :param filtered_dataframes: Dictionary of DataFrames
     :return: Merged DataFrame (or empty DataFrame if no valid DataFrames)
     """
-    merged_data = []
-    first_df = None
-
-    for df in filtered_dataframes.values():
-        if first_df is None:
-            first_df = df.copy()  # Keep the first DataFrame with headers
-            merged_data.append(first_df)
-        elif df.shape[1] == first_df.shape[1]:
-            merged_data.append(df.values)  # Append only data (drop headers)
-
-    merged_df = pd.concat([first_df] + [pd.DataFrame(data, columns=first_df.columns) for data in merged_data[1:]], 
-                          ignore_index=True) if merged_data else pd.DataFrame()
-    return merged_df
-
+    frames = [df for df in filtered_dataframes.values() if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
@@ -1,10 +1,49 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 
 from app.core.config import settings
+from app.core.http_cache import STREAMING_ROUTES, StreamingAwareGZipMiddleware
 from app.api.main import api_router
+from app.core.metrics import http_request_seconds
+from app.core.retrieval import prewarm
+from app.core.uploads import UploadSizeLimitMiddleware
+from app.core.utils import init_clients
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.prewarm_on_startup:
+        # Serve immediately; requests that arrive first create whatever they need on demand
+        app.state.prewarm = asyncio.create_task(run_in_threadpool(prewarm, settings.prewarm_indexes))
+    else:
+        init_clients()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Brotli when brotli-asgi is installed (it still serves gzip to clients without br), gzip otherwise.
+# Server-Sent Events are never compressed, so streamed tokens are not held back in a buffer.
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        gzip_fallback=True,
+        excluded_handlers=STREAMING_ROUTES,
+    )
+else:
+    app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=settings.compression_minimum_size)
+
+app.add_middleware(UploadSizeLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,5 +51,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"], 
+    expose_headers=["ETag"],
 )
-app.include_router(api_router, prefix=settings.api_v1_str)
\ No newline at end of file
+app.include_router(api_router, prefix=settings.api_v1_str)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # The route template keeps label cardinality bounded (no document ids)
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    return response
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import io
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core.parsing import PARSERS, PageParser, split_pdf_pages
+from app.core.textlayer import extract_page_markdown
+
+QA_ANSWER = """```markdown
+**Answer:** The requested details are listed below.
+
+| Date | Description | Amount |
+|---|---|---|
+| 2024-10-01 | SAMPLE MERCHANT | **$42.00** |
+```"""
+
+INSIGHTS_ANSWER = json.dumps({
+    "result": {
+        "credits": [
+            {"category": "Paycheck", "description": "Payroll deposits", "total_amount": 5000.0,
+             "transaction_count": 2, "notes": "Twice a month"},
+        ],
+        "debits": [
+            {"category": "Food & Dining", "description": "Groceries and restaurants", "total_amount": 812.4,
+             "transaction_count": 31},
+            {"category": "Subscriptions", "description": "Streaming services", "total_amount": 45.97,
+             "transaction_count": 3},
+        ],
+        "trends": {
+            "income_pattern": "Regular payroll deposits",
+            "spending_pattern": "Mostly small card purchases",
+        },
+    }
+})
+
+
+class FakeRateLimitError(Exception):
+    """What a fake backend raises to simulate an upstream 429 (quota exhausted)."""
+
+    status_code = 429
+
+
+def maybe_rate_limit(error_rate: float):
+    if error_rate and random.random() < error_rate:
+        raise FakeRateLimitError("Resource exhausted (fake)")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Vertex AI chat model.
+
+    Analyzer prompts get a valid insights JSON, everything else a short markdown answer.
+    `latency` seconds are spent per call (split across chunks when streaming) to mimic
+    the upstream round trip, and `error_rate` of the calls fail with a 429.
+    """
+
+    latency: float = 0.0
+    error_rate: float = 0.0
+    chunk_size: int = 8
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content)
+        return INSIGHTS_ANSWER if 'JSON format with the key "result"' in prompt else QA_ANSWER
+
+    def _usage(self, messages: List[BaseMessage], text: str) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4 + 1
+        output_tokens = len(text) // 4 + 1
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        maybe_rate_limit(self.error_rate)
+        text = self._respond(messages)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        maybe_rate_limit(self.error_rate)
+        text = self._respond(messages)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        maybe_rate_limit(self.error_rate)
+        chunks = self._chunks(self._respond(messages))
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        maybe_rate_limit(self.error_rate)
+        chunks = self._chunks(self._respond(messages))
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors seeded by the text's hash, so equal texts always embed the same."""
+
+    def __init__(self, size: int = 256, latency: float = 0.0, error_rate: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        maybe_rate_limit(self.error_rate)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        maybe_rate_limit(self.error_rate)
+        return self._embed(text)
+
+
+class FakeCloudParser(PageParser):
+    """
+    Stands in for LlamaParse: waits `latency` seconds per request, then returns what the
+    local text-layer engine reads from each page, whatever its confidence.
+    """
+
+    name = "fake-cloud-v1"
+    upstream = True
+    latency = 0.0
+    error_rate = 0.0
+
+    async def parse(self, pdf: bytes, file_name: str) -> List[str]:
+        await asyncio.sleep(self.latency)
+        maybe_rate_limit(self.error_rate)
+        return [extract_page_markdown(page)[0] for page in split_pdf_pages(io.BytesIO(pdf))]
+
+
+def install(chat_latency: float = 0.0, embedding_latency: float = 0.0, parser_latency: float = 0.0,
+            error_rate: float = 0.0):
+    """
+    Swaps every upstream backend of the app for the fakes above.
+
+    `error_rate` of every backend's calls fail with a 429, to exercise the upstream
+    schedulers' retries and backoff.
+    """
+    from app.core.config import settings
+    from app.core.utils import use_clients
+
+    use_clients(
+        chat_model=FakeChatModel(latency=chat_latency, error_rate=error_rate),
+        embeddings=FakeEmbeddings(latency=embedding_latency, error_rate=error_rate),
+    )
+    FakeCloudParser.latency = parser_latency
+    FakeCloudParser.error_rate = error_rate
+    PARSERS["fake"] = FakeCloudParser
+    settings.pdf_parser = "fake"
@@ -0,0 +1,190 @@
+"""
+Benchmarks the ingestion pipeline and the API with every upstream backend faked.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --sizes 10,1000,10000,50000 --requests 50 --json results.json
+
+For each statement size this reports table-extraction time, ingestion throughput,
+p50/p99 latency per endpoint and peak memory. Pass --fast-path off to parse every page
+through the fake cloud parser instead of the local text-layer engine, the --*-latency flags to
+simulate upstream round trips, and --error-rate to have that share of upstream calls
+rate limited (429) and retried.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Settings are read at import time, so the environment has to be in place first
+os.environ.setdefault("ENV", "benchmark")
+os.environ.setdefault("DEBUG", "false")
+for key in ("LLAMA_CLOUD_API_KEY", "GROQ_API_KEY", "GOOGLE_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "GOOGLE_CLOUD_PROJECT"):
+    os.environ.setdefault(key, "benchmark")
+os.environ.setdefault("API_V1_STR", "/api/v1")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="finsights-bench-")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from tabulate import tabulate  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.transactions import build_transactions_table  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+from benchmarks.synthetic import statement_markdown, statement_pdf, synthetic_rows  # noqa: E402
+
+API = settings.api_v1_str
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def time_call(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench_table_extraction(markdown: str, repeat: int) -> float:
+    return statistics.median(time_call(build_transactions_table, markdown) for _ in range(repeat))
+
+
+def bench_ingestion(client: TestClient, pdf: bytes, timeout: float) -> tuple[str, float]:
+    start = time.perf_counter()
+    response = client.post(f"{API}/submit", files={"file": ("statement.pdf", pdf, "application/pdf")})
+    response.raise_for_status()
+    id = response.json()["id"]
+
+    while time.perf_counter() - start < timeout:
+        job = client.get(f"{API}/jobs/{id}").json()
+        if job["stage"] == "done":
+            return id, time.perf_counter() - start
+        if job["stage"] == "failed":
+            raise RuntimeError("Ingestion failed: {}".format(job["error"]))
+        time.sleep(0.01)
+    raise TimeoutError("Ingestion did not finish within {}s".format(timeout))
+
+
+def bench_endpoints(client: TestClient, id: str, requests: int) -> dict:
+    """Latencies in seconds per endpoint; questions vary per request so the answer cache stays cold."""
+    calls = {
+        "get_tables": lambda i: client.post(f"{API}/get_tables", json={"id": id}),
+        "get_insights": lambda i: client.post(f"{API}/get_insights", json={"id": id}),
+        "query": lambda i: client.post(f"{API}/query", json={"id": id, "query": f"What did I spend at merchant {i}?"}),
+        "query (cached)": lambda i: client.post(f"{API}/query", json={"id": id, "query": "What is my total spending?"}),
+        "query/stream": lambda i: client.post(f"{API}/query/stream", json={"id": id, "query": f"List deposits for week {i}"}),
+        "query (filtered)": lambda i: client.post(f"{API}/query", json={"id": id, "query": f"debits over ${i + 1} in March"}),
+    }
+    latencies = {}
+    for name, call in calls.items():
+        samples = []
+        for i in range(requests):
+            start = time.perf_counter()
+            response = call(i)
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError("{} returned {}: {}".format(name, response.status_code, response.text[:200]))
+        latencies[name] = samples
+    return latencies
+
+
+def run(args) -> list[dict]:
+    settings.text_layer_fast_path = args.fast_path == "on"
+    results = []
+
+    # Installed before startup, so init_clients() finds the fakes in place
+    fakes.install(args.chat_latency, args.embedding_latency, args.parser_latency, args.error_rate)
+
+    with TestClient(app) as client:
+        for size in args.sizes:
+            rows = synthetic_rows(size, seed=size)
+            markdown = statement_markdown(rows)
+            pdf = statement_pdf(rows)
+
+            if args.trace_memory:
+                tracemalloc.start()
+
+            extraction = bench_table_extraction(markdown, args.repeat)
+            id, ingestion = bench_ingestion(client, pdf, args.timeout)
+            latencies = bench_endpoints(client, id, args.requests)
+
+            traced_peak = None
+            if args.trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+
+            result = {
+                "rows": size,
+                "pdf_kb": round(len(pdf) / 1024, 1),
+                "table_extraction_s": round(extraction, 4),
+                "ingestion_s": round(ingestion, 3),
+                "ingestion_rows_per_s": round(size / ingestion, 1),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+                "traced_peak_mb": round(traced_peak, 1) if traced_peak is not None else None,
+                "endpoints": {
+                    name: {
+                        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                    }
+                    for name, samples in latencies.items()
+                },
+            }
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: dict):
+    print("\n== {} rows ({} KB PDF) ==".format(result["rows"], result["pdf_kb"]))
+    print(tabulate([
+        ["table extraction", "{:.1f} ms".format(result["table_extraction_s"] * 1000)],
+        ["ingestion", "{:.2f} s ({} rows/s)".format(result["ingestion_s"], result["ingestion_rows_per_s"])],
+        ["peak RSS", "{} MB".format(result["peak_rss_mb"])],
+        ["peak traced", "{} MB".format(result["traced_peak_mb"]) if result["traced_peak_mb"] is not None else "-"],
+    ], tablefmt="simple"))
+    print(tabulate(
+        [[name, values["p50_ms"], values["p99_ms"]] for name, values in result["endpoints"].items()],
+        headers=["endpoint", "p50 ms", "p99 ms"],
+        tablefmt="simple",
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(v) for v in s.split(",")], default=[10, 1000, 10000, 50000],
+                        help="comma separated statement sizes in rows")
+    parser.add_argument("--requests", type=int, default=20, help="requests per endpoint and size")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of the table-extraction timing")
+    parser.add_argument("--fast-path", choices=["on", "off"], default="on", help="local text-layer parsing")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="seconds per fake chat call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per fake embedding call")
+    parser.add_argument("--parser-latency", type=float, default=0.0, help="seconds per fake cloud parse request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake upstream calls that return 429")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds to wait for one ingestion")
+    parser.add_argument("--trace-memory", action="store_true", help="also report the tracemalloc peak (slower)")
+    parser.add_argument("--json", help="write the results to this file for comparison across runs")
+    args = parser.parse_args()
+
+    print("Data directory: {}".format(settings.data_dir))
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
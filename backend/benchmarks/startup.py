@@ -0,0 +1,92 @@
+"""
+Benchmarks worker startup: how long a fresh process takes to import the app and to
+answer its first request, and how much memory it holds by then.
+
+Run from the backend directory:
+
+    python -m benchmarks.startup --runs 5 --json startup.json
+
+Every run is a new interpreter so nothing is warm from the previous one. The report
+also lists which heavy dependencies were imported eagerly; the goal is for that list
+to stay empty and for them to load during the background prewarm instead.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from tabulate import tabulate
+
+HEAVY_MODULES = [
+    "langchain_google_vertexai", "vertexai", "chromadb", "langchain_community.vectorstores",
+    "langchain.chains", "unstructured", "nltk", "sklearn", "pytablereader", "llama_parse",
+]
+
+# Runs inside the child interpreter and prints one JSON line
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter() - start
+eager = [name for name in {heavy!r} if name in sys.modules]
+
+from fastapi.testclient import TestClient
+from benchmarks import fakes
+fakes.install()
+with TestClient(app) as client:
+    client.get("{api}/metrics").raise_for_status()
+    first_response = time.perf_counter() - start
+
+scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+print(json.dumps({{
+    "import_s": imported,
+    "first_response_s": first_response,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+    "eager_imports": eager,
+}}))
+"""
+
+
+def probe(env: dict) -> dict:
+    env = dict(env, DATA_DIR=tempfile.mkdtemp(prefix="finsights-startup-"))
+    code = PROBE.format(heavy=HEAVY_MODULES, api=env["API_V1_STR"])
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to start")
+    parser.add_argument("--prewarm", choices=["on", "off"], default="on", help="background prewarm at startup")
+    parser.add_argument("--json", help="write the results to this file for comparison across runs")
+    args = parser.parse_args()
+
+    env = dict(os.environ, ENV="benchmark", DEBUG="false", PREWARM_ON_STARTUP="true" if args.prewarm == "on" else "false")
+    for key in ("LLAMA_CLOUD_API_KEY", "GROQ_API_KEY", "GOOGLE_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "GOOGLE_CLOUD_PROJECT"):
+        env.setdefault(key, "benchmark")
+    env.setdefault("API_V1_STR", "/api/v1")
+
+    runs = [probe(env) for _ in range(args.runs)]
+    result = {
+        key: round(statistics.median(run[key] for run in runs), 3)
+        for key in ("import_s", "first_response_s", "rss_mb")
+    }
+    result["eager_imports"] = sorted({name for run in runs for name in run["eager_imports"]})
+
+    print(tabulate([
+        ["import app.main", "{:.2f} s".format(result["import_s"])],
+        ["first response", "{:.2f} s".format(result["first_response_s"])],
+        ["RSS", "{:.1f} MB".format(result["rss_mb"])],
+        ["eager heavy imports", ", ".join(result["eager_imports"]) or "none"],
+    ], tablefmt="simple"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": runs, "result": result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
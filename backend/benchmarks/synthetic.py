@@ -0,0 +1,110 @@
+import random
+from datetime import date, timedelta
+from typing import List
+
+MERCHANTS = [
+    ("VISA PURCHASE WHOLE FOODS #{store}", 15, 180),
+    ("VISA PURCHASE STARBUCKS #{store}", 3, 12),
+    ("POS DEBIT SHELL OIL {store}", 20, 90),
+    ("AMAZON MKTPLACE PMTS AMZN.COM/BILL", 8, 250),
+    ("NETFLIX.COM", 15.99, 15.99),
+    ("SPOTIFY USA", 10.99, 10.99),
+    ("ONLINE TRANSFER TO SAVINGS {store}", 100, 1000),
+    ("CHECKCARD UBER TRIP {store}", 7, 45),
+    ("ACH DEBIT CITY UTILITIES", 60, 140),
+    ("ZELLE PAYMENT TO J SMITH", 20, 300),
+]
+DEPOSITS = [
+    ("DIRECT DEP ACME CORP PAYROLL", 2400, 2600),
+    ("ZELLE PAYMENT FROM A LEE", 20, 200),
+    ("REFUND AMAZON MKTPLACE", 5, 80),
+]
+HEADERS = ["Date", "Description", "Withdrawals", "Deposits", "Balance"]
+ROWS_PER_PAGE = 45
+
+
+def synthetic_rows(count: int, seed: int = 0, start: date = date(2024, 1, 1)) -> List[List[str]]:
+    """Generates `count` statement rows (date, description, withdrawal, deposit, balance) as strings."""
+    rng = random.Random(seed)
+    balance = 5000.0
+    day = start
+    rows = []
+    for _ in range(count):
+        day += timedelta(days=rng.random() < 0.3)
+        if rng.random() < 0.12:
+            template, low, high = rng.choice(DEPOSITS)
+            amount = round(rng.uniform(low, high), 2)
+            balance += amount
+            withdrawal, deposit = "", "{:,.2f}".format(amount)
+        else:
+            template, low, high = rng.choice(MERCHANTS)
+            amount = round(rng.uniform(low, high), 2)
+            balance -= amount
+            withdrawal, deposit = "{:,.2f}".format(amount), ""
+        description = template.format(store=rng.randint(100, 9999))
+        rows.append([day.strftime("%m/%d/%Y"), description, withdrawal, deposit, "{:,.2f}".format(balance)])
+    return rows
+
+
+def statement_markdown(rows: List[List[str]], rows_per_page: int = ROWS_PER_PAGE) -> str:
+    """The markdown a parser would produce for the statement: one pipe table per page."""
+    pages = []
+    for number, start in enumerate(range(0, len(rows), rows_per_page), 1):
+        table = ["| " + " | ".join(HEADERS) + " |", "|" + "|".join("---" for _ in HEADERS) + "|"]
+        table += ["| " + " | ".join(row) + " |" for row in rows[start:start + rows_per_page]]
+        pages.append(f"Synthetic Bank statement page {number}\n\n" + "\n".join(table))
+    return "\n\n".join(pages)
+
+
+def _pdf_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def statement_pdf(rows: List[List[str]], rows_per_page: int = ROWS_PER_PAGE) -> bytes:
+    """
+    Renders the rows as a digitally generated statement PDF with a text layer.
+
+    Amounts are right-aligned under their headers like on real statements.
+    Helvetica glyphs are approximated as half the font size wide.
+    """
+    columns = [(40, "left"), (110, "left"), (400, "right"), (480, "right"), (570, "right")]
+    size = 8
+    pages = []
+    for number, start in enumerate(range(0, len(rows), rows_per_page), 1):
+        ops = [f"BT /F1 {size} Tf 1 0 0 1 40 760 Tm (Synthetic Bank statement page {number}) Tj"]
+        y = 730
+        for cells in [HEADERS] + rows[start:start + rows_per_page]:
+            for (x, align), text in zip(columns, cells):
+                if not text:
+                    continue
+                if align == "right" and cells is not HEADERS:
+                    x -= len(text) * size * 0.5
+                elif align == "right":
+                    x -= 60
+                ops.append(f"1 0 0 1 {x:.2f} {y} Tm ({_pdf_string(text)}) Tj")
+            y -= 15
+        ops.append("ET")
+        pages.append(" ".join(ops).encode("latin-1"))
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for content in pages:
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
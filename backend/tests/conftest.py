@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Settings are read at import time, so the environment has to be in place before the app is imported
+os.environ.setdefault("ENV", "test")
+os.environ.setdefault("DEBUG", "false")
+for key in ("LLAMA_CLOUD_API_KEY", "GROQ_API_KEY", "GOOGLE_API_KEY", "GOOGLE_APPLICATION_CREDENTIALS", "GOOGLE_CLOUD_PROJECT"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("API_V1_STR", "/api/v1")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="finsights-test-")
+os.environ["PREWARM_ON_STARTUP"] = "false"
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from app.core.aggregates import format_chunk_for_prompt, split_merchants_by_budget, summarize_transactions
+
+
+def _statement() -> pd.DataFrame:
+    rows = [("2024-01-01", "ACME PAYROLL", None, 300000)]
+    for month in (1, 2, 3):
+        rows.append((f"2024-0{month}-05", "NETFLIX.COM", 1599, None))
+    for i in range(30):
+        rows.append((f"2024-01-{i % 28 + 1:02d}", f"STORE{chr(65 + i % 26)} {chr(65 + i // 26)}X MARKET", 1000 + i, None))
+    df = pd.DataFrame(rows, columns=["date", "transaction", "Debit", "Credit"])
+    df["date"] = pd.to_datetime(df["date"])
+    df["Debit"] = df["Debit"].astype("Int64")
+    df["Credit"] = df["Credit"].astype("Int64")
+    return df
+
+
+def test_every_map_prompt_carries_statement_context():
+    summary = summarize_transactions(_statement())
+    groups = split_merchants_by_budget(summary["merchants"], 100)
+    assert len(groups) > 1
+
+    # A part that holds none of the recurring merchant still sees it in the statement-wide context
+    part = next(group for group in groups if all(m["merchant"] != "NETFLIX COM" for m in group))
+    prompt = format_chunk_for_prompt(summary, part, 1, len(groups))
+
+    assert summary["recurring"][0]["merchant"] == "NETFLIX COM"
+    assert "NETFLIX COM" in prompt.split("Totals for this part")[0]
+    assert f'"total_credits": {summary["totals"]["total_credits"]}' in prompt
+    assert '"ratio": ' in prompt
+    assert "Busiest days" in prompt
@@ -0,0 +1,41 @@
+import pyarrow.parquet as pq
+
+from app.core import analytics
+from app.core.analytics import write_analytics
+from app.core.transactions import materialize_transactions
+from app.core.utils import get_markdown_path
+
+STATEMENT = """
+Account Number: XXXX-{account}
+
+| Date | Description | Withdrawals | Deposits | Balance |
+|---|---|---|---|---|
+| 0{month}/03/2024 | STARBUCKS #1234 | 5.25 | | 994.75 |
+| 0{month}/09/2024 | WHOLE FOODS #88 | 64.10 | | 930.65 |
+"""
+
+
+def ingest(id: str, account: str, month: int):
+    with open(get_markdown_path(id), "w", encoding="utf-8") as f:
+        f.write(STATEMENT.format(account=account, month=month))
+    materialize_transactions(id)
+    return write_analytics(id)
+
+
+def test_replacing_a_statement_only_rewrites_its_partitions(monkeypatch):
+    ingest("analytics-other", "1111", 1)
+    assert ingest("analytics-mine", "2222", 2) == 2
+
+    full_reads = []
+    read_table = pq.read_table
+
+    def spy(source, columns=None, **kwargs):
+        if columns is None and str(source).startswith(analytics.get_analytics_path()):
+            full_reads.append(source)
+        return read_table(source, columns=columns, **kwargs)
+
+    monkeypatch.setattr(analytics.pq, "read_table", spy)
+    assert ingest("analytics-mine", "2222", 2) == 2
+
+    assert full_reads and all("account=2222" in path for path in full_reads)
+    assert analytics.analytics_documents() >= {"analytics-other", "analytics-mine"}
@@ -0,0 +1,102 @@
+import asyncio
+from typing import List
+
+from langchain_core.documents import Document
+
+from app.core.answers import answer_cache, find_exact_answer, find_similar_answer
+from app.core.retrieval import BM25Index, HybridRetriever, transaction_documents, use_query_vector
+from app.core.transactions import build_transactions_table
+from app.core.utils import get_embedding_model, use_clients
+from benchmarks.fakes import FakeEmbeddings
+
+STATEMENT = """
+| Date | Description | Withdrawals | Deposits | Balance |
+|---|---|---|---|---|
+| 01/03/2024 | STARBUCKS #1234 | 5.25 | | 994.75 |
+| 01/09/2024 | WHOLE FOODS #88 | 64.10 | | 930.65 |
+| 02/01/2024 | ACME PAYROLL | | 1,000.00 | 1,930.65 |
+"""
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__(size=8)
+        self.queries: List[str] = []
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.searches = []
+
+    async def asimilarity_search_by_vector(self, vector, **kwargs):
+        self.searches.append(vector)
+        return [Document(page_content="Statement summary chunk")]
+
+
+class FakeVectorRetriever:
+    """Embeds through the shared client, like Chroma's retriever does."""
+
+    def __init__(self):
+        self.vectorstore = FakeVectorStore()
+        self.search_kwargs = {}
+
+    async def ainvoke(self, query, config=None):
+        await get_embedding_model().aembed_query(query)
+        return [Document(page_content="Statement summary chunk")]
+
+
+def make_retriever() -> HybridRetriever:
+    transactions = build_transactions_table(STATEMENT)
+    docs = [Document(page_content="Statement summary chunk")] + transaction_documents(transactions)
+    return HybridRetriever(vector_retriever=FakeVectorRetriever(), lexical=BM25Index(docs), transactions=transactions)
+
+
+def setup_embeddings() -> CountingEmbeddings:
+    embeddings = CountingEmbeddings()
+    use_clients(embeddings=embeddings)
+    return embeddings
+
+
+def test_filter_and_keyword_questions_are_not_embedded():
+    embeddings = setup_embeddings()
+    retriever = make_retriever()
+    for question in ("debits over $50 in January", "starbucks"):
+        assert find_exact_answer("doc-a", question) is None
+        assert asyncio.run(find_similar_answer("doc-a", question, retriever)) == (None, None)
+        docs = asyncio.run(retriever.ainvoke(question))
+        assert docs
+    assert embeddings.queries == []
+
+
+def test_vector_question_is_embedded_once():
+    embeddings = setup_embeddings()
+    retriever = make_retriever()
+    question = "how did my spending look overall"
+
+    cached, vector = asyncio.run(find_similar_answer("doc-b", question, retriever))
+    assert cached is None and vector is not None
+
+    async def retrieve():
+        with use_query_vector(question, vector):
+            return await retriever.ainvoke(question)
+
+    asyncio.run(retrieve())
+    assert embeddings.queries == [question]
+    assert retriever.vector_retriever.vectorstore.searches == [vector]
+
+
+def test_exact_and_similar_hits():
+    setup_embeddings()
+    retriever = make_retriever()
+    answer_cache.set("doc-c", "starbucks", None, "answer one", ["source"])
+    assert find_exact_answer("doc-c", "Starbucks?")["result"] == "answer one"
+
+    question = "how did my spending look overall"
+    _, vector = asyncio.run(find_similar_answer("doc-c", question, retriever))
+    answer_cache.set("doc-c", question, vector, "answer two", [])
+    cached, _ = asyncio.run(find_similar_answer("doc-c", question, retriever))
+    assert cached["result"] == "answer two"
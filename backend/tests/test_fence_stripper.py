@@ -0,0 +1,38 @@
+import pytest
+
+from app.core.utils import MarkdownFenceStripper, extract_markdown_answer
+
+ANSWERS = [
+    "```markdown\n**Answer:** $42.00\n```",
+    "```markdown\n| a | b |\n|---|---|\n| 1 | 2 |\n```\nTrailing notes the regex drops.",
+    "Here is what I found:\n```markdown\n**Answer:** $42.00\n```\nAnything else?",
+    "```markdown\n**Answer:** truncated before the closing fence",
+    "```markdown\n**Answer:** truncated mid-fence\n``",
+    "A plain answer without any fence.",
+    "Code ``` that is not a markdown fence\n```",
+    "```markdown\n```",
+    "",
+]
+
+
+def stream(answer: str, size: int) -> str:
+    stripper = MarkdownFenceStripper()
+    out = [stripper.feed(answer[i:i + size]) for i in range(0, len(answer), size)]
+    return "".join(out) + stripper.flush()
+
+
+@pytest.mark.parametrize("answer", ANSWERS)
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 1000])
+def test_streamed_answer_matches_non_streamed(answer, size):
+    assert stream(answer, size) == extract_markdown_answer(answer)
+
+
+def test_extracts_fenced_body():
+    assert extract_markdown_answer("intro\n```markdown\nbody\n```\nouter") == "body"
+    assert extract_markdown_answer("no fence") == "no fence"
+
+
+def test_text_before_fence_is_held_back():
+    stripper = MarkdownFenceStripper()
+    assert stripper.feed("Here is what I found:\n") == ""
+    assert stripper.feed("```markdown\nbody") == "body"
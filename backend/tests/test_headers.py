@@ -0,0 +1,49 @@
+import pytest
+
+from app.core.analytics import get_analytics_path
+from app.core.insights import insights_cache_key
+from app.core.transactions import TRANSACTIONS_VERSION, get_transactions_path
+from app.core.utils import HEADER_MAPPING_VERSION, HeaderMapper
+
+
+@pytest.mark.parametrize("header, column", [
+    ("Date", "Date"),
+    ("Posting Date", "Date"),
+    ("Trans. Date", "Date"),
+    ("Description", "Description"),
+    ("Transaction Details", "Description"),
+    ("Withdrawals", "Debit"),
+    ("Withdrawals ($)", "Debit"),
+    ("Debits", "Debit"),
+    ("Checks Paid", "Debit"),
+    ("Deposits", "Credit"),
+    ("Deposits/Credits", "Credit"),
+    ("Amount ($)", "Amount"),
+    ("Balance", "Balance"),
+    ("Running Bal", "Balance"),
+    ("Ref No.", "Reference"),
+])
+def test_maps_known_headers(header, column):
+    assert HeaderMapper().map([header])[header] == column
+
+
+@pytest.mark.parametrize("header", [
+    "Closing Date", "Opening Date", "Statement Date", "Account Number", "Card Number", "Page", "Interest Rate", "Category",
+])
+def test_leaves_other_fields_unmapped(header):
+    assert HeaderMapper().map([header])[header] is None
+
+
+def test_mappings_are_remembered():
+    mapper = HeaderMapper()
+    mapper.map(["Checks Paid", "Closing Date"])
+    assert mapper.cache["checks paid"] == "Debit"
+    assert mapper.cache["closing date"] is None
+
+
+def test_header_mapping_version_reaches_every_derived_key():
+    # Tables, their ETags, the analytics dataset and cached insights are all rebuilt with a new mapping
+    assert TRANSACTIONS_VERSION.endswith("." + HEADER_MAPPING_VERSION)
+    assert f"v{TRANSACTIONS_VERSION}." in get_transactions_path("doc")
+    assert get_analytics_path().endswith("." + TRANSACTIONS_VERSION)
+    assert f":{TRANSACTIONS_VERSION}:" in insights_cache_key("doc")
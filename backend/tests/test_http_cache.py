@@ -0,0 +1,67 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.api.routes import conversation
+from app.api.routes.conversation import ARROW_STREAM, TablePageRequest, table_page_response
+from app.core import insights
+from app.core.http_cache import StreamingAwareGZipMiddleware, document_etag, etag_matches
+from app.core.transactions import TRANSACTIONS_VERSION
+
+BODY = "data: token\n\n" * 500
+
+
+def make_client() -> TestClient:
+    async def text(request):
+        return PlainTextResponse(BODY)
+
+    app = Starlette(routes=[Route("/api/v1/query/stream", text), Route("/api/v1/documents", text)])
+    app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def test_streaming_routes_are_not_compressed():
+    client = make_client()
+    streamed = client.get("/api/v1/query/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in streamed.headers
+    assert streamed.text == BODY
+
+    compressed = client.get("/api/v1/documents", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.text == BODY
+
+
+def test_etag_comparison_is_weak():
+    etag = document_etag("doc", "1", "page", 2)
+    assert etag_matches(etag, etag)
+    assert etag_matches("W/" + etag, etag)
+    assert etag_matches('"other", ' + etag, etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(document_etag("doc", "1", "page", 3), etag)
+
+
+
+def test_table_page_304_repeats_vary():
+    req = TablePageRequest(id="not-ingested", page=2)
+    etag = document_etag(req.id, TRANSACTIONS_VERSION, req.page, req.page_size, req.sort_by, req.descending, [], "json")
+    response = asyncio.run(table_page_response(req, None, etag))
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.headers["Vary"] == "Accept"
+
+    # The Arrow variant has its own ETag, so the JSON one does not validate it
+    assert asyncio.run(table_page_response(req, ARROW_STREAM, etag)).status_code == 404
+
+
+def test_insights_etag_covers_pipeline_versions(monkeypatch):
+    etag = document_etag("doc", insights.insights_cache_key("doc"), weak=True)
+    assert asyncio.run(conversation.insights_response("doc", etag)).status_code == 304
+
+    for name in ("TRANSACTIONS_VERSION", "AGGREGATES_VERSION", "ANALYZER_PROMPT_VERSION"):
+        with monkeypatch.context() as patch:
+            patch.setattr(insights, name, "next")
+            assert asyncio.run(conversation.insights_response("doc", etag)).status_code != 304
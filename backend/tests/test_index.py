@@ -0,0 +1,75 @@
+import os
+import threading
+from typing import List
+
+from langchain_core.documents import Document
+
+from app.core.retrieval import get_retriever, make_retriever
+from app.core.utils import INDEX_READY_MARKER, RetrieverCache, get_index_path, index_exists, use_clients
+from benchmarks.fakes import FakeEmbeddings
+
+DOCS = [
+    Document(page_content="Opening balance 1,000.00 on 01/01/2024"),
+    Document(page_content="STARBUCKS #1234 5.25 on 01/03/2024"),
+]
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__(size=8)
+        self.documents: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.documents.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_persisted_index_reopens_without_reembedding():
+    id = "index-reopen-test"
+    embeddings = CountingEmbeddings()
+    use_clients(embeddings=embeddings)
+
+    make_retriever(id, {"docs": DOCS, "metadata": {"pages": 1}})
+    assert index_exists(id)
+    assert open(os.path.join(get_index_path(id), INDEX_READY_MARKER)).read() == id
+    embedded = len(embeddings.documents)
+    assert embedded > 0
+
+    # A cold process: nothing cached, only the files on disk
+    RetrieverCache().delete(id)
+    retriever, metadata = get_retriever(id)
+    assert retriever is not None
+    assert metadata["pages"] == 1
+    assert len(embeddings.documents) == embedded
+
+
+def test_index_without_ready_marker_is_ignored():
+    id = "index-unfinished-test"
+    os.makedirs(get_index_path(id), exist_ok=True)
+    assert not index_exists(id)
+    assert get_retriever(id) == (None, None)
+
+
+def test_concurrent_builds_of_one_index_run_once():
+    id = "index-concurrent-test"
+    embeddings = CountingEmbeddings()
+    use_clients(embeddings=embeddings)
+    # Texts no other test embeds, so the shared embedding cache cannot hide a second build
+    docs = [Document(page_content=f"WHOLE FOODS #{n} 64.10 on 01/09/2024") for n in range(3)]
+    errors = []
+
+    def build():
+        try:
+            make_retriever(id, {"docs": docs, "metadata": {"pages": 1}})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert index_exists(id)
+    assert len(embeddings.documents) == len(docs)
@@ -0,0 +1,72 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from app.api.routes import conversation
+from app.core import ingest
+from app.core.documents import document_store
+from app.core.ingest import resume_ingestion
+from app.core.jobs import IngestionInProgressError, ingestion_queue
+from app.core.utils import get_markdown_path
+
+
+def abandon(id: str, stage: str = "embedding"):
+    """A record left behind by a worker that died mid-ingestion."""
+    document_store.claim(id, "dead-worker:1", ingestion_queue.lease)
+    stale = time.time() - ingestion_queue.lease - 10_000
+    with sqlite3.connect(document_store.path) as conn:
+        conn.execute("UPDATE documents SET stage = ?, updated_at = ? WHERE id = ?", (stage, stale, id))
+
+
+def test_abandoned_job_does_not_block_queries(monkeypatch):
+    abandon("abandoned-query")
+    job = ingestion_queue.get("abandoned-query")
+    assert ingestion_queue.abandoned(job) and not ingestion_queue.running(job)
+
+    built = []
+    monkeypatch.setattr(conversation, "get_retriever", lambda id: (None, None))
+    monkeypatch.setattr(conversation, "split_markdown", lambda path: [])
+    monkeypatch.setattr(conversation, "make_retriever", lambda id, data: built.append(id) or "retriever")
+    assert conversation.load_retriever("abandoned-query") == "retriever"
+    assert built == ["abandoned-query"]
+
+
+def test_running_job_still_blocks_queries(monkeypatch):
+    document_store.claim("running-query", "other-worker:1", ingestion_queue.lease)
+    monkeypatch.setattr(conversation, "get_retriever", lambda id: (None, None))
+    with pytest.raises(IngestionInProgressError) as error:
+        conversation.load_retriever("running-query")
+    assert error.value.job.stage == "queued"
+
+
+def test_abandoned_job_without_its_input_is_marked_failed():
+    abandon("abandoned-gone")
+    job = resume_ingestion("abandoned-gone")
+    assert job.stage == "failed"
+    assert "upload" in job.error
+    assert ingestion_queue.get("abandoned-gone").stage == "failed"
+
+
+def test_abandoned_job_with_its_statement_on_disk_is_resumed(monkeypatch):
+    abandon("abandoned-resume")
+    with open(get_markdown_path("abandoned-resume"), "w") as f:
+        f.write("| Date | Description |")
+
+    resumed = []
+
+    async def pipeline(job):
+        resumed.append(job.id)
+
+    monkeypatch.setattr(ingest, "ingest_document", pipeline)
+
+    async def run():
+        job = resume_ingestion("abandoned-resume")
+        await job.task
+        return job
+
+    job = asyncio.run(run())
+    assert resumed == ["abandoned-resume"]
+    assert job.stage == "done"
+    assert document_store.get("abandoned-resume")["owner"] != "dead-worker:1"
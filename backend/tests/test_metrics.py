@@ -0,0 +1,26 @@
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app.api.routes import metrics
+from app.core import utils
+from benchmarks.fakes import FakeEmbeddings
+
+
+def test_scrape_does_not_create_upstream_clients(monkeypatch):
+    monkeypatch.setattr(utils, "_clients", {})
+
+    def no_client():
+        raise AssertionError("a scrape created the embeddings client")
+
+    monkeypatch.setattr(utils, "create_embedding_model", no_client)
+    app = FastAPI()
+    app.include_router(metrics.router)
+    client = TestClient(app)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "finsights_embedding_cache_chunks" not in response.text
+    assert utils._clients == {}
+
+    utils.use_clients(embeddings=FakeEmbeddings(size=8))
+    assert "finsights_embedding_cache_chunks" in client.get("/metrics").text
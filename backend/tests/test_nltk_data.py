@@ -0,0 +1,15 @@
+import os
+
+import nltk
+
+from app.core.config import settings
+from app.core.utils import use_nltk_data
+
+
+def test_bundled_path_is_added_once_and_absolute():
+    use_nltk_data()
+    use_nltk_data()
+    path = os.path.abspath(settings.nltk_data_dir)
+    assert nltk.data.path[0] == path
+    assert nltk.data.path.count(path) == 1
+    assert settings.nltk_data_dir not in nltk.data.path or os.path.isabs(settings.nltk_data_dir)
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from app.core.aggregates import summarize_transactions
+from app.core.retrieval import filter_transactions, parse_transaction_filters
+from app.core.transactions import build_transactions_table, normalize_transactions, parse_amounts, parse_dates
+
+NEGATIVE_DEBITS_STATEMENT = """
+| Date | Description | Withdrawals | Deposits | Balance |
+|---|---|---|---|---|
+| 01/03/2024 | STARBUCKS #1234 | -45.00 | | 955.00 |
+| 01/04/2024 | WHOLE FOODS #88 | -60.00 | | 895.00 |
+| 01/05/2024 | ACME PAYROLL | | 1,000.00 | 1,895.00 |
+"""
+
+
+def test_parse_amounts_formats():
+    cents, failed = parse_amounts(pd.Series(["$1,234.56", "(45.00)", "12.50-", "7.00 DR", "3.10 CR", "1.234,56", "", "abc"]))
+    assert cents.tolist()[:6] == [123456, -4500, -1250, -700, 310, 123456]
+    assert pd.isna(cents[6]) and pd.isna(cents[7])
+    assert failed.tolist() == [False] * 7 + [True]
+
+
+def test_separate_columns_store_magnitudes():
+    df = normalize_transactions(pd.DataFrame({"Debit": ["-45.00", "20.00"], "Credit": ["", "-5.00"]}))
+    assert df["Debit"].tolist() == [4500, 2000]
+    assert df["Credit"].tolist()[1] == 500
+
+
+def test_signed_amount_column_picks_the_side():
+    df = normalize_transactions(pd.DataFrame({"Amount": ["-45.00", "100.00"]}))
+    assert df["Debit"].tolist()[0] == 4500 and pd.isna(df["Debit"][1])
+    assert df["Credit"].tolist()[1] == 10000 and pd.isna(df["Credit"][0])
+
+
+def test_statement_with_negative_debits():
+    df = build_transactions_table(NEGATIVE_DEBITS_STATEMENT)
+    assert df["Debit"].dropna().tolist() == [4500, 6000]
+
+    summary = summarize_transactions(df)
+    assert summary["totals"]["total_debits"] == 105.0
+    assert summary["totals"]["debit_count"] == 2
+    assert summary["credit_debit_ratio"]["ratio"] == 9.52
+
+    matched = filter_transactions(df, parse_transaction_filters("debits over $40"))
+    assert len(matched) == 2
+
+
+def test_yearless_leap_day_takes_the_statement_year():
+    dates, failed = parse_dates(pd.Series(["01/15/2024", "02/29", "03/01"]))
+    assert dates.dt.strftime("%Y-%m-%d").tolist() == ["2024-01-15", "2024-02-29", "2024-03-01"]
+    assert not failed.any()
+
+
+def test_one_day_month_convention_per_document():
+    # 25/01 only reads day first, so 03/02 must too, not as March 2
+    dates, failed = parse_dates(pd.Series(["25/01/2024", "13/01/2024", "03/02/2024"]))
+    assert dates.dt.strftime("%Y-%m-%d").tolist() == ["2024-01-25", "2024-01-13", "2024-02-03"]
+    assert not failed.any()
+
+    # A month-first statement flags a row that only reads day first instead of mixing conventions
+    dates, failed = parse_dates(pd.Series(["01/25/2024", "02/13/2024", "25/02/2024"]))
+    assert dates.dt.strftime("%Y-%m-%d").tolist()[:2] == ["2024-01-25", "2024-02-13"]
+    assert failed.tolist() == [False, False, True]
@@ -0,0 +1,48 @@
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from app.api.routes import conversation
+from app.core.config import settings
+from app.core.uploads import MULTIPART_OVERHEAD_BYTES, UploadSizeLimitMiddleware
+
+
+def make_client(monkeypatch, limit: int) -> tuple[TestClient, list]:
+    monkeypatch.setattr(settings, "max_upload_bytes", limit)
+    submitted = []
+
+    async def fake_submit_upload(file):
+        submitted.append(file.filename)
+        return 202, {"id": file.filename, "stage": "queued"}
+
+    monkeypatch.setattr(conversation, "submit_upload", fake_submit_upload)
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware)
+    app.include_router(conversation.router)
+    return TestClient(app), submitted
+
+
+def test_declared_oversized_upload_is_rejected_before_parsing(monkeypatch):
+    client, submitted = make_client(monkeypatch, 1024)
+    response = client.post("/submit", files={"file": ("big.pdf", b"x" * (1024 + MULTIPART_OVERHEAD_BYTES + 1))})
+    assert response.status_code == 413
+    assert "limit" in response.json()["message"]
+    assert submitted == []
+
+
+def test_chunked_oversized_upload_is_cut_off(monkeypatch):
+    client, submitted = make_client(monkeypatch, 1024)
+
+    def body():
+        for _ in range(200):
+            yield b"x" * 1024
+
+    response = client.post("/submit", content=body(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert submitted == []
+
+
+def test_upload_within_limit_reaches_the_route(monkeypatch):
+    client, submitted = make_client(monkeypatch, 1024)
+    response = client.post("/submit", files={"file": ("small.pdf", b"x" * 512)})
+    assert response.status_code == 202
+    assert submitted == ["small.pdf"]
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.upstream import Priority, UpstreamBusyError, UpstreamScheduler
+from benchmarks.fakes import FakeRateLimitError
+
+
+def wait_until_queued(scheduler: UpstreamScheduler, count: int):
+    deadline = time.monotonic() + 5
+    while scheduler.stats()["queued"] < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert scheduler.stats()["queued"] == count
+
+
+def test_waiters_are_admitted_by_priority():
+    scheduler = UpstreamScheduler("test", max_concurrency=1)
+    grant = scheduler.acquire(1, Priority.INTERACTIVE)
+    admitted = []
+
+    def wait(level):
+        grant = scheduler.acquire(1, level)
+        admitted.append(level)
+        scheduler.release(grant)
+
+    threads = [threading.Thread(target=wait, args=(level,)) for level in (Priority.BATCH, Priority.INTERACTIVE)]
+    # Batch queues first, so arrival order alone would admit it first
+    for queued, thread in enumerate(threads, 1):
+        thread.start()
+        wait_until_queued(scheduler, queued)
+    scheduler.release(grant)
+    for thread in threads:
+        thread.join()
+    assert admitted == [Priority.INTERACTIVE, Priority.BATCH]
+
+
+def test_reserved_slots_only_go_to_interactive_calls():
+    scheduler = UpstreamScheduler("test", max_concurrency=2, reserved=1)
+    batch = scheduler.acquire(1, Priority.BATCH)
+    queued = threading.Thread(target=lambda: scheduler.release(scheduler.acquire(1, Priority.BATCH)))
+    queued.start()
+    wait_until_queued(scheduler, 1)
+
+    # The second batch call waits while the reserved slot still admits a chat
+    interactive = scheduler.acquire(1, Priority.INTERACTIVE)
+    assert scheduler.stats() == {"in_flight": 2, "queued": 1, "tokens_last_minute": 0}
+
+    scheduler.release(interactive)
+    scheduler.release(batch)
+    queued.join()
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_identical_calls_in_flight_share_one_request():
+    scheduler = UpstreamScheduler("test", max_concurrency=4)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*[scheduler.acall(fetch, key="same") for _ in range(3)])
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert len(calls) == 1
+
+
+def test_rate_limited_calls_are_retried_then_reported_busy():
+    scheduler = UpstreamScheduler("test", max_concurrency=1, max_retries=2, base_delay=0.001, max_delay=0.001)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise FakeRateLimitError()
+        return "ok"
+
+    assert scheduler.call(flaky) == "ok"
+    assert len(attempts) == 2
+
+    def always_limited():
+        raise FakeRateLimitError()
+
+    with pytest.raises(UpstreamBusyError) as error:
+        scheduler.call(always_limited)
+    assert error.value.status_code == 429
+    assert scheduler.stats()["in_flight"] == 0
@@ -50,55 +50,19 @@ export default function ConversationPage() {
   }
 
   const [showPdf, setShowPdf] = useState(true);
-  const [transactionTables, setTables] = useState([]);
   const [showInsights, setShowInsights] = useState(false);
   const [insightsLoading, setInsightsLoading] = useState(false);
   const [insightsData, setInsightsData] = useState([]);
 
-  async function getTransactionData() {
-    try {
-      const myHeaders = new Headers();
-      myHeaders.append("accept", "application/json");
-      myHeaders.append("Content-Type", "application/json");
-      const response = await fetch("http://127.0.0.1:8000/api/v1/get_tables", {
-        method: "POST",
-        body: JSON.stringify({
-          id: file?.id,
-        }),
-        headers: myHeaders,
-      });
-
-      if (!response.ok) {
-        return;
-      }
-
-      const data = await response.json();
-      const tables = data["result"];
-      let tableData = [];
-      if (Array.isArray(tables)) {
-        tableData = tables.map((table) => JSON.parse(table));
-      } else {
-        tableData = JSON.parse(tables);
-      }
-      setTables(tableData);
-    } catch (error) {
-      console.error("Error fetching transaction data: ", error);
-    }
-  }
-
   const fetchFinancialData = async () => {
     try {
       setInsightsLoading(true);
       const myHeaders = new Headers();
       myHeaders.append("accept", "application/json");
-      myHeaders.append("Content-Type", "application/json");
+      // A GET, so repeat visits are served from the browser cache
       const response = await fetch(
-        "http://127.0.0.1:8000/api/v1/get_insights",
+        `http://127.0.0.1:8000/api/v1/documents/${file?.id}/insights`,
         {
-          method: "POST",
-          body: JSON.stringify({
-            id: file?.id,
-          }),
           headers: myHeaders,
         }
       );
@@ -116,7 +80,6 @@ export default function ConversationPage() {
   };
 
   useEffect(() => {
-    getTransactionData();
     fetchFinancialData();
   }, []);
 
@@ -240,10 +203,7 @@ export default function ConversationPage() {
                 <div className="h-1 w-32 bg-casca-500 mx-auto rounded-full"></div>
               </div>
               <div className="flex-grow overflow-auto container mx-auto py-10 bg-white/50 backdrop-blur rounded-lg shadow-lg">
-                {transactionTables &&
-                  transactionTables.map((table, idx) => {
-                    return <DynamicDataTable key={idx} data={table} />;
-                  })}
+                {file?.id && <DynamicDataTable documentId={file.id} />}
               </div>
             </div>
           )}
@@ -20,6 +20,23 @@ import Slideshow from "@/components/Slideshow";
 import { motion, AnimatePresence } from "framer-motion";
 import { UploadFile } from "./context/fileContext";
 
+async function waitForIngestion(id: string) {
+  // /submit returns as soon as the job is queued; poll until it is ingested
+  while (true) {
+    const response = await fetch(`http://127.0.0.1:8000/api/v1/jobs/${id}`);
+    if (!response.ok) {
+      throw new Error("Failed to fetch ingestion status");
+    }
+    const job: { stage: string; progress: number; error: string | null } =
+      await response.json();
+    if (job.stage === "done") return;
+    if (job.stage === "failed") {
+      throw new Error(job.error ?? "Ingestion failed");
+    }
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+}
+
 function base64ToFile(base64, filename, mimeType) {
   const byteString = atob(base64.split(",")[1]); // Remove the data URI part
   const arrayBuffer = new ArrayBuffer(byteString.length);
@@ -127,8 +144,11 @@ function Home() {
         throw new Error("File upload failed");
       }
 
-      const result: { id: string } = await response.json();
+      const result: { id: string; stage: string } = await response.json();
       console.log("Upload successful:", result);
+      if (result.stage !== "done") {
+        await waitForIngestion(result.id);
+      }
       setFile((prev) => {
         return {
           ...prev,
@@ -42,25 +42,58 @@ export default function CustomChat({ id }: { id: number }) {
       myHeaders.append("accept", "application/json");
       myHeaders.append("Content-Type", "application/json");
 
-      const response = await fetch("http://127.0.0.1:8000/api/v1/query", {
-        method: "POST",
-        body: JSON.stringify({
-          id: id,
-          query: text,
-        }),
-        headers: myHeaders,
-      });
-
-      if (!response.ok) {
+      const response = await fetch(
+        "http://127.0.0.1:8000/api/v1/query/stream",
+        {
+          method: "POST",
+          body: JSON.stringify({
+            id: id,
+            query: text,
+          }),
+          headers: myHeaders,
+        }
+      );
+
+      if (!response.ok || !response.body) {
         throw new Error("API request failed");
       }
 
-      const data = await response.json();
-      console.log(data);
-
-      // Add assistant message to the chat
-      const assistantMessage = { role: "assistant", content: data["result"] };
-      setMessages((prevMessages) => [...prevMessages, assistantMessage]);
+      // Add the assistant message on the first token and grow it as tokens stream in
+      let answer = "";
+      let started = false;
+      const updateAnswer = (content: string) => {
+        const replace = started;
+        started = true;
+        setMessages((prevMessages) => [
+          ...(replace ? prevMessages.slice(0, -1) : prevMessages),
+          { role: "assistant", content },
+        ]);
+      };
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-Sent Events are separated by a blank line
+        const events = buffer.split("\n\n");
+        buffer = events.pop() ?? "";
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? "{}");
+          if (event === "sources") {
+            setIsLoading(false);
+          } else if (event === "token") {
+            answer += data["text"];
+            updateAnswer(answer);
+          } else if (event === "error") {
+            throw new Error(data["message"]);
+          }
+        }
+      }
     } catch (error) {
       console.error(error);
       // Optionally, add an error message to the chat
@@ -4,13 +4,11 @@ import * as React from "react";
 import {
   type ColumnDef,
   type ColumnFiltersState,
+  type PaginationState,
   type SortingState,
   type VisibilityState,
   flexRender,
   getCoreRowModel,
-  getFilteredRowModel,
-  getPaginationRowModel,
-  getSortedRowModel,
   useReactTable,
 } from "@tanstack/react-table";
 
@@ -30,25 +28,40 @@ import {
   DropdownMenuTrigger,
 } from "@/components/ui/dropdown-menu";
 import { Input } from "@/components/ui/input";
-import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
-import {
-  ChevronDown,
-  Search,
-  CreditCard,
-  DollarSign,
-  Wallet,
-  Receipt,
-} from "lucide-react";
+import { ArrowDown, ArrowUp, ChevronDown, Search, Receipt } from "lucide-react";
+
+const DOCUMENTS_URL = "http://127.0.0.1:8000/api/v1/documents";
+
+type Row = Record<string, any>;
+
+interface TablePage {
+  columns: string[];
+  data: Record<string, any[]>;
+  page: number;
+  page_size: number;
+  total_rows: number;
+  total_pages: number;
+}
 
-interface DynamicDataTableProps<TData> {
-  data: TData[];
+interface DynamicDataTableProps {
+  documentId: string;
   title?: string;
+  pageSize?: number;
 }
 
-export function DynamicDataTable<TData extends Record<string, any>>({
-  data,
+// The server sends one page column by column; only that page is turned into rows
+function toRows(page: TablePage): Row[] {
+  const length = page.columns.length ? page.data[page.columns[0]].length : 0;
+  return Array.from({ length }, (_, i) =>
+    Object.fromEntries(page.columns.map((column) => [column, page.data[column][i]]))
+  );
+}
+
+export function DynamicDataTable({
+  documentId,
   title,
-}: DynamicDataTableProps<TData>) {
+  pageSize = 50,
+}: DynamicDataTableProps) {
   const [sorting, setSorting] = React.useState<SortingState>([]);
   const [columnFilters, setColumnFilters] = React.useState<ColumnFiltersState>(
     []
@@ -56,10 +69,60 @@ export function DynamicDataTable<TData extends Record<string, any>>({
   const [columnVisibility, setColumnVisibility] =
     React.useState<VisibilityState>({});
   const [rowSelection, setRowSelection] = React.useState({});
+  const [pagination, setPagination] = React.useState<PaginationState>({
+    pageIndex: 0,
+    pageSize,
+  });
+  const [page, setPage] = React.useState<TablePage | null>(null);
 
-  const columns: ColumnDef<TData>[] = React.useMemo(() => {
-    if (data.length === 0) return [];
-    return Object.keys(data[0]).map((key) => ({
+  React.useEffect(() => {
+    const controller = new AbortController();
+    // Wait for a pause in typing before filtering on the server
+    const timer = setTimeout(async () => {
+      try {
+        // A GET, so the browser caches pages and revalidates them by ETag
+        const params = new URLSearchParams({
+          page: String(pagination.pageIndex + 1),
+          page_size: String(pagination.pageSize),
+        });
+        if (sorting[0]) {
+          params.set("sort_by", sorting[0].id);
+          params.set("descending", String(sorting[0].desc));
+        }
+        columnFilters.forEach((filter) =>
+          params.append("filter", `${filter.id}:${String(filter.value)}`)
+        );
+        const response = await fetch(
+          `${DOCUMENTS_URL}/${encodeURIComponent(documentId)}/tables?${params}`,
+          {
+            headers: { accept: "application/json" },
+            signal: controller.signal,
+          }
+        );
+        if (!response.ok) {
+          return;
+        }
+        setPage(await response.json());
+      } catch (error) {
+        if (!controller.signal.aborted) {
+          console.error("Error fetching transaction data: ", error);
+        }
+      }
+    }, columnFilters.length ? 300 : 0);
+
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [documentId, pagination, sorting, columnFilters]);
+
+  const data = React.useMemo(() => (page ? toRows(page) : []), [page]);
+
+  // Rebuilt only when the set of columns changes, not on every page
+  const columnNames = page ? page.columns.join("\n") : "";
+  const columns: ColumnDef<Row>[] = React.useMemo(() => {
+    if (!columnNames) return [];
+    return columnNames.split("\n").map((key) => ({
       accessorKey: key,
       header: key.charAt(0).toUpperCase() + key.slice(1),
       cell: ({ row }) => {
@@ -67,17 +130,25 @@ export function DynamicDataTable<TData extends Record<string, any>>({
         return typeof value === "boolean" ? value.toString() : value;
       },
     }));
-  }, [data]);
+  }, [columnNames]);
 
   const table = useReactTable({
     data,
     columns,
-    onSortingChange: setSorting,
-    onColumnFiltersChange: setColumnFilters,
+    pageCount: page?.total_pages ?? -1,
+    manualPagination: true,
+    manualSorting: true,
+    manualFiltering: true,
+    onSortingChange: (updater) => {
+      setSorting(updater);
+      setPagination((p) => ({ ...p, pageIndex: 0 }));
+    },
+    onColumnFiltersChange: (updater) => {
+      setColumnFilters(updater);
+      setPagination((p) => ({ ...p, pageIndex: 0 }));
+    },
+    onPaginationChange: setPagination,
     getCoreRowModel: getCoreRowModel(),
-    getPaginationRowModel: getPaginationRowModel(),
-    getSortedRowModel: getSortedRowModel(),
-    getFilteredRowModel: getFilteredRowModel(),
     onColumnVisibilityChange: setColumnVisibility,
     onRowSelectionChange: setRowSelection,
     state: {
@@ -85,25 +156,10 @@ export function DynamicDataTable<TData extends Record<string, any>>({
       columnFilters,
       columnVisibility,
       rowSelection,
+      pagination,
     },
   });
 
-  const { totalCredit, totalDebit, balance } = React.useMemo(() => {
-    let credit = 0;
-    let debit = 0;
-    data.forEach((row) => {
-      const creditAmount = Number.parseFloat(row.Credit) || 0;
-      const debitAmount = Number.parseFloat(row.Debit) || 0;
-      credit += creditAmount;
-      debit += debitAmount;
-    });
-    return {
-      totalCredit: credit.toFixed(2),
-      totalDebit: debit.toFixed(2),
-      balance: (credit - debit).toFixed(2),
-    };
-  }, [data]);
-
   return (
     <div className="h-full w-full max-w-6xl mx-auto p-6 space-y-8">
       {title && (
@@ -116,36 +172,6 @@ export function DynamicDataTable<TData extends Record<string, any>>({
         </div>
       )}
 
-      {/* <div className="grid gap-4 md:grid-cols-3">
-        <Card>
-          <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
-            <CardTitle className="text-sm font-medium">Total Credit</CardTitle>
-            <CreditCard className="h-4 w-4 text-muted-foreground" />
-          </CardHeader>
-          <CardContent>
-            <div className="text-2xl font-bold">${totalCredit}</div>
-          </CardContent>
-        </Card>
-        <Card>
-          <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
-            <CardTitle className="text-sm font-medium">Total Debit</CardTitle>
-            <DollarSign className="h-4 w-4 text-muted-foreground" />
-          </CardHeader>
-          <CardContent>
-            <div className="text-2xl font-bold">${totalDebit}</div>
-          </CardContent>
-        </Card>
-        <Card>
-          <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
-            <CardTitle className="text-sm font-medium">Balance</CardTitle>
-            <Wallet className="h-4 w-4 text-muted-foreground" />
-          </CardHeader>
-          <CardContent>
-            <div className="text-2xl font-bold">${balance}</div>
-          </CardContent>
-        </Card>
-      </div> */}
-
       <div className="flex flex-col sm:flex-row items-center justify-between gap-4 py-4">
         <div className="relative w-full sm:w-72">
           <Search className="absolute left-2 top-2.5 h-4 w-4 text-muted-foreground" />
@@ -194,13 +220,25 @@ export function DynamicDataTable<TData extends Record<string, any>>({
               <TableRow key={headerGroup.id}>
                 {headerGroup.headers.map((header) => {
                   return (
-                    <TableHead key={header.id} className="font-semibold">
-                      {header.isPlaceholder
-                        ? null
-                        : flexRender(
-                            header.column.columnDef.header,
-                            header.getContext()
-                          )}
+                    <TableHead
+                      key={header.id}
+                      className="font-semibold cursor-pointer select-none"
+                      onClick={header.column.getToggleSortingHandler()}
+                    >
+                      <div className="flex items-center gap-1">
+                        {header.isPlaceholder
+                          ? null
+                          : flexRender(
+                              header.column.columnDef.header,
+                              header.getContext()
+                            )}
+                        {header.column.getIsSorted() === "asc" && (
+                          <ArrowUp className="h-3 w-3" />
+                        )}
+                        {header.column.getIsSorted() === "desc" && (
+                          <ArrowDown className="h-3 w-3" />
+                        )}
+                      </div>
                     </TableHead>
                   );
                 })}
@@ -239,8 +277,8 @@ export function DynamicDataTable<TData extends Record<string, any>>({
       </div>
       <div className="flex flex-col sm:flex-row items-center justify-between gap-4 py-4">
         <div className="text-sm text-muted-foreground">
-          {table.getFilteredSelectedRowModel().rows.length} of{" "}
-          {table.getFilteredRowModel().rows.length} row(s) selected.
+          Page {pagination.pageIndex + 1} of {page?.total_pages ?? 1} ·{" "}
+          {page?.total_rows ?? 0} transaction(s)
         </div>
         <div className="flex justify-end space-x-2">
           <Button